@@ -0,0 +1,719 @@
+#!/usr/bin/env python
+
+"""
+Benchmark harness for the QUBEKit pipeline.
+Runs the Main.execute stages over a series of reference molecules of increasing size using the fake QM engine,
+so the Python overhead and file I/O of the pipeline can be measured without any QM software.
+Wall time, CPU time and peak (traced) memory are recorded for each stage and for each hot function;
+results are stored as JSON and can be compared against a stored baseline to flag regressions.
+
+Small isolated benchmarks (parsers, pickling etc.) can be added to the micro_benchmarks registry with @micro_benchmark.
+Those whose input does not depend on the reference molecule size (large tiled pdb files, a long chain) are registered
+with large=True; their inputs are built once per run and they are recorded once, under 'large'.
+"""
+
+from QUBEKit.run import Main
+from QUBEKit import run
+from QUBEKit.ligand import Molecule, Ligand, Protein
+from QUBEKit.engines import PSI4, Chargemol, FakeQM
+from QUBEKit.mod_seminario import ModSeminario
+from QUBEKit.lennard_jones import LennardJones
+from QUBEKit.dihedrals import TorsionScan
+from QUBEKit.helpers import Configure, unpickle
+from QUBEKit.readers import PDBFile
+
+import argparse
+from argparse import Namespace
+from collections import OrderedDict
+from copy import deepcopy
+from datetime import datetime
+from functools import partial
+from json import dump, load
+from os import chdir, getcwd
+from platform import python_version, node
+from sys import exit as sys_exit
+from tempfile import TemporaryDirectory
+from time import perf_counter, process_time
+import tracemalloc
+
+
+# Stages which can run with the fake engine alone; parametrise, mm_optimise, torsion_optimise and finalise
+# need OpenFF / AnteChamber, geomeTRIC, OpenMM and RDKit and can be added with -stages when those are installed.
+default_stages = ['qm_optimise', 'hessian', 'mod_sem', 'density', 'charges', 'lennard_jones', 'torsion_scan']
+
+# Number of carbons in each reference alcohol CnH(2n+1)OH; the molecules have 3n + 3 atoms
+default_sizes = [2, 4, 8, 16]
+
+# Rough size of the tiled pdb used by the large file benchmarks (the pdb format allows at most 99999 atoms)
+large_pdb_atoms = 50000
+
+# Carbons in the reference alcohol tiled to make the large pdb, and in the long chain
+large_reference_carbons = 8
+chain_carbons = 750
+
+# Functions timed inside the stages as (owner, attribute name) pairs
+hot_functions = [
+    (Ligand, 'pickle'), (run, 'unpickle'), (Ligand, 'read_xyz'),
+    (FakeQM, 'generate_input'), (FakeQM, 'geo_gradient'), (FakeQM, 'drive_torsion'), (FakeQM, 'ddec'),
+    (Chargemol, 'generate_input'), (Chargemol, 'cache_key'), (Chargemol, 'save_cache'),
+    (PSI4, 'hessian'), (PSI4, 'all_modes'),
+    (ModSeminario, 'modified_seminario_method'), (ModSeminario, 'calculate_bonds'),
+    (ModSeminario, 'calculate_angles'),
+    (LennardJones, 'extract_params_chargemol'), (LennardJones, 'calculate_sig_eps'),
+    (LennardJones, 'correct_polar_hydrogens'), (LennardJones, 'apply_symmetrisation'),
+    (TorsionScan, 'get_energy'),
+]
+
+# name: function(pdb_file) which does any setup then returns the zero argument callable to be timed
+micro_benchmarks = OrderedDict()
+
+# name: function(inputs) like the micro benchmarks, given the shared large inputs (see large_inputs)
+large_benchmarks = OrderedDict()
+
+# Metrics compared against the baseline with the smallest change (seconds or MB) which counts as a regression
+metric_floors = {'wall': 0.01, 'cpu': 0.01, 'peak_mb': 1.0}
+
+# reset_peak arrived in python 3.9; without it nested blocks report the peak since their stage began
+reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+def micro_benchmark(name, large=False):
+    """
+    Decorator which adds a setup function to the micro_benchmarks registry under name,
+    or to the large_benchmarks registry if large is True.
+    """
+
+    def register(func):
+        (large_benchmarks if large else micro_benchmarks)[name] = func
+        return func
+
+    return register
+
+
+class Recorder:
+    """
+    Accumulates the number of calls, wall time, CPU time and peak traced memory of named blocks of code.
+    Blocks can be nested (hot functions inside stages); the peak memory of a block is the highest traced
+    allocation above the memory in use when the block started. Memory is traced while the outermost block runs.
+    """
+
+    def __init__(self, memory=True):
+
+        self.memory = memory
+        self.results = OrderedDict()
+        self.open_blocks = []
+
+    def fold_peak(self):
+        """Push the peak since the last reset into every open block, then reset the peak."""
+
+        peak = tracemalloc.get_traced_memory()[1]
+        for block in self.open_blocks:
+            block['peak'] = max(block['peak'], peak)
+
+        if reset_peak is not None:
+            reset_peak()
+
+    def measure(self, name, func, *args, **kwargs):
+        """Call func(*args, **kwargs) and record its cost under name."""
+
+        outermost = self.memory and not self.open_blocks
+        if outermost:
+            tracemalloc.start()
+
+        if self.memory:
+            self.fold_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            block = {'start': current, 'peak': current}
+            self.open_blocks.append(block)
+
+        wall, cpu = perf_counter(), process_time()
+
+        try:
+            return func(*args, **kwargs)
+
+        finally:
+            wall, cpu = perf_counter() - wall, process_time() - cpu
+
+            peak = None
+            if self.memory:
+                self.fold_peak()
+                self.open_blocks.pop()
+                peak = (block['peak'] - block['start']) / 2 ** 20
+
+            if outermost:
+                tracemalloc.stop()
+
+            self.record(name, wall, cpu, peak)
+
+    def record(self, name, wall, cpu, peak):
+        """Add one call to the totals for name."""
+
+        entry = self.results.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_mb': None})
+
+        entry['calls'] += 1
+        entry['wall'] += wall
+        entry['cpu'] += cpu
+        if peak is not None:
+            entry['peak_mb'] = peak if entry['peak_mb'] is None else max(entry['peak_mb'], peak)
+
+    def wrap(self, name, func):
+        """Return func wrapped so every call is measured under name."""
+
+        def wrapper(*args, **kwargs):
+            return self.measure(name, func, *args, **kwargs)
+
+        return wrapper
+
+    def patch(self, functions):
+        """
+        Replace each (owner, attribute) function with a measured version.
+        Returns the list needed by restore() to put the originals back.
+        """
+
+        originals = []
+        for owner, attr in functions:
+            inherited = attr not in vars(owner)
+            original = getattr(owner, attr)
+            originals.append((owner, attr, original, inherited))
+
+            setattr(owner, attr, self.wrap(f'{owner.__name__.split(".")[-1]}.{attr}', original))
+
+        return originals
+
+    @staticmethod
+    def restore(originals):
+        """Undo patch()."""
+
+        for owner, attr, original, inherited in reversed(originals):
+            if inherited:
+                delattr(owner, attr)
+            else:
+                setattr(owner, attr, original)
+
+
+def alkanol_pdb(carbons, filename):
+    """
+    Write a pdb file (with CONECT records) of the straight chain alcohol CnH(2n+1)OH in an all trans zigzag.
+    These are the reference molecules: cheap to make at any size, and every C-C and C-O bond
+    away from the methyl is a rotatable torsion.
+    """
+
+    # Zigzag backbone: heavy atoms alternate between y = 0 and y = 0.883 (1.53 angstrom bonds, tetrahedral angles)
+    backbone = [('C', 1.249 * i, 0.883 * (i % 2)) for i in range(carbons)] + [('O', 1.249 * carbons,
+                                                                             0.883 * (carbons % 2))]
+
+    atoms, bonds = [], []
+    for i, (element, x, y) in enumerate(backbone):
+        atoms.append([element, x, y, 0.0])
+        if i:
+            bonds.append((i, i + 1))
+
+    for i, (element, x, y) in enumerate(backbone):
+        # Hydrogens point away from the chain on the opposite side to the neighbouring backbone atoms
+        side = -1 if i % 2 == 0 else 1
+        if element == 'C':
+            hydrogens = [(x, y + 0.63 * side, 0.89), (x, y + 0.63 * side, -0.89)]
+            if i == 0:
+                hydrogens.append((x - 1.03, y - 0.36 * side, 0.0))
+        else:
+            hydrogens = [(x + 0.32, y + 0.9 * side, 0.0)]
+
+        for coords in hydrogens:
+            atoms.append(['H', *coords])
+            bonds.append((i + 1, len(atoms)))
+
+    with open(filename, 'w+') as pdb:
+        for i, (element, x, y, z) in enumerate(atoms, 1):
+            # Names wrap after atom 999 so they stay within the four name columns
+            name = f'{element}{i % 1000 if i > 999 else i}'
+            pdb.write(f'HETATM{i:>5} {name:>4} UNL     1    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00          {element:>2}\n')
+
+        connections = OrderedDict((i, []) for i in range(1, len(atoms) + 1))
+        for a, b in bonds:
+            connections[a].append(b)
+            connections[b].append(a)
+
+        for atom, bonded in connections.items():
+            pdb.write(f'CONECT{atom:>5}' + ''.join(f'{other:>5}' for other in bonded) + '\n')
+
+        pdb.write('END\n')
+
+    return len(atoms)
+
+
+def tiled_pdb(pdb_file, filename, atoms=large_pdb_atoms):
+    """
+    Write a large protein style pdb file (ATOM records, one residue per copy, CONECT records) by tiling copies
+    of a reference molecule on a grid until there are at least atoms atoms, like a box of solvated ligands.
+    """
+
+    pdb = PDBFile(pdb_file)
+    size = len(pdb)
+    copies = -(-atoms // size)
+    per_side = int(round(copies ** (1 / 3))) + 1
+    spacing = pdb.coords.max(axis=0) - pdb.coords.min(axis=0) + 3
+
+    with open(filename, 'w+') as large:
+        for copy in range(copies):
+            shift = spacing * [copy % per_side, (copy // per_side) % per_side, copy // per_side ** 2]
+            for i, (name, element, (x, y, z)) in enumerate(zip(pdb.names, pdb.elements, pdb.coords + shift)):
+                large.write(f'ATOM  {copy * size + i + 1:>5} {name:<4} MOL A{copy + 1:>4}    '
+                            f'{x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00          {element:>2}\n')
+
+        for copy in range(copies):
+            offset = copy * size
+            for a, b in pdb.bonds:
+                large.write(f'CONECT{a + offset:>5}{b + offset:>5}\n')
+
+        large.write('END\n')
+
+    return copies * size
+
+
+def benchmark_configs():
+    """The default configs with every engine switched to the fake one."""
+
+    qm, fitting, descriptions = (deepcopy(config) for config in Configure.load_config())
+
+    qm.update({'bonds_engine': 'fake', 'density_engine': 'fake', 'charges_engine': 'chargemol',
+               'geometric': True, 'solvent': False, 'ddec_version': 6})
+    descriptions['log'] = 'BENCHMARK'
+
+    defaults = {'charge': 0, 'multiplicity': 1, 'config': 'default_config'}
+
+    return [defaults, qm, fitting, descriptions]
+
+
+def build_main(pdb_file, stages, all_configs):
+    """
+    Make a Main instance for pdb_file without the command line parsing or config prompts of Main.__init__,
+    which will only run the given stages.
+    """
+
+    main = Main.__new__(Main)
+
+    main.file = pdb_file
+    main.log_file = 'QUBEKit_log.txt'
+    main.args = Namespace(combination='opls', mm_opt_method='openmm', restart=None, skip=None, end=None)
+    main.engine_dict = {'fake': FakeQM}
+
+    main.all_configs = all_configs
+    main.defaults_dict, main.qm, main.fitting, main.descriptions = all_configs
+
+    main.order = OrderedDict((stage, getattr(main, stage)) for stage in stages)
+
+    return main
+
+
+def run_pipeline(pdb_file, stages, recorder):
+    """
+    Run the stages over one molecule in the current folder, measuring each stage and the whole of execute.
+    The stages before the first one requested are stood in for: the input structure is used as the
+    MM structure and every rotatable torsion is scanned.
+    """
+
+    all_configs = benchmark_configs()
+    main = build_main(pdb_file, stages, all_configs)
+    main.create_log()
+
+    molecule = Ligand(pdb_file)
+    molecule.molecule['mm'] = deepcopy(molecule.molecule['input'])
+    molecule.scan_order = list(molecule.rotatable)
+    molecule.pickle(state=stages[0])
+
+    for stage in stages:
+        main.order[stage] = recorder.wrap(stage, main.order[stage])
+
+    # Each run caches its DDEC results in its own folder, so every repeat partitions the charges again
+    # and nothing is left in the user's cache
+    cache_folder, Configure.cache_folder = Configure.cache_folder, f'{getcwd()}/QUBEKit_cache/'
+
+    originals = recorder.patch(hot_functions)
+    try:
+        recorder.measure('total', main.execute)
+    finally:
+        recorder.restore(originals)
+        Configure.cache_folder = cache_folder
+
+
+def combine(repeats):
+    """Best (minimum) times and the largest peak memory over repeated Recorder results."""
+
+    combined = OrderedDict()
+    for results in repeats:
+        for name, entry in results.items():
+            if name not in combined:
+                combined[name] = dict(entry)
+                continue
+
+            best = combined[name]
+            best['wall'] = min(best['wall'], entry['wall'])
+            best['cpu'] = min(best['cpu'], entry['cpu'])
+            if entry['peak_mb'] is not None:
+                best['peak_mb'] = entry['peak_mb'] if best['peak_mb'] is None else max(best['peak_mb'], entry['peak_mb'])
+
+    return combined
+
+
+def benchmark_molecule(carbons, stages, repeats=3, memory=True):
+    """Benchmark the pipeline stages on one reference molecule; each repeat runs in a fresh temporary folder."""
+
+    name = f'alkanol_{carbons:02d}'
+    home = getcwd()
+
+    runs, atoms = [], 0
+    for _ in range(repeats):
+        recorder = Recorder(memory=memory)
+        with TemporaryDirectory() as temp:
+            chdir(temp)
+            try:
+                atoms = alkanol_pdb(carbons, f'{name}.pdb')
+                run_pipeline(f'{name}.pdb', stages, recorder)
+            finally:
+                chdir(home)
+        runs.append(recorder.results)
+
+    combined = combine(runs)
+
+    return name, OrderedDict([
+        ('atoms', atoms),
+        ('total', combined.pop('total')),
+        ('stages', OrderedDict((stage, combined.pop(stage)) for stage in stages if stage in combined)),
+        ('functions', combined)])
+
+
+def benchmark_micro(carbons, repeats=3, memory=True):
+    """Run every registered micro benchmark on one reference molecule."""
+
+    home = getcwd()
+    recorder_runs = []
+
+    for _ in range(repeats):
+        recorder = Recorder(memory=memory)
+        with TemporaryDirectory() as temp:
+            chdir(temp)
+            try:
+                name = f'alkanol_{carbons:02d}'
+                alkanol_pdb(carbons, f'{name}.pdb')
+                for bench_name, setup in micro_benchmarks.items():
+                    recorder.measure(bench_name, setup(f'{name}.pdb'))
+            finally:
+                chdir(home)
+        recorder_runs.append(recorder.results)
+
+    return combine(recorder_runs)
+
+
+def large_inputs():
+    """
+    Build the inputs of the large benchmarks in the current folder: a tiled pdb file (large.pdb) of about
+    large_pdb_atoms atoms and the pdb of a C750 alcohol chain (chain.pdb), with the molecules read from them.
+    The large benchmarks copy the molecules rather than reading the files again.
+    """
+
+    alkanol_pdb(large_reference_carbons, 'reference.pdb')
+    tiled_pdb('reference.pdb', 'large.pdb')
+    alkanol_pdb(chain_carbons, 'chain.pdb')
+
+    chain = Molecule('chain.pdb')
+    chain.read_pdb()
+
+    return {'large_pdb': 'large.pdb', 'protein': Protein('large.pdb'), 'chain': chain}
+
+
+def benchmark_large(repeats=3, memory=True):
+    """Run every registered large benchmark, building their inputs only once."""
+
+    home = getcwd()
+    recorder_runs = []
+
+    with TemporaryDirectory() as temp:
+        chdir(temp)
+        try:
+            inputs = large_inputs()
+            for _ in range(repeats):
+                recorder = Recorder(memory=memory)
+                for bench_name, setup in large_benchmarks.items():
+                    recorder.measure(bench_name, setup(inputs))
+                recorder_runs.append(recorder.results)
+        finally:
+            chdir(home)
+
+    return combine(recorder_runs)
+
+
+def benchmark(sizes=None, stages=None, repeats=3, memory=True, micro=True, pipeline=True):
+    """Run the whole suite and return the results dictionary ready to be stored as JSON."""
+
+    sizes = sizes if sizes is not None else default_sizes
+    stages = stages if stages is not None else default_stages
+
+    results = OrderedDict([
+        ('date', datetime.now().isoformat(timespec='seconds')),
+        ('machine', node()),
+        ('python', python_version()),
+        ('repeats', repeats),
+        ('memory', memory),
+        ('stages', stages),
+        ('molecules', OrderedDict()),
+        ('micro', OrderedDict()),
+        ('large', OrderedDict())])
+
+    for carbons in sizes:
+        if pipeline:
+            name, data = benchmark_molecule(carbons, stages, repeats, memory)
+            results['molecules'][name] = data
+
+        if micro and micro_benchmarks:
+            results['micro'][f'alkanol_{carbons:02d}'] = benchmark_micro(carbons, repeats, memory)
+
+    if micro and large_benchmarks:
+        results['large'] = benchmark_large(repeats, memory)
+
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Compare results against a baseline made with the same suite.
+    A metric regresses when it is more than tolerance (fractional) worse than the baseline
+    and the difference is larger than the floor for that metric (which hides timer noise in tiny functions).
+    Returns a list of (molecule, section, name, metric, baseline value, new value).
+    """
+
+    def entries(data):
+        """Flatten the results into {(molecule, section, name): entry}."""
+
+        flat = {}
+        for molecule, mol_data in data['molecules'].items():
+            flat[(molecule, 'total', 'total')] = mol_data['total']
+            for section in ['stages', 'functions']:
+                for name, entry in mol_data[section].items():
+                    flat[(molecule, section, name)] = entry
+
+        for molecule, micro in data.get('micro', {}).items():
+            for name, entry in micro.items():
+                flat[(molecule, 'micro', name)] = entry
+
+        for name, entry in data.get('large', {}).items():
+            flat[('large', 'micro', name)] = entry
+
+        return flat
+
+    old_entries = entries(baseline)
+    regressions = []
+
+    for key, new in entries(results).items():
+        old = old_entries.get(key)
+        if old is None:
+            continue
+
+        for metric, floor in metric_floors.items():
+            if old.get(metric) is None or new.get(metric) is None:
+                continue
+
+            if new[metric] > old[metric] * (1 + tolerance) and new[metric] - old[metric] > floor:
+                regressions.append((*key, metric, old[metric], new[metric]))
+
+    return regressions
+
+
+def print_results(results):
+    """Print a table of the stage timings for each molecule."""
+
+    for molecule, data in results['molecules'].items():
+        print(f'\n{molecule} ({data["atoms"]} atoms)')
+        print(f'  {"stage / function":<45}{"calls":>7}{"wall / s":>12}{"cpu / s":>12}{"peak / MB":>12}')
+
+        rows = [('total', data['total'])] + list(data['stages'].items()) + list(data['functions'].items())
+        for name, entry in rows:
+            peak = f'{entry["peak_mb"]:12.3f}' if entry['peak_mb'] is not None else f'{"-":>12}'
+            print(f'  {name:<45}{entry["calls"]:>7}{entry["wall"]:12.4f}{entry["cpu"]:12.4f}{peak}')
+
+    for molecule, micro in results['micro'].items():
+        print(f'\nMicro benchmarks on {molecule}')
+        for name, entry in micro.items():
+            print(f'  {name:<45}{entry["wall"]:12.6f} s')
+
+    if results.get('large'):
+        print('\nLarge benchmarks')
+        for name, entry in results['large'].items():
+            print(f'  {name:<45}{entry["wall"]:12.6f} s')
+
+
+@micro_benchmark('read_pdb')
+def bench_read_pdb(pdb_file):
+    """Build a Ligand from the pdb file, including the topology and internal coordinate analysis."""
+
+    return partial(Ligand, pdb_file)
+
+
+@micro_benchmark('pickle_round_trip')
+def bench_pickle(pdb_file):
+    """Pickle a Ligand into the states folder and read that state back."""
+
+    molecule = Ligand(pdb_file)
+
+    def round_trip():
+        molecule.pickle(state='benchmark')
+        unpickle('benchmark')
+
+    return round_trip
+
+
+@micro_benchmark('psi4_hessian_parse')
+def bench_hessian_parse(pdb_file):
+    """Parse the Hessian and modes from a psi4 output.dat file."""
+
+    molecule = Ligand(pdb_file)
+    engine = FakeQM(molecule, benchmark_configs())
+    engine.generate_input(hessian=True)
+
+    def parse():
+        engine.hessian()
+        engine.all_modes()
+
+    return parse
+
+
+@micro_benchmark('internal_coordinates')
+def bench_internal_coordinates(pdb_file):
+    """Measure every bond, angle and dihedral of the molecule."""
+
+    molecule = Ligand(pdb_file)
+
+    def measure():
+        molecule.get_bond_lengths()
+        molecule.get_angle_values()
+        molecule.get_dihedral_values()
+
+    return measure
+
+
+@micro_benchmark('read_large_pdb', large=True)
+def bench_read_large_pdb(inputs):
+    """Read a large tiled pdb file into arrays."""
+
+    return partial(PDBFile, inputs['large_pdb'])
+
+
+@micro_benchmark('protein_read_pdb', large=True)
+def bench_protein_read_pdb(inputs):
+    """Build the protein structure and topology from a large tiled pdb file."""
+
+    return partial(Protein, inputs['large_pdb'])
+
+
+@micro_benchmark('rotatable_bonds')
+def bench_rotatable_bonds(pdb_file):
+    """Find the rotatable bonds of the reference molecule."""
+
+    molecule = Ligand(pdb_file)
+
+    return molecule.find_rotatable_dihedrals
+
+
+@micro_benchmark('rotatable_bonds_chain', large=True)
+def bench_rotatable_bonds_chain(inputs):
+    """Find the rotatable bonds of a long flexible chain (C750 alcohol, 2253 atoms) where every bond is a bridge."""
+
+    molecule = deepcopy(inputs['chain'])
+    molecule.find_dihedrals()
+
+    return molecule.find_rotatable_dihedrals
+
+
+@micro_benchmark('rotatable_bonds_large', large=True)
+def bench_rotatable_bonds_large(inputs):
+    """Find the rotatable bonds of a large tiled pdb file, built like a protein."""
+
+    molecule = deepcopy(inputs['protein'])
+    molecule.find_dihedrals()
+
+    return molecule.find_rotatable_dihedrals
+
+
+@micro_benchmark('bonded_terms_large', large=True)
+def bench_bonded_terms_large(inputs):
+    """Enumerate the angles, dihedrals and impropers of a large tiled pdb file, built like a protein."""
+
+    molecule = deepcopy(inputs['protein'])
+
+    def enumerate_terms():
+        molecule.find_angles()
+        molecule.find_dihedrals()
+        molecule.find_impropers()
+
+    return enumerate_terms
+
+
+@micro_benchmark('internal_coordinates_large', large=True)
+def bench_internal_coordinates_large(inputs):
+    """
+    Measure every bond, angle and dihedral of a large tiled pdb file, built like a protein.
+    Each measurement reads the derived terms many times, so this also times checking them against the topology.
+    """
+
+    molecule = deepcopy(inputs['protein'])
+
+    def measure():
+        molecule.get_bond_lengths()
+        molecule.get_angle_values()
+        molecule.get_dihedral_values()
+
+    return measure
+
+
+def main():
+    """Command line entry point; returns a non-zero exit code if any regressions are found."""
+
+    parser = argparse.ArgumentParser(prog='QUBEKit-bench', description='Benchmark the QUBEKit pipeline with the fake '
+                                                                       'QM engine over reference molecules.')
+    parser.add_argument('-sizes', '--sizes', nargs='+', type=int, default=default_sizes,
+                        help='Number of carbons in each reference alcohol.')
+    parser.add_argument('-stages', '--stages', nargs='+', default=default_stages,
+                        choices=['parametrise', 'mm_optimise', 'qm_optimise', 'hessian', 'mod_sem', 'density',
+                                 'charges', 'lennard_jones', 'torsion_scan', 'torsion_optimise', 'finalise'],
+                        help='Pipeline stages to run, in order.')
+    parser.add_argument('-repeats', '--repeats', type=int, default=3,
+                        help='Repeats of each benchmark; the best time is kept.')
+    parser.add_argument('-output', '--output', default='QUBEKit_benchmarks.json',
+                        help='JSON file to store the results in.')
+    parser.add_argument('-baseline', '--baseline', help='JSON results file to compare against.')
+    parser.add_argument('-tolerance', '--tolerance', type=float, default=0.25,
+                        help='Fractional slow down (or memory growth) over the baseline which counts as a regression.')
+    parser.add_argument('-no_memory', '--no_memory', action='store_true',
+                        help='Do not trace memory; tracing slows the code down so times are inflated when it is on.')
+    parser.add_argument('-micro_only', '--micro_only', action='store_true',
+                        help='Only run the micro benchmarks.')
+    parser.add_argument('-no_micro', '--no_micro', action='store_true',
+                        help='Do not run the micro benchmarks.')
+    args = parser.parse_args()
+
+    results = benchmark(sizes=args.sizes, stages=args.stages, repeats=args.repeats, memory=not args.no_memory,
+                        micro=not args.no_micro, pipeline=not args.micro_only)
+
+    print_results(results)
+
+    with open(args.output, 'w+') as json_file:
+        dump(results, json_file, indent=2)
+    print(f'\nResults written to {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as json_file:
+            baseline = load(json_file)
+
+        regressions = compare(results, baseline, args.tolerance)
+
+        if regressions:
+            print(f'\n{len(regressions)} regressions against {args.baseline}:')
+            for molecule, section, name, metric, old, new in regressions:
+                print(f'  {molecule:<14}{section:<11}{name:<45}{metric:<9}{old:12.4f} -> {new:12.4f}')
+            sys_exit(1)
+
+        print(f'\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%})')
+
+
+if __name__ == '__main__':
+
+    main()
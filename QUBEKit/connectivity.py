@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+"""
+Bond perception from the coordinates, for input files without CONECT records.
+Close pairs of atoms are found with a cell list, so the work grows linearly with the number of atoms:
+the atoms are binned into cubes as wide as the longest possible bond and only atoms in the same or next cubes
+are compared. Ligands are bonded by the covalent radii of their elements; proteins use residue templates
+for the bonds between heavy atoms and the radii only for hydrogens and residues without a template.
+The residue data also gives the net formal charge of a protein (residue_charge).
+"""
+
+from numpy import arange, argsort, array, asarray, column_stack, concatenate, cumsum, empty, flatnonzero, float64, \
+    floor, full, inf, int64, lexsort, minimum, ones, repeat, searchsorted, sqrt, unique, zeros
+
+
+# Single bond covalent radii (angstroms) from Cordero et al. Dalton Trans. 2008, 2832
+covalent_radii = {'H': 0.31, 'C': 0.76, 'N': 0.71, 'O': 0.66, 'F': 0.57, 'P': 1.07, 'S': 1.05, 'Cl': 1.02,
+                  'Br': 1.20, 'I': 1.39, 'B': 0.84, 'Si': 1.11, 'Se': 1.20, 'Na': 1.66, 'K': 2.03, 'Mg': 1.41,
+                  'Ca': 1.76, 'Fe': 1.32, 'Zn': 1.22, 'Cu': 1.32, 'Mn': 1.39}
+
+# Bonds between the heavy atoms of each residue by atom name; backbone bonds are added to every amino acid
+backbone = (('N', 'CA'), ('CA', 'C'), ('C', 'O'), ('C', 'OXT'))
+side_chains = {
+    'ALA': (('CA', 'CB'),),
+    'ARG': (('CA', 'CB'), ('CB', 'CG'), ('CG', 'CD'), ('CD', 'NE'), ('NE', 'CZ'), ('CZ', 'NH1'), ('CZ', 'NH2')),
+    'ASN': (('CA', 'CB'), ('CB', 'CG'), ('CG', 'OD1'), ('CG', 'ND2')),
+    'ASP': (('CA', 'CB'), ('CB', 'CG'), ('CG', 'OD1'), ('CG', 'OD2')),
+    'CYS': (('CA', 'CB'), ('CB', 'SG')),
+    'GLN': (('CA', 'CB'), ('CB', 'CG'), ('CG', 'CD'), ('CD', 'OE1'), ('CD', 'NE2')),
+    'GLU': (('CA', 'CB'), ('CB', 'CG'), ('CG', 'CD'), ('CD', 'OE1'), ('CD', 'OE2')),
+    'GLY': (),
+    'HIS': (('CA', 'CB'), ('CB', 'CG'), ('CG', 'ND1'), ('ND1', 'CE1'), ('CE1', 'NE2'), ('NE2', 'CD2'), ('CD2', 'CG')),
+    'ILE': (('CA', 'CB'), ('CB', 'CG1'), ('CG1', 'CD1'), ('CB', 'CG2')),
+    'LEU': (('CA', 'CB'), ('CB', 'CG'), ('CG', 'CD1'), ('CG', 'CD2')),
+    'LYS': (('CA', 'CB'), ('CB', 'CG'), ('CG', 'CD'), ('CD', 'CE'), ('CE', 'NZ')),
+    'MET': (('CA', 'CB'), ('CB', 'CG'), ('CG', 'SD'), ('SD', 'CE')),
+    'PHE': (('CA', 'CB'), ('CB', 'CG'), ('CG', 'CD1'), ('CD1', 'CE1'), ('CE1', 'CZ'), ('CZ', 'CE2'), ('CE2', 'CD2'),
+            ('CD2', 'CG')),
+    'PRO': (('CA', 'CB'), ('CB', 'CG'), ('CG', 'CD'), ('CD', 'N')),
+    'SER': (('CA', 'CB'), ('CB', 'OG')),
+    'THR': (('CA', 'CB'), ('CB', 'OG1'), ('CB', 'CG2')),
+    'TRP': (('CA', 'CB'), ('CB', 'CG'), ('CG', 'CD1'), ('CD1', 'NE1'), ('NE1', 'CE2'), ('CE2', 'CD2'), ('CD2', 'CG'),
+            ('CE2', 'CZ2'), ('CZ2', 'CH2'), ('CH2', 'CZ3'), ('CZ3', 'CE3'), ('CE3', 'CD2')),
+    'TYR': (('CA', 'CB'), ('CB', 'CG'), ('CG', 'CD1'), ('CD1', 'CE1'), ('CE1', 'CZ'), ('CZ', 'CE2'), ('CE2', 'CD2'),
+            ('CD2', 'CG'), ('CZ', 'OH')),
+    'VAL': (('CA', 'CB'), ('CB', 'CG1'), ('CB', 'CG2')),
+}
+residue_templates = {name: backbone + bonds for name, bonds in side_chains.items()}
+# Protonation states and disulphide cysteines named by Amber, and the usual caps
+residue_templates.update({alias: residue_templates[name] for alias, name in (
+    ('HID', 'HIS'), ('HIE', 'HIS'), ('HIP', 'HIS'), ('CYX', 'CYS'), ('CYM', 'CYS'), ('ASH', 'ASP'), ('GLH', 'GLU'),
+    ('LYN', 'LYS'))})
+residue_templates.update({'ACE': (('CH3', 'C'), ('C', 'O')), 'NME': (('N', 'CH3'), ('N', 'C'))})
+
+# Names of the atoms each template bonds
+template_names = {name: {atom for bond in bonds for atom in bond} for name, bonds in residue_templates.items()}
+
+# Bonds between residues by atom name: the peptide bond and disulphide bridges
+linking_bonds = {('C', 'N'), ('N', 'C'), ('SG', 'SG')}
+
+# Formal charge of each residue by its (Amber) name at pH 7; other residues are neutral
+residue_charges = {'ASP': -1, 'GLU': -1, 'CYM': -1, 'LYS': 1, 'ARG': 1, 'HIP': 1}
+
+# Protons which decide the charge of a residue given with its hydrogens: (charge with the proton, charge without)
+titratable_protons = {('ASP', 'HD2'): (0, -1), ('GLU', 'HE2'): (0, -1), ('LYS', 'HZ3'): (1, 0)}
+
+# Capping groups; their methyl hydrogens are also named H1, H2 and H3 but they are never charged termini
+capping_groups = {'ACE', 'NME', 'NMA'}
+
+
+def close_pairs(coords, cutoff):
+    """
+    Every pair of atoms no further apart than cutoff (angstroms), found with a cell list.
+    Atoms are sorted into cubic cells of side cutoff, so each atom need only be compared with the atoms of its own
+    cell and the 26 around it; each pair of cells is visited once, from the 13 cells "above" each cell and the cell
+    itself, and the atoms of each pair of cells are compared together as arrays.
+    Returns a (P, 2) array of the atom indices (counted from 0), the lower first, sorted.
+    """
+
+    coords = asarray(coords, dtype=float64).reshape(-1, 3)
+    if len(coords) < 2:
+        return empty((0, 2), dtype=int64)
+
+    # Cell of each atom, padded by one cell on every side so no neighbour cell wraps round into the next row
+    cells = floor((coords - coords.min(axis=0)) / cutoff).astype(int64) + 1
+    shape = cells.max(axis=0) + 2
+    strides = array([shape[1] * shape[2], shape[2], 1], dtype=int64)
+    ids = cells @ strides
+
+    order = argsort(ids, kind='stable')
+    occupied, starts, counts = unique(ids[order], return_index=True, return_counts=True)
+
+    # The cell itself and half of the 26 around it
+    offsets = array([(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)
+                     if (x, y, z) >= (0, 0, 0)], dtype=int64)
+
+    pairs = []
+    for offset in offsets @ strides:
+        found = searchsorted(occupied, occupied + offset)
+        found[found == len(occupied)] = 0
+        first = flatnonzero(occupied[found] == occupied + offset)
+        second = found[first]
+
+        # Every atom of each first cell against every atom of its second cell
+        sizes = counts[first] * counts[second]
+        block = repeat(arange(len(first)), sizes)
+        entry = arange(int(sizes.sum())) - repeat(cumsum(sizes) - sizes, sizes)
+        across = counts[second][block]
+        atoms_a = order[starts[first][block] + entry // across]
+        atoms_b = order[starts[second][block] + entry % across]
+
+        # Within a cell each pair turns up twice, and each atom with itself
+        keep = atoms_a < atoms_b if not offset else ones(len(atoms_a), dtype=bool)
+        vectors = coords[atoms_b[keep]] - coords[atoms_a[keep]]
+        close = (vectors * vectors).sum(axis=1) <= cutoff * cutoff
+        pairs.append(column_stack([atoms_a[keep][close], atoms_b[keep][close]]))
+
+    pairs = concatenate(pairs)
+    pairs.sort(axis=1)
+
+    return pairs[lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def element_radii(elements):
+    """Covalent radius of each element as an array; raises ValueError for elements with no radius."""
+
+    try:
+        return array([covalent_radii[element.title()] for element in elements], dtype=float64)
+    except KeyError as error:
+        raise ValueError(f'No covalent radius for {error.args[0]!r}; the bonds cannot be found from the coordinates.')
+
+
+def perceive_bonds(elements, coords, tolerance=0.45):
+    """
+    Find the bonds of a molecule from its coordinates: atoms are bonded when they are closer than the sum of their
+    covalent radii plus tolerance (angstroms), and further apart than 0.4 angstroms, as OpenBabel does.
+    A hydrogen only keeps its shortest bond.
+    Returns a (B, 2) array of the bonded atom indices (counted from 0), the lower first, sorted.
+    """
+
+    radii = element_radii(elements)
+    if not len(radii):
+        return empty((0, 2), dtype=int64)
+
+    pairs = close_pairs(coords, 2 * radii.max() + tolerance)
+
+    coords = asarray(coords, dtype=float64).reshape(-1, 3)
+    lengths = sqrt(((coords[pairs[:, 1]] - coords[pairs[:, 0]]) ** 2).sum(axis=1))
+    bonded = (lengths > 0.4) & (lengths <= radii[pairs].sum(axis=1) + tolerance)
+    pairs, lengths = pairs[bonded], lengths[bonded]
+
+    # The shortest bond of each atom, so each hydrogen can keep only that one
+    hydrogens = array([element.title() == 'H' for element in elements], dtype=bool)
+    shortest = full(len(radii), inf)
+    for end in (0, 1):
+        minimum.at(shortest, pairs[:, end], lengths)
+    keep = ~((hydrogens[pairs] & (lengths[:, None] > shortest[pairs])).any(axis=1))
+
+    return pairs[keep]
+
+
+def residue_starts(residues, residue_ids):
+    """
+    Split the atoms of a pdb into residues; a new residue starts wherever the residue name or id changes.
+    Returns the index of the first atom of each residue then the number of atoms (as one list),
+    and the residue number of each atom counted along the file.
+    """
+
+    residues, residue_ids = asarray(residues), asarray(residue_ids)
+
+    changes = (residues[1:] != residues[:-1]) | (residue_ids[1:] != residue_ids[:-1])
+    residue = concatenate([[0], cumsum(changes)]).astype(int64)
+
+    return concatenate([[0], flatnonzero(changes) + 1, [len(residues)]]).astype(int64).tolist(), residue
+
+
+def residue_charge(names, residues, residue_ids):
+    """
+    Net formal charge of a protein from its residues (see residue_charges) at pH 7.
+    Where the hydrogens are given their names decide the charge instead: protonated Asp and Glu, neutral Lys,
+    doubly protonated His (HD1 and HE2), charged N termini (H1, H2 and H3 on a residue with a backbone N, not a cap;
+    H2 and H3 for Pro) and C termini (OXT without HXT).
+
+    names, residues     Atom name and residue name of each atom (e.g. from readers.PDBFile)
+    residue_ids         Chain, residue number and insertion code of each atom, as for template_bonds
+    """
+
+    names = asarray(names).tolist()
+    residues = asarray(residues).tolist()
+    starts = residue_starts(residues, residue_ids)[0]
+
+    total = 0
+    for start, end in zip(starts[:-1], starts[1:]):
+        name = residues[start]
+        atoms = set(names[start:end])
+
+        charge = residue_charges.get(name, 0)
+        if any(atom.startswith('H') for atom in atoms):
+            for (residue, proton), (charged, uncharged) in titratable_protons.items():
+                if residue == name:
+                    charge = charged if proton in atoms else uncharged
+            if name in ('HIS', 'HID', 'HIE', 'HIP'):
+                charge = int({'HD1', 'HE2'} <= atoms)
+
+            # Protonated amine of an N terminal amino acid (caps have no backbone amine to protonate)
+            if name not in capping_groups and 'N' in atoms and (
+                    {'H1', 'H2', 'H3'} <= atoms or (name == 'PRO' and {'H2', 'H3'} <= atoms and 'H' not in atoms)):
+                charge += 1
+
+        # Carboxylate of a C terminus
+        if 'OXT' in atoms and 'HXT' not in atoms:
+            charge -= 1
+
+        total += charge
+
+    return total
+
+
+def template_bonds(names, residues, residue_ids, elements, coords, tolerance=0.45):
+    """
+    Find the bonds of a protein from its residue templates (residue_templates) and coordinates.
+    Heavy atoms of residues with a template are bonded by atom name; residues are linked by their peptide bonds
+    and disulphide bridges (linking_bonds) where the atoms are close enough to be bonded.
+    Hydrogens, atoms the template does not name and every atom of residues with no template (ligands, waters, ions)
+    are bonded by distance (see perceive_bonds) within their own residue.
+
+    names, residues     Atom name and residue name of each atom (e.g. from readers.PDBFile)
+    residue_ids         Anything that marks each residue apart from its neighbours in the file, e.g. the chain,
+                        residue number and insertion code; a new residue starts wherever it or the name changes
+    Returns a (B, 2) array of the bonded atom indices (counted from 0), the lower first, sorted.
+    """
+
+    names, residues = asarray(names), asarray(residues)
+    starts, residue = residue_starts(residues, residue_ids)
+
+    # Bonds between the heavy atoms of each templated residue, by name, and the atoms the templates name
+    named = []
+    covered = zeros(len(names), dtype=bool)
+    for start, end in zip(starts[:-1], starts[1:]):
+        template = residue_templates.get(residues[start])
+        if template is None:
+            continue
+
+        atoms = {name: atom for atom, name in enumerate(names[start:end].tolist(), start)}
+        named.extend((atoms[a], atoms[b]) for a, b in template if a in atoms and b in atoms)
+        covered[[atom for name, atom in atoms.items() if name in template_names[residues[start]]]] = True
+
+    pairs = perceive_bonds(elements, coords, tolerance)
+
+    # Distance bonds within a residue unless the template gives both atoms: hydrogens, and atoms of other residues
+    same = residue[pairs[:, 0]] == residue[pairs[:, 1]]
+    kept = same & ~covered[pairs].all(axis=1)
+
+    # Distance bonds between residues only where the templates link them
+    linked = array([(a, b) in linking_bonds for a, b in names[pairs].tolist()], dtype=bool)
+    kept |= ~same & covered[pairs].all(axis=1) & linked
+
+    pairs = concatenate([pairs[kept], array(named, dtype=int64).reshape(-1, 2)])
+    pairs.sort(axis=1)
+
+    return unique(pairs, axis=0)
@@ -1,11 +1,12 @@
 #!/usr/bin/env python
 
 from QUBEKit.decorators import timer_logger, for_all_methods
+from QUBEKit.geometry import Conformers, dihedral_values
 
 from simtk.openmm import app
 import simtk.openmm as mm
 from simtk import unit
-from numpy import array, zeros, sqrt, sum, exp, round, append
+from numpy import array, zeros, sqrt, sum, exp, round, nan
 from scipy.optimize import minimize
 
 from subprocess import run as sub_run
@@ -133,17 +134,14 @@ class TorsionScan:
 
     def get_energy(self, scan):
         """
-        Extracts an array of energies from the scan results then stores it back
-        into the molecule (in a dictionary) using the scan orders as the keys.
+        Reads the structures and energies of the scan results then stores them back
+        into the molecule (in dictionaries) using the scan orders as the keys.
         """
 
-        with open('scan.xyz', 'r') as scan_file:
-            scan_energy = []
-            for line in scan_file:
-                if 'Energy ' in line:
-                    scan_energy.append(float(line.split()[3]))
+        conformers = Conformers.from_xyz('scan.xyz', source='qm scan')
 
-            self.scan_mol.qm_scan_energy[scan] = array(scan_energy)
+        self.scan_mol.qm_scans[scan] = conformers
+        self.scan_mol.qm_scan_energy[scan] = conformers.qm_energy
 
     def start_scan(self):
         """Makes a folder and writes a new a dihedral input file for each scan and runs the scan."""
@@ -163,7 +161,10 @@ class TorsionScan:
 
             # now make the scan input files
             self.qm_scan_input(scan)
-            sub_run(self.cmd, shell=True)
+            if self.qm_engine.drives_torsions:
+                self.qm_engine.drive_torsion(scan, self.grid_space)
+            else:
+                sub_run(self.cmd, shell=True)
             self.get_energy(scan)
             chdir(self.home)
 
@@ -220,16 +221,14 @@ class TorsionOptimiser:
         self.starting_energy = None
         # list of the scan keys in the order to be fit
         self.scan_order = molecule.scan_order
-        # list of molecule geometries in OpenMM format list[tuple] [(x, y, z)]
-        self.scan_coords = []
+        # Conformers of the molecule geometries currently being fit, with their energies
+        self.scan_coords = Conformers()
         # list of the dihedral starting parameters
         self.starting_params = []
-        # list of all of the qm energies collected in the same order as the scan coords
-        self.energy_store_qm = []
-        # list of all of the coordinates sampled in the fitting
-        self.coords_store = []
-        # the qm optimised geometrys
-        self.initial_coords = []
+        # Conformers of all of the geometries sampled in the fitting, with their qm energies
+        self.coords_store = Conformers()
+        # Conformers of the qm optimised geometries
+        self.initial_coords = Conformers()
         self.atm_no = len(molecule.atom_names)
         # important! stores the torsion indexs in the OpenMM system and groups torsions
         self.tor_types = OrderedDict()
@@ -265,52 +264,42 @@ class TorsionOptimiser:
     def mm_energies(self):
         """Evaluate the MM energies of the QM structures."""
 
-        mm_energy = []
-        for position in self.scan_coords:
-            mm_energy.append(self.get_energy(position))
+        for frame in range(len(self.scan_coords)):
+            self.scan_coords.mm_energy[frame] = self.get_energy(self.scan_coords.to_openmm(frame))
 
-        return array(mm_energy)
+        return self.scan_coords.mm_energy.copy()
         # get forces from the system
         # open_grad = state.getForces()
 
-    @staticmethod
-    def get_coords(engine):
+    def get_coords(self, engine, source):
         """
-        Read the torsion drive output file to get all of the coords in a format that can be passed to openmm
-        so we can update positions in context without reloading the molecule.
+        Read the torsion drive or geometric output file to get all of the coords as Conformers, whose frames can be
+        passed to openmm so we can update positions in context without reloading the molecule.
+        The value of the scanned dihedral is stored with each structure.
         """
 
-        scan_coords = []
         if engine == 'torsiondrive':
-            # open the torsion drive data file read all the scan coordinates
+            # open the torsion drive data file read all the scan coordinates and energies
+            scan_coords = Conformers(source=source)
             with open('qdata.txt', 'r') as data:
-                for line in data.readlines():
+                for line in data:
                     if 'COORDS' in line:
-                        # get the coords into a single array
-                        coords = [float(x) / 10 for x in line.split()[1:]]
-                        # convert to a list of tuples for OpenMM format
-                        tups = []
-                        for i in range(0, len(coords), 3):
-                            tups.append((coords[i], coords[i + 1], coords[i + 2]))
-                        scan_coords.append(tups)
+                        coords = array(line.split()[1:], dtype=float)
+                    elif 'ENERGY' in line:
+                        # only the qm drive energies are kept, the mm energies are found again with our parameters
+                        energy = float(line.split()[1]) if source == 'qm scan' else nan
+                        scan_coords.append(coords, source=source, qm_energy=energy)
 
         # get the coords from a geometric output
         elif engine == 'geometric':
-            with open('scan-final.xyz', 'r') as data:
-                lines = data.readlines()
-                # get the amount of atoms
-                atoms = int(lines[0])
-                for i, line in enumerate(lines):
-                    if 'Iteration' in line:
-                        # this is the start of the cordinates
-                        tups = []
-                        for coords in lines[i + 1:i + atoms + 1]:
-                            coord = tuple(float(x) / 10 for x in coords.split()[1:])
-                            # convert to a list of tuples for OpenMM format
-                            # store tuples
-                            tups.append(coord)
-                        # now store that structure back to the coords list
-                        scan_coords.append(tups)
+            scan_coords = Conformers.from_xyz('scan-final.xyz', source=source, energy=None)
+
+        else:
+            raise NotImplementedError
+
+        torsion = array(self.molecule.dihedrals[self.scan][:1]) - 1
+        scan_coords.dihedral[:] = dihedral_values(scan_coords.coords, torsion)[:, 0]
+
         return scan_coords
 
     def openmm_system(self):
@@ -349,15 +338,15 @@ class TorsionOptimiser:
         # Now, reset all periodic torsion terms back to their initial values
         for pos, key in enumerate(self.torsion_store):
             try:
-                self.tor_types[pos] = [[key], [float(self.torsion_store[key][i][1]) for i in range(4)],
+                self.tor_types[pos] = [[key], self.torsion_store[key].k.tolist(),
                                        [self.index_dict[key]]]
             except KeyError:
                 try:
-                    self.tor_types[pos] = [[tuple(reversed(key))], [float(self.torsion_store[key][i][1]) for i in range(4)],
+                    self.tor_types[pos] = [[tuple(reversed(key))], self.torsion_store[key].k.tolist(),
                                            [self.index_dict[tuple(reversed(key))]]]
                 except KeyError:
                     # after trying to match the forward and backwards strings must be improper
-                    self.tor_types[pos] = [[(key[1], key[2], key[0], key[3])], [float(self.torsion_store[key][i][1]) for i in range(4)],
+                    self.tor_types[pos] = [[(key[1], key[2], key[0], key[3])], self.torsion_store[key].k.tolist(),
                                            [self.index_dict[(key[1], key[2], key[0], key[3])]]]
 
         self.update_torsions()
@@ -501,9 +490,6 @@ class TorsionOptimiser:
             # with wavefront propagation, returns the new set of coords these become the new scan coords
             self.scan_coords = self.drive_mm(engine='torsiondrive')
 
-            # also save these coords to the coords store
-            self.coords_store = deepcopy(self.coords_store + self.scan_coords)
-
             # step 3 calculate the rmsd for these structures compared to QM
             rmsd = self.rmsd(f'{self.qm_local}/scan.xyz', 'torsiondrive_scan/scan.xyz')
 
@@ -511,7 +497,9 @@ class TorsionOptimiser:
             self.qm_energy = self.single_point()
 
             # Keep a copy of the energy before adjusting in case another loop is needed
-            self.energy_store_qm = deepcopy(append(self.energy_store_qm, self.qm_energy))
+            # and save these coords and energies to the coords store
+            self.scan_coords.qm_energy[:] = self.qm_energy
+            self.coords_store.extend(self.scan_coords)
 
             # Normalise the qm energy again using the qm reference energy
             self.qm_normalise()
@@ -582,7 +570,7 @@ class TorsionOptimiser:
         # get the energy surface for these final parameters
         # this will also update the parameters in the molecule class so we can write a new xml
         # first get back the original qm energies as well
-        self.qm_energy = self.energy_store_qm[:24]
+        self.qm_energy = self.initial_coords.qm_energy.copy()
         self.qm_normalise()
         # energy_error = self.objective(final_parameters)
 
@@ -664,7 +652,7 @@ class TorsionOptimiser:
             self.qm_local = getcwd()
 
             # Get the MM coords from the QM torsion drive
-            self.scan_coords = self.get_coords(engine='torsiondrive')
+            self.scan_coords = self.get_coords(engine='torsiondrive', source='qm scan')
 
             # now move to our working folder
             # make a lot of folders not nice
@@ -686,16 +674,16 @@ class TorsionOptimiser:
             self.target_energy = self.energy_dict[self.scan]
 
             # Adjust the QM energies
-            # and store all QM raw energies
-            self.energy_store_qm = deepcopy(self.target_energy)
+            # the raw QM energies are stored with the scan coords
+            self.scan_coords.qm_energy[:] = self.target_energy
             self.qm_energy = deepcopy(self.target_energy)
             # store the optimized qm energy and make all other energies relative to this one
 
             self.qm_normalise()
 
             # Keep the initial coords
-            self.coords_store = deepcopy(self.scan_coords)
-            self.initial_coords = deepcopy(self.scan_coords)
+            self.coords_store = self.scan_coords.copy()
+            self.initial_coords = self.scan_coords
 
             # Get the initial energies
             self.initial_energies()
@@ -827,14 +815,10 @@ class TorsionOptimiser:
         # save the molecule torsions to a dict
         self.torsion_store = deepcopy(self.molecule.PeriodicTorsionForce)
 
-        # Set all the torsion to 1 to get them into the system
-        for key in self.molecule.PeriodicTorsionForce:
-            if self.molecule.PeriodicTorsionForce[key][-1] == 'Improper':
-                self.molecule.PeriodicTorsionForce[key] = [['1', '1', '0'], ['2', '1', '3.141592653589793'],
-                                                           ['3', '1', '0'], ['4', '1', '3.141592653589793'], 'Improper']
-            else:
-                self.molecule.PeriodicTorsionForce[key] = [['1', '1', '0'], ['2', '1', '3.141592653589793'],
-                                                           ['3', '1', '0'], ['4', '1', '3.141592653589793']]
+        # Set all the torsion to 1 (with the default phases) to get them into the system
+        torsions = self.molecule.PeriodicTorsionForce
+        torsions.values[:, :4] = 1
+        torsions.values[:, 4:] = torsions.default_phases
 
         # Write out the new xml file which is read into the OpenMM system
         self.molecule.write_parameters()
@@ -863,10 +847,10 @@ class TorsionOptimiser:
             # Get the torsions param vector used to compare to others
             # The master vector could be backwards so try one way and if keyerror try the other
             try:
-                master_vector = [float(self.torsion_store[torsion][i][1]) for i in range(4)]
+                master_vector = self.torsion_store[torsion].k.tolist()
             except KeyError:
                 torsion = torsion[::-1]
-                master_vector = [float(self.torsion_store[torsion][i][1]) for i in range(4)]
+                master_vector = self.torsion_store[torsion].k.tolist()
 
             # Add this type to the torsion type dictionary with the right key index
             try:
@@ -879,10 +863,10 @@ class TorsionOptimiser:
             for dihedral in to_fit:
                 # Again, try both directions
                 try:
-                    vector = [float(self.torsion_store[dihedral][i][1]) for i in range(4)]
+                    vector = self.torsion_store[dihedral].k.tolist()
                 except KeyError:
                     dihedral = dihedral[::-1]
-                    vector = [float(self.torsion_store[dihedral][i][1]) for i in range(4)]
+                    vector = self.torsion_store[dihedral].k.tolist()
 
                 # See if that vector is the same as the master vector
                 if vector == master_vector:
@@ -1162,12 +1146,12 @@ class TorsionOptimiser:
                 self.write_dihedrals()
                 completed = system('torsiondrive-launch -e openmm openmm.pdb dihedrals.txt > log.txt')
                 if completed == 0:
-                    positions = self.get_coords(engine='torsiondrive')
+                    positions = self.get_coords(engine='torsiondrive', source='mm drive')
             elif engine == 'geometric':
                 self.make_constraints()
                 sub_run('geometric-optimize --reset --epsilon 0.0 --maxiter 500 --qccnv --openmm openmm.pdb constraints.txt',
                         shell=True, stdout=log)
-                positions = self.get_coords(engine='geometric')
+                positions = self.get_coords(engine='geometric', source='mm drive')
             else:
                 raise NotImplementedError
 
@@ -1189,15 +1173,12 @@ class TorsionOptimiser:
             pass
         mkdir('Single_points')
         chdir('Single_points')
-        for i, x in enumerate(self.scan_coords):
+        for i, coords in enumerate(self.scan_coords):
             mkdir(f'SP_{i}')
             chdir(f'SP_{i}')
             print(f'Doing single point calculations on new structures ... {i + 1}/{len(self.scan_coords)}')
-            # now we need to change the positions of the molecule in the molecule array
-            for y, coord in enumerate(x):
-                for z, pos in enumerate(coord):
-                    # convert from nanometers in openmm to Angs in QM
-                    self.qm_engine.molecule.molecule['input'][y][z + 1] = pos * 10
+            # now we need to change the positions of the molecule in the molecule array (both in Angs)
+            self.qm_engine.molecule.molecule['input'].coords = coords
 
             # Write the new coordinate file and run the calculation
             self.qm_engine.generate_input(energy=True)
@@ -1218,11 +1199,10 @@ class TorsionOptimiser:
 
         for val in self.tor_types.values():
             for dihedral in val[0]:
-                for vn in range(4):
-                    try:
-                        self.molecule.PeriodicTorsionForce[dihedral][vn][1] = str(val[1][vn])
-                    except KeyError:
-                        self.molecule.PeriodicTorsionForce[tuple(reversed(dihedral))][vn][1] = str(val[1][vn])
+                try:
+                    self.molecule.PeriodicTorsionForce[dihedral].k[:] = val[1]
+                except KeyError:
+                    self.molecule.PeriodicTorsionForce[tuple(reversed(dihedral))].k[:] = val[1]
 
     def opls_lj(self):
         """
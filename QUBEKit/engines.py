@@ -5,13 +5,23 @@
 #       Maybe add path checking for Chargemol?
 # TODO use QCEngine to run PSI4, geometric and torsion drive QM commands.
 
-from QUBEKit.helpers import get_overage, check_symmetry, append_to_log
+from QUBEKit.helpers import get_overage, check_symmetry, append_to_log, Configure
 from QUBEKit.decorators import for_all_methods, timer_logger
+from QUBEKit.geometry import atomic_numbers
+from QUBEKit.writers import format_rows
 
 from subprocess import run as sub_run
-from numpy import array, zeros
+from os import environ, path, makedirs, rename, getcwd, chdir
+from shutil import copy, rmtree
+from tempfile import mkdtemp
+from hashlib import sha256
+from functools import partial
+from networkx import node_connected_component
+from numpy import array, zeros, eye, prod, linalg, cross, dot, outer, arctan2, cos, sin, sqrt, sign, repeat, degrees, \
+    radians, tril_indices
+from numpy.random import RandomState
 from numpy import append as np_append
-from scipy.spatial import ConvexHull
+from scipy.spatial import ConvexHull, QhullError
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 import qcengine as qcng
@@ -25,6 +35,11 @@ class Engines:
     Also gives all configs from the appropriate config file.
     """
 
+    # Engines which can drive torsion scans themselves rather than through torsiondrive
+    drives_torsions = False
+    # Engines with a ddec method which writes the DDEC files in place of the Chargemol binary (see Chargemol)
+    partitions_charges = False
+
     def __init__(self, molecule, config_dict):
 
         self.molecule = molecule
@@ -65,8 +80,7 @@ class PSI4(Engines):
             # opening tag is always writen
             input_file.write(f"memory {self.qm['threads']} GB\n\nmolecule {self.molecule.name} {{\n{self.charge} {self.multiplicity} \n")
             # molecule is always printed
-            for atom in molecule:
-                input_file.write(f' {atom[0]}    {float(atom[1]): .10f}  {float(atom[2]): .10f}  {float(atom[3]): .10f} \n')
+            input_file.write(format_rows(' %s    % .10f  % .10f  % .10f \n', molecule.elements, *molecule.coords.T))
             input_file.write(f" units angstrom\n no_reorient\n}}\n\nset {{\n basis {self.qm['basis']}\n")
 
             if energy:
@@ -233,8 +247,7 @@ class PSI4(Engines):
 
         return opt_struct, opt_energy
 
-    @staticmethod
-    def get_energy():
+    def get_energy(self):
         """Get the energy of a single point calculation."""
 
         # open the psi4 log file
@@ -295,8 +308,7 @@ class PSI4(Engines):
         with open(f'{self.molecule.name}.psi4in', 'w+') as file:
 
             file.write(f'molecule {self.molecule.name} {{\n {self.charge} {self.multiplicity} \n')
-            for atom in molecule:
-                file.write(f'  {atom[0]}    {float(atom[1]): .10f}  {float(atom[2]): .10f}  {float(atom[3]): .10f}\n')
+            file.write(format_rows('  %s    % .10f  % .10f  % .10f\n', molecule.elements, *molecule.coords.T))
 
             file.write(f" units angstrom\n no_reorient\n}}\nset basis {self.qm['basis']}\n")
 
@@ -312,15 +324,36 @@ class PSI4(Engines):
 
 @for_all_methods(timer_logger)
 class Chargemol(Engines):
+    """
+    Writes and executes the job file for Chargemol DDEC charge partitioning.
+    The OpenMP parallel build is used whenever more than one thread is given in the configs.
+    DDEC output files are cached under the hash of the wfx file and the DDEC version,
+    so restarts and duplicate molecules skip the partitioning entirely.
+    An engine's stand-in partitioning (partition, e.g. FakeQM.ddec) can replace the binary;
+    the job file and cache are then used exactly as for Chargemol.
+    """
 
-    def __init__(self, molecule, config_file):
+    # The files read back in by the LennardJones class for each DDEC version
+    ddec_files = {
+        3: ['DDEC3_net_atomic_charges.xyz', 'DDEC_atomic_Rcubed_moments.xyz'],
+        6: ['DDEC6_even_tempered_net_atomic_charges.xyz', 'DDEC_atomic_Rcubed_moments.xyz']
+    }
+
+    def __init__(self, molecule, config_file, partition=None):
+        """
+        partition               Callable taking the DDEC version which writes the DDEC files instead of Chargemol
+        """
 
         super().__init__(molecule, config_file)
 
+        self.cache_folder = f'{Configure.cache_folder}ddec/'
+        self.partition = partition
+
     def generate_input(self, run=True):
         """
         Given a DDEC version (from the defaults), this function writes the job file for chargemol and
-        executes it.
+        executes it. If the same wfx has already been partitioned with the same DDEC version,
+        the cached results are copied in instead.
         """
 
         if (self.qm['ddec_version'] != 6) and (self.qm['ddec_version'] != 3):
@@ -345,12 +378,79 @@ class Chargemol(Engines):
 
             charge_file.write('\n\n<compute BOs>\n.true.\n</compute BOs>')
 
-        # sub_run(f'psi4 input.dat -n {self.qm["threads"]}', shell=True)
-        # sub_run('mv Dt.cube total_density.cube', shell=True)
-
         if run:
-            control_path = 'chargemol_FORTRAN_09_26_2017/compiled_binaries/linux/Chargemol_09_26_2017_linux_serial job_control.txt'
-            sub_run(f'{self.descriptions["chargemol"]}/{control_path}', shell=True)
+            cache_key = self.cache_key()
+
+            if self.load_cache(cache_key):
+                append_to_log(f'DDEC{self.qm["ddec_version"]} results found in cache {cache_key[:12]}; '
+                              f'skipping Chargemol', 'minor')
+                return
+
+            if self.partition is not None:
+                self.partition(self.qm['ddec_version'])
+
+            else:
+                threads = self.qm['threads']
+                build = 'parallel' if threads > 1 else 'serial'
+                control_path = f'chargemol_FORTRAN_09_26_2017/compiled_binaries/linux/Chargemol_09_26_2017_linux_{build} job_control.txt'
+
+                # The parallel build is OpenMP so the thread count is set through the environment
+                sub_run(f'{self.descriptions["chargemol"]}/{control_path}', shell=True,
+                        env=dict(environ, OMP_NUM_THREADS=str(threads)))
+
+            self.save_cache(cache_key)
+
+    def cache_key(self):
+        """Hash the wfx file (in blocks, it can be very large) together with the DDEC version."""
+
+        sha = sha256(f'DDEC{self.qm["ddec_version"]}'.encode())
+
+        with open(f'{self.molecule.name}.wfx', 'rb') as wfx:
+            for block in iter(partial(wfx.read, 1 << 20), b''):
+                sha.update(block)
+
+        return sha.hexdigest()
+
+    def load_cache(self, cache_key):
+        """Copy cached DDEC output files into the working directory; return True if they were all found."""
+
+        entry = f'{self.cache_folder}{cache_key}'
+        files = self.ddec_files[self.qm['ddec_version']]
+
+        if not all(path.exists(f'{entry}/{file}') for file in files):
+            return False
+
+        for file in files:
+            copy(f'{entry}/{file}', file)
+
+        return True
+
+    def save_cache(self, cache_key):
+        """
+        Store the DDEC output files in the cache.
+        Files are written to a temporary folder first and then renamed into place,
+        so a crash part way through can never leave a half written cache entry behind.
+        """
+
+        files = self.ddec_files[self.qm['ddec_version']]
+
+        # Chargemol failed; there is nothing to cache and LennardJones will raise the error.
+        if not all(path.exists(file) for file in files):
+            return
+
+        makedirs(self.cache_folder, exist_ok=True)
+        entry = f'{self.cache_folder}{cache_key}'
+
+        temp = mkdtemp(dir=self.cache_folder)
+        for file in files:
+            copy(file, f'{temp}/{file}')
+
+        try:
+            rename(temp, entry)
+
+        # Another run finished the same molecule first; their entry is identical.
+        except OSError:
+            rmtree(temp, ignore_errors=True)
 
 
 @for_all_methods(timer_logger)
@@ -397,8 +497,7 @@ class Gaussian(Engines):
             input_file.write(commands)
 
             # Add the atomic coordinates
-            for atom in molecule:
-                input_file.write(f'{atom[0]} {float(atom[1]): .3f} {float(atom[2]): .3f} {float(atom[3]): .3f}\n')
+            input_file.write(format_rows('%s % .3f % .3f % .3f\n', molecule.elements, *molecule.coords.T))
 
             if solvent:
                 # Adds the epsilon and cavity params
@@ -497,25 +596,535 @@ class Gaussian(Engines):
         return array(freqs)
 
 
+@for_all_methods(timer_logger)
+class FakeQM(PSI4):
+    """
+    Deterministic stand-in QM engine which needs no QM software installed.
+    Cheap analytic models replace each calculation:
+        energies: free atom energies, harmonic bonds and a cosine series for each rotatable torsion;
+        Hessian: bonded MM Hessian (bonds and 1-3 pairs) plus seeded symmetric noise;
+        charges: bond electronegativity differences, with volumes scaled from the free atom volumes.
+    The results are written in the same formats as psi4, geometric, torsiondrive and Chargemol
+    (output.dat, fchk, wfx, opt.xyz, scan.xyz, qdata.txt and DDEC xyz files) so the normal parsers are used and
+    every run.Main stage can be timed on a machine without the QM codes.
+    The numbers have no chemical meaning; this engine is for benchmarking and testing the pipeline only.
+    """
+
+    # Scans are done by the engine itself rather than by launching torsiondrive, and DDEC files are written by ddec
+    drives_torsions = True
+    partitions_charges = True
+
+    # Covalent radii (angstroms) which set the equilibrium bond lengths
+    covalent_radii = {'H': 0.31, 'C': 0.76, 'N': 0.71, 'O': 0.66, 'F': 0.57, 'P': 1.07, 'S': 1.05, 'Cl': 1.02,
+                      'Br': 1.20, 'I': 1.39}
+
+    # Rough free atom energies (hartree)
+    atom_energies = {'H': -0.5, 'C': -37.8, 'N': -54.5, 'O': -75.0, 'F': -99.7, 'P': -341.2, 'S': -397.9,
+                     'Cl': -460.1, 'Br': -2572.4, 'I': -6917.0}
+
+    # Pauling electronegativities used to polarise the bonds
+    electronegativity = {'H': 2.20, 'C': 2.55, 'N': 3.04, 'O': 3.44, 'F': 3.98, 'P': 2.19, 'S': 2.58, 'Cl': 3.16,
+                         'Br': 2.96, 'I': 2.66}
+
+    # Free atom volumes (bohr ** 3), the same as used in the LennardJones class
+    free_volumes = {'H': 7.6, 'C': 34.4, 'N': 25.9, 'O': 22.1, 'F': 18.2, 'P': 57.3, 'S': 75.2, 'Cl': 65.1,
+                    'Br': 95.7, 'I': 153.8}
+
+    def __init__(self, molecule, config_dict, seed=0, noise=1e-4):
+        """
+        seed                    Seed for the Hessian noise so repeated runs give identical files
+        noise                   Standard deviation of the Hessian noise (hartree / bohr ** 2)
+        """
+
+        super().__init__(molecule, config_dict)
+
+        self.seed = seed
+        self.noise = noise
+
+        # Force constants (hartree / bohr ** 2) and torsion barriers V1 - V3 (hartree)
+        self.k_bond = 0.35
+        self.k_angle = 0.05
+        self.torsion_barriers = [0.0015, 0.0008, 0.0025]
+
+        self.bohr_to_angs = 0.529177
+
+    def structure(self, input_type='input'):
+        """Return the elements and an N x 3 array of the coordinates (angstroms) of the molecule."""
+
+        geometry = self.molecule.molecule[input_type]
+
+        return [element.title() for element in geometry.elements], geometry.coords
+
+    def dihedral(self, coords, torsion):
+        """Dihedral angle (radians) of the torsion, where the torsion atoms are indexed from 1."""
+
+        x1, x2, x3, x4 = (coords[atom - 1] for atom in torsion)
+        b1, b2, b3 = x2 - x1, x3 - x2, x4 - x3
+        n1, n2 = cross(b1, b2), cross(b2, b3)
+
+        return arctan2(dot(cross(n1, n2), b2 / linalg.norm(b2)), dot(n1, n2))
+
+    def model_energy(self, elements, coords):
+        """Energy (hartree) of the structure from the analytic model."""
+
+        energy = sum(self.atom_energies[element] for element in elements)
+
+        for i, j in self.molecule.topology.edges:
+            eq_length = self.covalent_radii[elements[i - 1]] + self.covalent_radii[elements[j - 1]]
+            length = linalg.norm(coords[i - 1] - coords[j - 1])
+            energy += 0.5 * self.k_bond * ((length - eq_length) / self.bohr_to_angs) ** 2
+
+        # The representative dihedral of each rotatable bond carries the torsion profile
+        dihedrals = self.molecule.dihedrals
+        for bond in self.molecule.rotatable or []:
+            phi = self.dihedral(coords, dihedrals[bond][0])
+            energy += sum(0.5 * v_n * (1 + cos(n * phi)) for n, v_n in enumerate(self.torsion_barriers, 1))
+
+        return energy
+
+    def model_hessian(self, coords):
+        """3N x 3N Hessian matrix (hartree / bohr ** 2) of central springs on each bond and 1-3 pair, plus noise."""
+
+        size = 3 * len(coords)
+        hessian = zeros((size, size))
+
+        pairs = [(i, j, self.k_bond) for i, j in self.molecule.topology.edges]
+        pairs += [(angle[0], angle[2], self.k_angle) for angle in self.molecule.angles or []]
+
+        for i, j, k in pairs:
+            vec = coords[j - 1] - coords[i - 1]
+            block = k * outer(vec, vec) / dot(vec, vec)
+
+            a, b = 3 * (i - 1), 3 * (j - 1)
+            hessian[a:a + 3, a:a + 3] += block
+            hessian[b:b + 3, b:b + 3] += block
+            hessian[a:a + 3, b:b + 3] -= block
+            hessian[b:b + 3, a:a + 3] -= block
+
+        noise = RandomState(self.seed).normal(scale=self.noise, size=(size, size))
+
+        return hessian + (noise + noise.T) / 2
+
+    def frequencies(self, elements, hessian):
+        """Harmonic frequencies (cm-1) of the mass weighted Hessian; imaginary modes are given as negative values."""
+
+        masses = repeat([self.molecule.element_dict[element.upper()] for element in elements], 3)
+        eigenvalues = linalg.eigvalsh(hessian / sqrt(outer(masses, masses)))
+
+        # sqrt(hartree / (bohr ** 2 * amu)) -> cm-1
+        return sign(eigenvalues) * sqrt(abs(eigenvalues)) * 5140.487
+
+    def generate_input(self, input_type='input', optimise=False, hessian=False, density=False, energy=False,
+                       fchk=False, run=True, solvent=False):
+        """
+        Write the psi4 input file then, in place of running psi4, write the psi4 style output.dat file
+        (plus the fchk and wfx files where requested) from the analytic model.
+        The optimisation does not move the atoms; the input structure is reported as converged.
+        """
+
+        super().generate_input(input_type=input_type, optimise=optimise, hessian=hessian, energy=energy,
+                               fchk=fchk, run=False)
+
+        if not run:
+            return
+
+        elements, coords = self.structure(input_type)
+        total = self.model_energy(elements, coords)
+
+        lines = ['', '    Fake QM engine output in psi4 format', '',
+                 f'    @DF-RKS Final Energy:   {total:20.12f}', '', f'    Total Energy =     {total:20.12f}', '']
+
+        if optimise:
+            # The energy of the final step must be 8 lines below the completion line
+            lines += ['    **** Optimization is complete! (in 1 steps) ****', '',
+                      '    ==> Optimization Summary <==', '',
+                      '    Measures of convergence in internal coordinates in au.', '',
+                      '   --------------------------------------------------------------------------------------',
+                      '    Step     Total Energy             Delta E       MAX Force       RMS Force       MAX Disp',
+                      f'      1   {total:20.12f}   {0.0:14.8e}   {0.0:14.8e}   {0.0:14.8e}   {0.0:14.8e}',
+                      '   --------------------------------------------------------------------------------------', '',
+                      '    ==> Geometry <==', '',
+                      '    Molecular point group: c1', '    Full point group: C1', '',
+                      f'    Geometry (in Angstrom), charge = {self.charge}, multiplicity = {self.multiplicity}:', '',
+                      '       Center              X                  Y                   Z',
+                      '    ------------   -----------------  -----------------  -----------------']
+            lines += [f'         {element:<3} {x:18.12f} {y:18.12f} {z:18.12f}' for element, (x, y, z) in
+                      zip(elements, coords)]
+            lines.append('')
+
+        if hessian:
+            hess_matrix = self.model_hessian(coords)
+            lines += self.hessian_block(hess_matrix)
+            lines += self.modes_block(self.frequencies(elements, hess_matrix))
+
+        with open('output.dat', 'w+') as output:
+            output.write('\n'.join(lines) + '\n')
+
+        if fchk:
+            self.write_fchk(elements, coords)
+
+        if density:
+            self.write_wfx(elements, coords, total)
+
+        append_to_log(f'Fake QM outputs written for {self.molecule.name}', 'minor')
+
+    def hessian_block(self, hess_matrix):
+        """psi4 style Hessian print out: blocks of five columns, three lines between the blocks."""
+
+        size = len(hess_matrix)
+        lines = ['  ## Hessian (Symmetry 0) ##', f'  Irrep: 1 Size: {size} x {size}']
+
+        for start in range(0, size, 5):
+            columns = range(start, min(start + 5, size))
+            lines += ['', ' ' * 5 + ''.join(f'{col + 1:20}' for col in columns), '']
+            lines += [f'{row + 1:>5}' + ''.join(f'{hess_matrix[row, col]:20.10f}' for col in columns)
+                      for row in range(size)]
+
+        lines.append('')
+
+        return lines
+
+    def modes_block(self, freqs):
+        """
+        psi4 style list of all modes. The six smallest (translations and rotations) are written as zeros
+        at the start of the first line, which only holds as many vibrations as needed to fill the rest into rows of 6.
+        """
+
+        vibrations = [f"'{freq:.4f}'" for freq in freqs[6:]]
+        first = len(freqs) % 6
+
+        lines = [f'{"  post-proj  all modes:[":<24}' + ' '.join(["'0.0000'"] * 6 + vibrations[:first])]
+        lines += [' '.join(vibrations[start:start + 6]) for start in range(first, len(vibrations), 6)]
+        lines[-1] += ']'
+
+        return lines + ['']
+
+    def write_fchk(self, elements, coords):
+        """Formatted checkpoint file with the lower triangle of the Hessian as psi4 writes it."""
+
+        hess_matrix = self.model_hessian(coords)
+        lower = hess_matrix[tril_indices(len(hess_matrix))]
+
+        with open(f'{self.molecule.name}_psi4.fchk', 'w+') as fchk:
+            fchk.write(f'{self.molecule.name}\nFakeQM {self.qm["theory"]}/{self.qm["basis"]}\n')
+            fchk.write(f'{"Number of atoms":<43}I     {len(elements):>12}\n')
+            fchk.write(f'{"Cartesian Force Constants":<43}R   N={len(lower):>12}\n')
+            for start in range(0, len(lower), 5):
+                fchk.write(''.join(f'{val:16.8E}' for val in lower[start:start + 5]) + '\n')
+            fchk.write(f'{"Dipole Moment":<43}R   N={3:>12}\n{0.0:16.8E}{0.0:16.8E}{0.0:16.8E}\n')
+
+    def write_wfx(self, elements, coords, total):
+        """AIM wavefunction file with the headers the density readers use; there are no orbitals or primitives."""
+
+        with open(f'{self.molecule.name}.wfx', 'w+') as wfx:
+            wfx.write(f'<Title>\n {self.molecule.name}\n</Title>\n<Keywords>\n GTO\n</Keywords>\n')
+            wfx.write(f'<Number of Nuclei>\n {len(elements)}\n</Number of Nuclei>\n')
+            wfx.write(f'<Net Charge>\n {self.charge}\n</Net Charge>\n')
+            wfx.write(f'<Electronic Spin Multiplicity>\n {self.multiplicity}\n</Electronic Spin Multiplicity>\n')
+            wfx.write('<Nuclear Names>\n' + ''.join(f' {element}{i}\n' for i, element in enumerate(elements, 1)))
+            wfx.write('</Nuclear Names>\n<Nuclear Cartesian Coordinates>\n')
+            for x, y, z in coords / self.bohr_to_angs:
+                wfx.write(f' {x: .12E} {y: .12E} {z: .12E}\n')
+            wfx.write(f'</Nuclear Cartesian Coordinates>\n<Energy>\n {total: .12E}\n</Energy>\n')
+
+    def geo_gradient(self, input_type='input', threads=False, run=True):
+        """Write the geometric input then, in place of the optimisation, write the final opt.xyz frame."""
+
+        super().geo_gradient(input_type=input_type, threads=threads, run=False)
+
+        if run:
+            elements, coords = self.structure(input_type)
+            with open('opt.xyz', 'w+') as xyz:
+                xyz.write(f'{len(elements)}\nIteration 0 Energy {self.model_energy(elements, coords):.12f}\n')
+                for element, (x, y, z) in zip(elements, coords):
+                    xyz.write(f'{element}  {x: .10f}  {y: .10f}  {z: .10f}\n')
+
+    def drive_torsion(self, bond, grid_space=15):
+        """
+        Stand in for torsiondrive: rigidly rotate one side of the central bond through a full turn,
+        writing the scan.xyz and qdata.txt files torsiondrive would leave in the current folder.
+        """
+
+        elements, coords = self.structure('qm' if self.molecule.molecule['qm'] else 'input')
+        torsion = self.molecule.dihedrals[bond][0]
+
+        # Atoms on the far side of the central bond are the ones which move
+        topology = self.molecule.topology.copy()
+        topology.remove_edge(*bond)
+        moving = array(sorted(node_connected_component(topology, bond[1]))) - 1
+
+        origin = coords[bond[1] - 1]
+        axis = coords[bond[1] - 1] - coords[bond[0] - 1]
+        axis /= linalg.norm(axis)
+        start = degrees(self.dihedral(coords, torsion))
+
+        grid = int(grid_space) if grid_space else 15
+        skew = array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+
+        with open('scan.xyz', 'w+') as scan, open('qdata.txt', 'w+') as qdata:
+            for job, angle in enumerate(range(-165, 181, grid)):
+                # Rodrigues rotation of the moving fragment about the central bond
+                theta = radians(angle - start)
+                rotation = cos(theta) * eye(3) + sin(theta) * skew + (1 - cos(theta)) * outer(axis, axis)
+
+                new_coords = coords.copy()
+                new_coords[moving] = (coords[moving] - origin) @ rotation.T + origin
+                energy = self.model_energy(elements, new_coords)
+
+                scan.write(f'{len(elements)}\nDihedral ({angle},) Energy {energy:.12f}\n')
+                for element, (x, y, z) in zip(elements, new_coords):
+                    scan.write(f'{element}  {x: .10f}  {y: .10f}  {z: .10f}\n')
+
+                qdata.write(f'JOB {job}\nCOORDS {" ".join(f"{val:.10f}" for val in new_coords.flatten())}\n'
+                            f'ENERGY {energy:.12f}\n\n')
+
+        append_to_log(f'Fake torsion drive about bond {bond[0]}-{bond[1]} complete', 'minor')
+
+    def ddec(self, ddec_version=6):
+        """Write the DDEC net charge and R cubed moment files which the LennardJones class reads."""
+
+        elements, coords = self.structure('qm' if self.molecule.molecule['qm'] else 'input')
+
+        charges = zeros(len(elements))
+        for i, j in self.molecule.topology.edges:
+            shift = 0.15 * (self.electronegativity[elements[j - 1]] - self.electronegativity[elements[i - 1]])
+            charges[i - 1] += shift
+            charges[j - 1] -= shift
+
+        # Spread any net charge evenly and round as Chargemol does, with the last atom taking the rounding error
+        charges = [round(charge, 6) for charge in charges + self.charge / len(elements)]
+        charges[-1] = round(self.charge - sum(charges[:-1]), 6)
+
+        net_charge_file = ('DDEC6_even_tempered_net_atomic_charges.xyz' if ddec_version == 6 else
+                           'DDEC3_net_atomic_charges.xyz')
+
+        with open(net_charge_file, 'w+') as charge_file:
+            charge_file.write(f'{len(elements)}\nFake DDEC{ddec_version} net atomic charges\n')
+            for element, (x, y, z), charge in zip(elements, coords, charges):
+                charge_file.write(f'{element} {x: .6f} {y: .6f} {z: .6f} {charge: .6f}\n')
+            charge_file.write('\n The following XYZ coordinates are in angstroms. '
+                              'The atomic dipoles and quadrupoles are in atomic units.\n')
+            charge_file.write(' atom number, atomic symbol, x, y, z, net_charge, dipole_x, dipole_y, dipole_z\n')
+            for i, (element, (x, y, z), charge) in enumerate(zip(elements, coords, charges), 1):
+                charge_file.write(f'{i} {element} {x: .6f} {y: .6f} {z: .6f} {charge: .6f} '
+                                  f'{0.0: .6f} {0.0: .6f} {0.0: .6f}\n')
+
+        with open('DDEC_atomic_Rcubed_moments.xyz', 'w+') as vol_file:
+            vol_file.write(f'{len(elements)}\nFake DDEC atomic Rcubed moments\n')
+            for element, (x, y, z), charge in zip(elements, coords, charges):
+                # Electron poor atoms shrink, electron rich atoms swell
+                vol_file.write(f'{element} {x: .6f} {y: .6f} {z: .6f} '
+                               f'{self.free_volumes[element] * (1 - 0.2 * charge): .6f}\n')
+
+        append_to_log(f'Fake DDEC{ddec_version} charges written', 'minor')
+
+
 @for_all_methods(timer_logger)
 class ONETEP(Engines):
+    """
+    Writes ONETEP input (.dat) files for linear-scaling DFT density calculations.
+    The simulation cell is the smallest box which holds the molecule plus a padding margin,
+    since the cell size directly sets the cost of the calculation.
+    Batches of inputs can also be written with a job array script so many structures (e.g. a protein campaign)
+    can be submitted as one job.
+    """
 
-    def __init__(self, molecule, config_dict):
+    # ONETEP xc_functional keywords by the theory names used for PSI4 and Gaussian
+    functionals = {'LDA': 'LDA', 'SVWN': 'LDA', 'PBE': 'PBE', 'PBEPBE': 'PBE', 'PW91': 'PW91', 'PW91PW91': 'PW91',
+                   'BLYP': 'BLYP', 'B3LYP': 'B3LYP', 'PBE0': 'PBE0', 'PBE1PBE': 'PBE0', 'REVPBE': 'REVPBE',
+                   'RPBE': 'RPBE', 'PBESOL': 'PBESOL'}
+
+    def __init__(self, molecule, config_dict, ngwf_radius=7.0, padding=None, cutoff=800):
+        """
+        ngwf_radius             Radius of the NGWF localisation spheres (bohr)
+        padding                 Vacuum margin between the molecule and each cell wall (bohr);
+                                defaults to the NGWF radius plus 3 bohr so no NGWF sphere touches its periodic image.
+        cutoff                  Psinc kinetic energy cutoff (eV)
+        """
 
         super().__init__(molecule, config_dict)
 
-    def generate_input(self, input_type='input', density=False, solvent=False):
-        """ONETEP takes a xyz input file."""
+        self.ngwf_radius = ngwf_radius
+        self.padding = padding if padding is not None else ngwf_radius + 3.0
+        self.cutoff = cutoff
+        self.bohr_to_angs = 0.529177
+
+        # Theories ONETEP does not have (e.g. the recommended wB97XD) fall back to PBE rather than stopping the run
+        theory = self.qm.get('theory', 'PBE')
+        self.xc_functional = self.functionals.get(theory.upper(), 'PBE')
+        if theory.upper() not in self.functionals:
+            append_to_log(f'The {theory} functional is not available in ONETEP; the inputs use {self.xc_functional}. '
+                          f'Set the theory to one of {", ".join(sorted(set(self.functionals.values())))} '
+                          f'to choose another', 'warning')
+            print(f'The {theory} functional is not available in ONETEP; using {self.xc_functional}.')
+
+    def generate_input(self, input_type='input', density=False, solvent=False, name=None):
+        """
+        Write the ONETEP input file for the molecule with a minimal cell.
+        The xyz file is still written as it is needed to restart the analysis after the ONETEP run.
+        """
+
+        name = name if name is not None else self.molecule.name
 
         if density:
             self.molecule.write_xyz(input_type=input_type)
 
-        # should we make a onetep run file? this is quite specific?
-        print('Run this file in ONETEP.')
+        geometry = self.molecule.molecule[input_type]
+        elements = list(geometry.elements)
+
+        positions, lattice = self.minimal_cell(geometry.coords)
+        self.write_dat(name, elements, positions, lattice, solvent=solvent)
+
+        append_to_log(f'ONETEP input {name}.dat written with a {lattice[0]:.2f} x {lattice[1]:.2f} x '
+                      f'{lattice[2]:.2f} angstrom cell', 'minor')
+
+        print(f'Run {name}.dat in ONETEP.')
+
+    def minimal_cell(self, coords, lattice=None):
+        """
+        Find the tightest orthorhombic cell for the coordinates (angstroms).
+        Only the convex hull vertices matter for the extent of the molecule, so the box is fitted to those.
+        Both the input orientation and the principal axes of the hull are tried and the smaller box kept.
+        The molecule is then shifted so it sits in the centre of the cell.
+        If a lattice is given (e.g. a shared cell for a batch) the molecule is centred in that instead.
+        Returns the new positions (angstroms) and the three cell lengths (angstroms).
+        """
+
+        # Hulls need 4 non-coplanar points; small or flat molecules just use every atom
+        try:
+            vertices = coords[ConvexHull(coords).vertices]
+        except (QhullError, ValueError):
+            vertices = coords
+
+        centred = coords - vertices.mean(axis=0)
+        centred_vertices = vertices - vertices.mean(axis=0)
+
+        orientations = [eye(3)]
+        if len(vertices) > 2:
+            # Principal axes of the hull vertices; flip one if needed so this is a rotation not a reflection
+            principal = linalg.eigh(centred_vertices.T @ centred_vertices)[1]
+            if linalg.det(principal) < 0:
+                principal[:, 2] *= -1
+            orientations.append(principal)
+
+        best = None
+        for axes in orientations:
+            rotated = centred_vertices @ axes
+            extent = rotated.max(axis=0) - rotated.min(axis=0)
+            if best is None or prod(extent) < prod(best[1]):
+                best = (axes, extent)
+
+        axes = best[0]
+        rotated = centred @ axes
+
+        padding = self.padding * self.bohr_to_angs
+        if lattice is None:
+            lattice = rotated.max(axis=0) - rotated.min(axis=0) + 2 * padding
+
+        # Put the middle of the molecule in the middle of the cell
+        positions = rotated - (rotated.max(axis=0) + rotated.min(axis=0)) / 2 + array(lattice) / 2
+
+        return positions, array(lattice)
+
+    def ngwf_count(self, element):
+        """Number of NGWFs: 1 for hydrogen, 4 (s + p) for the first row and 9 (s + p + d) for anything heavier."""
+
+        number = atomic_numbers[element.title()]
+
+        if number <= 2:
+            return 1
+
+        return 4 if number <= 10 else 9
+
+    def write_dat(self, name, elements, positions, lattice, solvent=False):
+        """Write a complete ONETEP single point input file with DDEC analysis and density output."""
+
+        species = sorted(set(elements), key=elements.index)
+
+        with open(f'{name}.dat', 'w+') as dat:
+
+            dat.write(f'task : SINGLEPOINT\ncutoff_energy : {self.cutoff} eV\n')
+            dat.write(f'xc_functional : {self.xc_functional}\n')
+            dat.write(f'charge : {self.charge}\nspin : {self.multiplicity - 1}\n')
+            dat.write('ngwf_threshold_orig : 0.000002\nmaxit_ngwf_cg : 100\n')
+            dat.write('write_denskern : T\nwrite_tightbox_ngwfs : T\n')
+            dat.write('write_density_plot : T\ncube_format : T\n')
+            dat.write('ddec_calculate : T\nddec_moment : 3\n')
+
+            if solvent:
+                dat.write('is_implicit_solvent : T\nis_include_apolar : T\nis_smeared_ion_rep : T\n')
+                dat.write('is_bulk_permittivity : 78.54\n')
+
+            dat.write('\n%block lattice_cart\nang\n')
+            for axis in range(3):
+                row = [0.0, 0.0, 0.0]
+                row[axis] = lattice[axis]
+                dat.write(f'  {row[0]:14.8f}  {row[1]:14.8f}  {row[2]:14.8f}\n')
+            dat.write('%endblock lattice_cart\n')
+
+            dat.write('\n%block positions_abs\nang\n')
+            dat.write(format_rows('%-3s %14.8f  %14.8f  %14.8f\n', elements, *positions.T))
+            dat.write('%endblock positions_abs\n')
+
+            # Species label, element, atomic number, number of NGWFs, NGWF radius (bohr)
+            dat.write('\n%block species\n')
+            for element in species:
+                dat.write(f'{element:<3} {element.title():<3} {atomic_numbers[element.title()]:3} '
+                          f'{self.ngwf_count(element):2} {self.ngwf_radius:.2f}\n')
+            dat.write('%endblock species\n')
+
+            dat.write('\n%block species_pot\n')
+            for element in species:
+                dat.write(f'{element:<3} "{element.title()}.recpot"\n')
+            dat.write('%endblock species_pot\n')
+
+    def generate_batch(self, molecules, input_type='input', folder='onetep_batch', shared_cell=False,
+                       solvent=False, executable='onetep'):
+        """
+        Write one ONETEP input for each molecule into folder, plus a job list and a SLURM job array script
+        so the whole set can be submitted at once with: sbatch submit_array.sh
+        If shared_cell is True, every input uses the largest of the minimal cells so all jobs have the same grid.
+        """
+
+        makedirs(folder, exist_ok=True)
+
+        structures = []
+        for molecule in molecules:
+            geometry = molecule.molecule[input_type]
+            structures.append((molecule.name, list(geometry.elements), geometry.coords,
+                               self.minimal_cell(geometry.coords)))
+
+        shared = None
+        if shared_cell:
+            shared = array([structure[3][1] for structure in structures]).max(axis=0)
+
+        home = getcwd()
+        chdir(folder)
+
+        try:
+            with open('jobs.txt', 'w+') as jobs:
+                for name, elements, coords, (positions, lattice) in structures:
+                    if shared is not None:
+                        positions, lattice = self.minimal_cell(coords, lattice=shared)
+
+                    self.write_dat(name, elements, positions, lattice, solvent=solvent)
+                    jobs.write(f'{name}\n')
+
+            with open('submit_array.sh', 'w+') as script:
+                script.write(f'#!/bin/bash\n#SBATCH --job-name=QUBEKit_onetep\n#SBATCH --array=1-{len(structures)}\n')
+                script.write(f'#SBATCH --cpus-per-task={self.qm.get("threads", 1)}\n\n')
+                script.write(f'export OMP_NUM_THREADS={self.qm.get("threads", 1)}\n')
+                script.write('NAME=$(sed -n "${SLURM_ARRAY_TASK_ID}p" jobs.txt)\n')
+                script.write(f'{executable} $NAME.dat > $NAME.out\n')
+
+        finally:
+            chdir(home)
+
+        append_to_log(f'{len(structures)} ONETEP inputs written to {folder}', 'minor')
 
     def calculate_hull(self):
 
-        coords = array([atom[1:] for atom in self.molecule.molecule['input']])
+        coords = self.molecule.molecule['input'].coords
 
         hull = ConvexHull(coords)
 
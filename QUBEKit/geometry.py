@@ -0,0 +1,514 @@
+#!/usr/bin/env python
+
+"""
+Array backed storage for molecular structures.
+Each structure is held as an array of element symbols and an (N, 3) float64 array of coordinates
+rather than a list of [element, x, y, z] lists; list style access still works through light weight views
+so existing code can index, iterate and assign atoms exactly as before.
+"""
+
+from numpy import array, empty, float64, concatenate, array_equal, asarray, intp, cross, arctan2, arccos, degrees, \
+    clip, einsum, sqrt, full, nan, load as load_array, save as save_array
+
+from itertools import count
+
+
+# Atomic numbers of the elements QUBEKit can handle
+atomic_numbers = {'H': 1, 'C': 6, 'N': 7, 'O': 8, 'F': 9, 'P': 15, 'S': 16, 'Cl': 17, 'Br': 35, 'I': 53}
+
+# Every change of coordinates takes the next of these as the version of its Geometry
+versions = count(1)
+
+
+def term_indices(terms, size):
+    """Integer (n, size) array from a list of index tuples, or any array like; an empty list gives shape (0, size)."""
+
+    return asarray(list(terms) if not hasattr(terms, 'shape') else terms, dtype=intp).reshape(-1, size)
+
+
+def bond_lengths(coords, bonds):
+    """
+    Lengths of all the bonds at once.
+    coords          (N, 3) coordinates, or an (M, N, 3) stack of frames such as a torsion scan
+    bonds           (n, 2) atom indices (counted from 0)
+    Returns an (n,) array, or (M, n) for a stack of frames, in the units of the coordinates.
+    """
+
+    bonds = term_indices(bonds, 2)
+    vectors = coords[..., bonds[:, 1], :] - coords[..., bonds[:, 0], :]
+
+    return sqrt(einsum('...i,...i->...', vectors, vectors))
+
+
+def angle_values(coords, angles):
+    """
+    Angles (degrees) of all the (n, 3) atom index triples at once, with the central atom in the middle.
+    Accepts the same (N, 3) or (M, N, 3) coordinates as bond_lengths.
+    """
+
+    angles = term_indices(angles, 3)
+    b1 = coords[..., angles[:, 0], :] - coords[..., angles[:, 1], :]
+    b2 = coords[..., angles[:, 2], :] - coords[..., angles[:, 1], :]
+
+    cosine = einsum('...i,...i->...', b1, b2) / sqrt(einsum('...i,...i->...', b1, b1) *
+                                                     einsum('...i,...i->...', b2, b2))
+
+    # Rounding can push the cosine of linear angles just outside [-1, 1]
+    return degrees(arccos(clip(cosine, -1, 1)))
+
+
+def dihedral_values(coords, dihedrals):
+    """
+    Dihedral angles (degrees, -180 to 180) of all the (n, 4) atom index quadruples at once.
+    Accepts the same (N, 3) or (M, N, 3) coordinates as bond_lengths.
+    """
+
+    dihedrals = term_indices(dihedrals, 4)
+    x1, x2, x3, x4 = (coords[..., dihedrals[:, i], :] for i in range(4))
+    b1, b2, b3 = x2 - x1, x3 - x2, x4 - x3
+
+    cross_12, cross_23 = cross(b1, b2), cross(b2, b3)
+
+    t1 = sqrt(einsum('...i,...i->...', b2, b2)) * einsum('...i,...i->...', b1, cross_23)
+    t2 = einsum('...i,...i->...', cross_12, cross_23)
+
+    return degrees(arctan2(t1, t2))
+
+
+class AtomView:
+    """
+    List style view of one atom in a Geometry: [element, x, y, z].
+    Reads and writes go straight through to the geometry arrays.
+    """
+
+    __slots__ = ('geometry', 'index')
+
+    def __init__(self, geometry, index):
+
+        self.geometry = geometry
+        self.index = index
+
+    def __repr__(self):
+        return repr(self.to_list())
+
+    def __len__(self):
+        return 4
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __eq__(self, other):
+
+        try:
+            return self.to_list() == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __getitem__(self, item):
+
+        if isinstance(item, slice):
+            return self.to_list()[item]
+
+        if item < 0:
+            item += 4
+
+        if item == 0:
+            return str(self.geometry.elements[self.index])
+
+        if 0 < item < 4:
+            return float(self.geometry.coords[self.index, item - 1])
+
+        raise IndexError('Atom index out of range; atoms are [element, x, y, z].')
+
+    def __setitem__(self, item, value):
+
+        if isinstance(item, slice):
+            for pos, val in zip(range(4)[item], value):
+                self[pos] = val
+            return
+
+        if item < 0:
+            item += 4
+
+        if item == 0:
+            self.geometry.elements[self.index] = value
+
+        elif 0 < item < 4:
+            # The coordinates are only writable here, so the change always gives the geometry a new version
+            coords = self.geometry.coords
+            coords.flags.writeable = True
+            try:
+                coords[self.index, item - 1] = value
+            finally:
+                coords.flags.writeable = False
+            self.geometry.version = next(versions)
+
+        else:
+            raise IndexError('Atom index out of range; atoms are [element, x, y, z].')
+
+    def to_list(self):
+        """Return the atom as a new [element, x, y, z] list."""
+
+        x, y, z = self.geometry.coords[self.index]
+        return [str(self.geometry.elements[self.index]), float(x), float(y), float(z)]
+
+
+class Geometry:
+    """
+    One structure of a molecule:
+        elements        (N,) array of the element symbols
+        coords          (N, 3) float64 array of the coordinates (angstroms)
+    Behaves like the old list of [element, x, y, z] lists: indexing gives AtomView objects,
+    slicing gives lists of them, and atoms can be compared to, or replaced by, plain lists.
+    The coordinates array is read only: move atoms through their views or assign a new array.
+    Either gives the geometry a new version, which is all measurements from it need to be checked against.
+    """
+
+    __slots__ = ('elements', '_coords', 'version')
+
+    def __init__(self, elements=None, coords=None):
+
+        self.elements = array(elements if elements is not None else [], dtype='<U2')
+        self.coords = coords if coords is not None else empty((0, 3), dtype=float64)
+
+        if len(self.elements) != len(self.coords):
+            raise ValueError(f'{len(self.elements)} elements given for {len(self.coords)} coordinates.')
+
+    @property
+    def coords(self):
+        return self._coords
+
+    @coords.setter
+    def coords(self, coords):
+
+        coords = array(coords, dtype=float64).reshape(-1, 3)
+        coords.flags.writeable = False
+
+        self._coords = coords
+        self.version = next(versions)
+
+    def __getstate__(self):
+        return {'elements': self.elements, 'coords': self.coords}
+
+    def __setstate__(self, state):
+        """Geometries pickled before the coordinates were versioned give (None, slots) rather than a dictionary."""
+
+        if isinstance(state, tuple):
+            state = state[1]
+
+        self.elements = state['elements']
+        # Unpickled or copied coordinates always get a new version, so versions from other processes never clash
+        self.coords = state['coords']
+
+    @classmethod
+    def from_list(cls, atoms):
+        """Build a Geometry from a list of [element, x, y, z] lists (or any iterable of atoms)."""
+
+        atoms = [atom.to_list() if isinstance(atom, AtomView) else atom for atom in atoms]
+
+        return cls([atom[0] for atom in atoms], [atom[1:4] for atom in atoms])
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.to_list()!r})'
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __iter__(self):
+        return (AtomView(self, index) for index in range(len(self)))
+
+    def __getitem__(self, item):
+
+        if isinstance(item, slice):
+            return [AtomView(self, index) for index in range(len(self))[item]]
+
+        if item < 0:
+            item += len(self)
+
+        if not 0 <= item < len(self):
+            raise IndexError('Geometry index out of range.')
+
+        return AtomView(self, item)
+
+    def __setitem__(self, item, atom):
+
+        self[item][:] = atom
+
+    def __eq__(self, other):
+
+        if isinstance(other, Geometry):
+            return array_equal(self.elements, other.elements) and array_equal(self.coords, other.coords)
+
+        try:
+            return self.to_list() == [list(atom) for atom in other]
+        except TypeError:
+            return NotImplemented
+
+    def index(self, atom):
+        """Position of the first atom equal to atom, like list.index."""
+
+        for pos, view in enumerate(self):
+            if view == atom:
+                return pos
+
+        raise ValueError(f'{atom} is not in the geometry.')
+
+    def append(self, atom):
+        """Add an atom to the end; this copies the arrays so build whole geometries with from_list where possible."""
+
+        self.elements = concatenate([self.elements, array([atom[0]], dtype='<U2')])
+        self.coords = concatenate([self.coords, array([atom[1:4]], dtype=float64)])
+
+    def copy(self):
+        return Geometry(self.elements.copy(), self.coords)
+
+    @property
+    def atomic_numbers(self):
+        """(N,) array of the atomic numbers."""
+
+        return array([atomic_numbers[element.title()] for element in self.elements], dtype=int)
+
+    def to_list(self):
+        """Return the structure as a new list of [element, x, y, z] lists."""
+
+        return [[str(element), float(x), float(y), float(z)] for element, (x, y, z) in
+                zip(self.elements, self.coords)]
+
+
+class Geometries(dict):
+    """
+    Dictionary of named Geometry objects ('input', 'mm', 'qm' ...).
+    Lists of [element, x, y, z] lists are converted to Geometry objects when they are assigned.
+    """
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__()
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+
+        if not isinstance(value, Geometry):
+            value = Geometry.from_list(value)
+
+        super().__setitem__(key, value)
+
+    def update(self, *args, **kwargs):
+
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+
+        if key not in self:
+            self[key] = default if default is not None else []
+
+        return self[key]
+
+
+class Conformers:
+    """
+    A set of structures of one molecule, such as the frames of a torsion scan, with what is known about each:
+        coords          (M, N, 3) float64 array of the coordinates (angstroms)
+        qm_energy       (M,) QM energies (hartree)
+        mm_energy       (M,) MM energies (kcal / mol)
+        dihedral        (M,) values of the driven dihedral (degrees)
+        source          (M,) where each structure came from, e.g. 'qm scan' or 'mm drive'
+    Values which are not known are nan. Space is added in blocks so appending does not copy the arrays every time;
+    conformers[i] is the (N, 3) coordinates of one structure and slicing gives a Conformers sharing the arrays.
+    """
+
+    fields = ('qm_energy', 'mm_energy', 'dihedral')
+
+    def __init__(self, coords=None, source='', **metadata):
+
+        coords = empty((0, 0, 3), dtype=float64) if coords is None else array(coords, dtype=float64)
+        if coords.ndim == 2:
+            coords = coords[None]
+
+        self._coords = coords
+        self._data = {field: full(len(coords), nan) for field in self.fields}
+        self._source = full(len(coords), source, dtype='<U32')
+        self.count = len(coords)
+
+        for field, values in metadata.items():
+            if field not in self._data:
+                raise KeyError(f'{field} is not stored for conformers; use one of {", ".join(self.fields)}.')
+            self._data[field][:] = values
+
+    @classmethod
+    def from_xyz(cls, filename, source='', energy='qm_energy'):
+        """
+        Read every frame of a multi-structure xyz file such as a torsiondrive scan.xyz or a geometric scan-final.xyz.
+        Energies are read from 'Energy' in the comment lines into the energy field (or not at all if it is None),
+        and dihedrals from torsiondrive's 'Dihedral (angle,)'.
+        """
+
+        with open(filename, 'r') as xyz_file:
+            lines = xyz_file.readlines()
+
+        atoms = int(lines[0])
+        frames = len(lines) // (atoms + 2)
+
+        coords = array([line.split()[1:4] for frame in range(frames)
+                        for line in lines[frame * (atoms + 2) + 2:(frame + 1) * (atoms + 2)]], dtype=float64)
+        conformers = cls(coords.reshape(frames, atoms, 3), source=source)
+
+        for frame, comment in enumerate(lines[1::atoms + 2][:frames]):
+            words = comment.split()
+            if energy is not None and 'Energy' in words:
+                conformers.metadata[energy][frame] = float(words[words.index('Energy') + 1])
+            if 'Dihedral' in words:
+                conformers.dihedral[frame] = float(comment.split('(')[1].split(',')[0])
+
+        return conformers
+
+    @classmethod
+    def load(cls, filename, mmap_mode=None):
+        """Load conformers written by save; mmap_mode='r' maps the file rather than reading it in."""
+
+        data = load_array(filename, mmap_mode=mmap_mode)
+
+        conformers = cls.__new__(cls)
+        conformers._coords = data['coords']
+        conformers._data = {field: data[field] for field in cls.fields}
+        conformers._source = data['source']
+        conformers.count = len(data)
+
+        return conformers
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({len(self)} structures of {self.coords.shape[1]} atoms)'
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.coords)
+
+    def __getitem__(self, item):
+
+        if not isinstance(item, slice):
+            return self.coords[item]
+
+        # Views of the arrays; appending to the slice moves it onto arrays of its own
+        conformers = self.__class__.__new__(self.__class__)
+        conformers._coords = self.coords[item]
+        conformers._data = {field: values[item] for field, values in self.metadata.items()}
+        conformers._source = self.source[item]
+        conformers.count = len(conformers._coords)
+
+        return conformers
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state['_coords'] = self.coords.copy()
+        state['_data'] = {field: values.copy() for field, values in self.metadata.items()}
+        state['_source'] = self.source.copy()
+
+        return state
+
+    @property
+    def coords(self):
+        """(M, N, 3) array of the coordinates (angstroms) of every structure."""
+
+        return self._coords[:self.count]
+
+    @property
+    def metadata(self):
+        """Dictionary of the (M,) arrays of qm_energy, mm_energy and dihedral values."""
+
+        return {field: values[:self.count] for field, values in self._data.items()}
+
+    @property
+    def qm_energy(self):
+        return self._data['qm_energy'][:self.count]
+
+    @property
+    def mm_energy(self):
+        return self._data['mm_energy'][:self.count]
+
+    @property
+    def dihedral(self):
+        return self._data['dihedral'][:self.count]
+
+    @property
+    def source(self):
+        return self._source[:self.count]
+
+    def reserve(self, extra, atoms):
+        """Make room for extra more structures of atoms atoms, growing the arrays by at least half their size."""
+
+        if self.count and atoms != self._coords.shape[1]:
+            raise ValueError(f'Structures of {atoms} atoms can not be added to conformers of '
+                             f'{self._coords.shape[1]} atoms.')
+
+        if self.count + extra <= len(self._coords) and atoms == self._coords.shape[1]:
+            return
+
+        size = max(16, self.count + extra, len(self._coords) * 3 // 2)
+
+        coords = empty((size, atoms, 3), dtype=float64)
+        if self.count:
+            coords[:self.count] = self.coords
+        self._coords = coords
+
+        for field, values in self.metadata.items():
+            self._data[field] = concatenate([values, full(size - self.count, nan)])
+        self._source = concatenate([self.source, full(size - self.count, '', dtype='<U32')])
+
+    def append(self, coords, source='', **metadata):
+        """Add one (N, 3) structure, with any of qm_energy, mm_energy and dihedral."""
+
+        coords = asarray(coords, dtype=float64).reshape(-1, 3)
+        self.reserve(1, len(coords))
+
+        self._coords[self.count] = coords
+        self._source[self.count] = source
+        for field, value in metadata.items():
+            self._data[field][self.count] = value
+
+        self.count += 1
+
+    def extend(self, conformers):
+        """Add every structure of another Conformers, with its values, in one go."""
+
+        if not len(conformers):
+            return
+
+        self.reserve(len(conformers), conformers.coords.shape[1])
+
+        new = slice(self.count, self.count + len(conformers))
+        self._coords[new] = conformers.coords
+        self._source[new] = conformers.source
+        for field, values in conformers.metadata.items():
+            self._data[field][new] = values
+
+        self.count += len(conformers)
+
+    def copy(self):
+
+        conformers = self.__class__.__new__(self.__class__)
+        conformers.__dict__.update(self.__getstate__())
+
+        return conformers
+
+    def to_openmm(self, item):
+        """Positions of one structure as an OpenMM Quantity in nanometres, ready for context.setPositions."""
+
+        from simtk import unit
+
+        return unit.Quantity(self.coords[item] / 10, unit.nanometer)
+
+    def save(self, filename):
+        """Write the structures and their values to one .npy file (a structured array, no pickling needed)."""
+
+        columns = [('coords', float64, self.coords.shape[1:])] + [(field, float64) for field in self.fields]
+        data = empty(len(self), dtype=columns + [('source', '<U32')])
+        data['coords'] = self.coords
+        for field, values in self.metadata.items():
+            data[field] = values
+        data['source'] = self.source
+
+        save_array(filename, data)
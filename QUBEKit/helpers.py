@@ -1,13 +1,18 @@
 #!/usr/bin/env python
 
 from csv import DictReader, writer, QUOTE_MINIMAL
-from os import walk, listdir, path, system
+from os import walk, listdir, path, system, makedirs, replace, remove, fsync
 from collections import OrderedDict
+from collections.abc import Mapping
 from numpy import allclose
 from pathlib import Path
 from configparser import ConfigParser
-from pickle import load
+from pickle import load, loads, dumps, HIGHEST_PROTOCOL
 from contextlib import contextmanager
+from shutil import rmtree
+from tempfile import NamedTemporaryFile, mkdtemp
+from urllib.parse import quote, unquote
+from zlib import compress, decompress
 
 
 class Configure:
@@ -20,13 +25,16 @@ class Configure:
     config_folder = f'{home}/QUBEKit_configs/'
     master_file = 'master_config.ini'
 
+    # Results which are expensive to recompute (such as DDEC partitioning) are cached here between runs
+    cache_folder = f'{home}/QUBEKit_cache/'
+
     # QuBeKit config file allows users to reset the global variables
 
     qm = {
         'theory': 'B3LYP',              # Theory to use in freq and dihedral scans recommended e.g. wB97XD or B3LYP
         'basis': '6-311++G(d,p)',       # Basis set
         'vib_scaling': '0.991',         # Associated scaling to the theory
-        'threads': '6',                 # Number of processors used in Gaussian09; affects the bonds and dihedral scans
+        'threads': '6',                 # Number of processors used in Gaussian09 and Chargemol; affects the bonds, dihedral scans and charges
         'memory': '2',                  # Amount of memory (in GB); specified in the Gaussian09 scripts
         'convergence': 'GAU_TIGHT',     # Criterion used during optimisations; works using PSI4, GeomeTRIC and G09
         'iterations': '100',            # Max number of optimisation iterations
@@ -60,7 +68,7 @@ class Configure:
         'theory': ';Theory to use in freq and dihedral scans recommended wB97XD or B3LYP, for example',
         'basis': ';Basis set',
         'vib_scaling': ';Associated scaling to the theory',
-        'threads': ';Number of processors used in g09; affects the bonds and dihedral scans',
+        'threads': ';Number of processors used in g09 and chargemol; affects the bonds, dihedral scans and charges',
         'memory': ';Amount of memory (in GB); specified in the g09 and PSI4 scripts',
         'convergence': ';Criterion used during optimisations; works using psi4 and geometric so far',
         'iterations': ';Max number of optimisation iterations',
@@ -409,25 +417,191 @@ def set_dict_val(file_name, search_term):
     return False
 
 
-def unpickle():
+class StateStore(Mapping):
     """
-    Function to unpickle a set of ligand objects from the pickle file, and return a dictionary of ligands
-    indexed by their progress.
+    Store of the molecule object at each stage of the analysis, kept in the (hidden) .QUBEKit_states folder.
+
+    Each state is pickled to its own file, so saving a stage never reads or rewrites the others
+    and loading a state only unpickles that one file. The store reads like a dictionary of molecules indexed
+    by their state, in the order the states were first saved; molecules are only unpickled when they are accessed.
+
+    Each file is a zlib compressed pickle, so the molecules' slim pickled form (see Molecule.__getstate__) stays small.
+    Files are written to a temporary file and then renamed over the old one, so a crash part way through
+    a write leaves the previous copy of that state intact. The order of the states is kept in an index file;
+    any state file missing from it (from a crash between the two writes) is still found and is put last.
+
+    A .QUBEKit_states pickle jar from older versions (one file holding every state) can still be read,
+    and is converted into a folder the first time a new state is saved. The folder is built under a temporary name
+    and only swapped in for the jar once it is complete; the jar is kept as .QUBEKit_states.old until then,
+    and is read from there if a crash leaves neither the jar nor the folder in place.
     """
 
-    mol_states = OrderedDict()
+    index_file = 'index.txt'
+
+    # State files are zlib compressed pickles marked with this header
+    magic = b'QUBEKit-state\n'
+    compression_level = 1
+
+    def __init__(self, folder='.QUBEKit_states'):
+
+        self.folder = folder
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(folder={self.folder!r}, states={list(self)})'
+
+    def state_file(self, state, folder=None):
+        """File name of a state; states are stored under their (quoted) string names."""
+
+        return path.join(self.folder if folder is None else folder, f'{quote(str(state), safe="")}.pkl')
+
+    def legacy_jar(self):
+        """
+        File name of the old style pickle jar to read the states from, or None if the states are in a folder:
+        the jar itself, or the copy kept during its conversion if the conversion did not finish.
+        """
+
+        if path.isfile(self.folder):
+            return self.folder
+
+        if not path.exists(self.folder) and path.isfile(f'{self.folder}.old'):
+            return f'{self.folder}.old'
+
+        return None
+
+    def legacy_states(self):
+        """Read every state from an old style single file pickle jar."""
+
+        mol_states = OrderedDict()
+
+        with open(self.legacy_jar(), 'rb') as jar:
+            while True:
+                try:
+                    mol = load(jar)
+                    mol_states[str(mol.state)] = mol
+                except EOFError:
+                    break
+
+        return mol_states
+
+    def __iter__(self):
+
+        if self.legacy_jar() is not None:
+            return iter(self.legacy_states())
+
+        if not path.isdir(self.folder):
+            return iter([])
+
+        try:
+            with open(path.join(self.folder, self.index_file), 'r') as index:
+                states = [unquote(line.strip()) for line in index if line.strip()]
+        except FileNotFoundError:
+            states = []
+
+        # Only list states whose files exist; add any which were saved but never indexed, oldest first
+        states = list(OrderedDict.fromkeys(state for state in states if path.exists(self.state_file(state))))
+        stray = [file_name for file_name in listdir(self.folder)
+                 if file_name.endswith('.pkl') and unquote(file_name[:-4]) not in states]
+        stray.sort(key=lambda file_name: path.getmtime(path.join(self.folder, file_name)))
+
+        return iter(states + [unquote(file_name[:-4]) for file_name in stray])
+
+    def __len__(self):
+        return len(list(iter(self)))
 
-    # unpickle the pickle jar
-    # try to load a pickle file make sure to get all objects
-    with open('.QUBEKit_states', 'rb') as jar:
-        while True:
+    def __contains__(self, state):
+
+        if self.legacy_jar() is not None:
+            return str(state) in self.legacy_states()
+
+        return path.exists(self.state_file(state))
+
+    def __getitem__(self, state):
+
+        if self.legacy_jar() is not None:
+            return self.legacy_states()[str(state)]
+
+        try:
+            with open(self.state_file(state), 'rb') as state_file:
+                payload = state_file.read()
+
+        except FileNotFoundError:
+            raise KeyError(f'No {state} state has been saved in {self.folder}.')
+
+        # Files written before compression was added are plain pickles
+        if payload.startswith(self.magic):
+            payload = decompress(payload[len(self.magic):])
+
+        return loads(payload)
+
+    def save(self, molecule, state=None):
+        """Pickle the molecule as the given state (default: molecule.state), replacing any older copy of that state."""
+
+        state = str(molecule.state if state is None else state)
+
+        # Convert an old single file jar to a folder first
+        if self.legacy_jar() is not None:
+            self.convert_jar()
+        elif path.isdir(self.folder) and path.isfile(f'{self.folder}.old'):
+            # A conversion which finished swapping in the folder but not removing the jar
+            remove(f'{self.folder}.old')
+
+        makedirs(self.folder, exist_ok=True)
+        self.write_state(state, molecule)
+
+    def convert_jar(self):
+        """
+        Convert an old style pickle jar into a state folder. The folder is written under a temporary name,
+        then the jar is moved aside to .old and the folder renamed into its place; the jar is only removed after.
+        """
+
+        jar = self.legacy_jar()
+        states = self.legacy_states()
+
+        temp = mkdtemp(dir=path.dirname(path.abspath(self.folder)), prefix=f'{path.basename(self.folder)}.')
+        try:
+            for old_state, old_molecule in states.items():
+                self.write_state(old_state, old_molecule, folder=temp)
+        except BaseException:
+            rmtree(temp)
+            raise
+
+        if jar == self.folder:
+            replace(self.folder, f'{self.folder}.old')
+        replace(temp, self.folder)
+        remove(f'{self.folder}.old')
+
+    def write_state(self, state, molecule, folder=None):
+        """Atomically (re)write one state file and add the state to the index if it is new."""
+
+        folder = self.folder if folder is None else folder
+        new = not path.exists(self.state_file(state, folder))
+
+        with NamedTemporaryFile('wb', dir=folder, prefix='.', suffix='.tmp', delete=False) as temp:
             try:
-                mol = load(jar)
-                mol_states[mol.state] = mol
-            except EOFError:
-                break
+                temp.write(self.magic + compress(dumps(molecule, protocol=HIGHEST_PROTOCOL), self.compression_level))
+                temp.flush()
+                fsync(temp.fileno())
+            except BaseException:
+                temp.close()
+                remove(temp.name)
+                raise
+
+        replace(temp.name, self.state_file(state, folder))
+
+        if new:
+            with open(path.join(folder, self.index_file), 'a+') as index:
+                index.write(f'{quote(state, safe="")}\n')
+
+
+def unpickle(state=None, folder='.QUBEKit_states'):
+    """
+    Return the StateStore of molecule objects indexed by their progress (molecules are only unpickled when accessed),
+    or just the molecule at the given state.
+    """
+
+    store = StateStore(folder)
 
-    return mol_states
+    return store if state is None else store[state]
 
 
 @contextmanager
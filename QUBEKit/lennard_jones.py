@@ -2,10 +2,11 @@
 
 from QUBEKit.decorators import for_all_methods, timer_logger
 from QUBEKit.helpers import check_net_charge
+from QUBEKit.parameters import NonbondedTable
 
 from os.path import exists
 from collections import OrderedDict
-from numpy import array, cross, dot, sqrt
+from numpy import add, array, bincount, cross, dot, sqrt, zeros
 
 
 @for_all_methods(timer_logger)
@@ -32,7 +33,7 @@ class LennardJones:
         # PI = 57.65240039
         self.epsilon_conversion = 57.65240039
 
-        self.non_bonded_force = {}
+        self.non_bonded_force = NonbondedTable()
 
     def extract_params_chargemol(self):
         """
@@ -165,12 +166,12 @@ class LennardJones:
 
     def calculate_sig_eps(self):
         """
-        Adds the sigma, epsilon terms to the ligand class object as a dictionary.
-        The ligand class object (NonbondedForce) is stored as an empty dictionary until this method is called.
+        Adds the sigma, epsilon terms to the ligand class object as a NonbondedTable.
+        The ligand class object (NonbondedForce) is stored as an empty table until this method is called.
         first_pass argument prevents the sigmas being recalculated (unlike the epsilons).
         """
 
-        # Creates Nonbondedforce dict for later xml creation.
+        # Creates Nonbondedforce table for later xml creation.
         # Format: {0: [charge, sigma, epsilon], 1: [charge, sigma, epsilon], ... }
         # This follows the usual ordering of the atoms such as in molecule.molecule.
 
@@ -188,7 +189,7 @@ class LennardJones:
                 epsilon = (atom[-2] ** 2) / (4 * atom[-1])
                 epsilon *= self.epsilon_conversion
 
-            self.non_bonded_force[pos] = [str(atom[5]), str(sigma), str(epsilon)]
+            self.non_bonded_force[pos] = [atom[5], sigma, epsilon]
 
     def correct_polar_hydrogens(self):
         """
@@ -250,31 +251,27 @@ class LennardJones:
         for pos, atom in enumerate(self.ddec_data):
 
             if atom[-1] == 0:
-                epsilon, self.non_bonded_force[pos][1] = 0, str(0)
+                epsilon, self.non_bonded_force[pos][1] = 0, 0
             else:
                 # epsilon = (b_i ** 2) / (4 * a_i)
                 epsilon = (atom[-2] ** 2) / (4 * atom[-1])
                 epsilon *= self.epsilon_conversion
 
-            self.non_bonded_force[pos] = [str(atom[5]), self.non_bonded_force[pos][1], str(epsilon)]
+            self.non_bonded_force[pos] = [atom[5], self.non_bonded_force[pos][1], epsilon]
 
     def apply_symmetrisation(self):
-        """Using the atoms picked out to be symmetrised apply the symmetry to the charge, sigma and epsilon values"""
-
-        # get the values to be symmetrised
-        for sym_set in self.molecule.symm_hs.values():
-            charges, sigmas, epsilons = [], [], []
-            for atom_set in sym_set:
-                for atom in atom_set:
-                    charges.append(float(self.non_bonded_force[atom - 1][0]))
-                    sigmas.append(float(self.non_bonded_force[atom - 1][1]))
-                    epsilons.append(float(self.non_bonded_force[atom - 1][2]))
-                # calculate the average values to be used in symmetry
-                charge, sigma, epsilon = sum(charges) / len(charges), sum(sigmas) / len(sigmas), sum(epsilons) / len(epsilons)
-
-                # now loop through the atoms again and store the new values
-                for atom in atom_set:
-                    self.non_bonded_force[atom - 1] = [str(charge), str(sigma), str(epsilon)]
+        """
+        Average the charge, sigma and epsilon values over each of the molecule's symmetry classes,
+        so atoms which the bonds and elements cannot tell apart get the same non-bonded parameters.
+        """
+
+        classes = array(self.molecule.symmetry_classes)
+        rows = self.non_bonded_force.rows(range(len(classes)))
+        values = self.non_bonded_force.values
+
+        totals = zeros((classes.max() + 1, values.shape[1]))
+        add.at(totals, classes, values[rows])
+        values[rows] = (totals / bincount(classes)[:, None])[classes]
 
     def extract_extra_sites(self):
         """
@@ -346,10 +343,8 @@ class LennardJones:
 
         # get the parent non bonded values
         for value in sites.values():
-            charge, sigma, eps = self.non_bonded_force[value[0][0]]
             # Change the charge on the first entry
-            charge = float(charge) - value[2]
-            self.non_bonded_force[value[0][0]] = [str(charge), sigma, eps]
+            self.non_bonded_force[value[0][0]][0] -= value[2]
 
     def calculate_non_bonded_force(self):
         """
@@ -1,40 +1,161 @@
 #!/usr/bin/env python
 
 # TODO Add remaining xml methods for Protein class
-# TODO allow reading of different input files on instancing (mol2, xyz, ....)
-# new method read_input this should decided what file reader should be used
 
-from numpy import array, linalg, dot, degrees, cross, arctan2, arccos
-from networkx import neighbors, Graph, has_path
+from QUBEKit.connectivity import perceive_bonds, residue_charge, template_bonds
+from QUBEKit.geometry import Geometry, Geometries, bond_lengths, angle_values, dihedral_values
+from QUBEKit.helpers import StateStore
+from QUBEKit.parameters import AngleTable, BondTable, NonbondedTable, TorsionTable
+from QUBEKit.readers import PDBFile, read_molecules
+from QUBEKit.topology import BondGraph, Topology, canonical_ranks, conflicting_terms, find_bridges, group_dihedrals, \
+    refine_colours, symmetry_classes, term_tuples
+from QUBEKit.writers import XMLWriter, conect_records, format_rows
 
-from xml.etree.ElementTree import tostring, Element, SubElement, ElementTree
-from xml.dom.minidom import parseString
+from numpy import arange, array, bincount, char, column_stack, empty, float64, full, int32, int64, lexsort, minimum, \
+    unique, where, zeros
+from networkx import Graph
+
+from xml.etree.ElementTree import ElementTree, TreeBuilder
 
 from datetime import datetime
-from pickle import dump, load
+from hashlib import sha256
+from os import path
 from re import sub
 from collections import OrderedDict
-from itertools import groupby
+from itertools import combinations, groupby
+
+
+class Derived:
+    """
+    Molecule attribute worked out from the topology by the method named, the first time it is used
+    rather than whenever the molecule is built or updated. Measurements (measured=True) also depend on the geometry
+    they were taken from, which is recorded in Molecule.measured_from ('input' unless the method was asked for another).
+    The value is kept until the topology or the measured coordinates change, which is read from their versions
+    (see BondGraph and Geometry) so checking costs the same for any size of molecule;
+    it is then found again the next time it is used. Assigning a value stores it in the same way, None forgets it.
+    """
+
+    def __init__(self, method, measured=False):
+
+        self.method = method
+        self.measured = measured
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, molecule, owner=None):
+
+        if molecule is None:
+            return self
+
+        value = molecule.__dict__.get(self.name)
+        if molecule.topology is None:
+            return value
+
+        key = self.key(molecule)
+        found = molecule.derived.get(self.name)
+
+        if value is None or (found is not None and found != key):
+            if self.measured:
+                getattr(molecule, self.method)(input_type=molecule.measured_from.get(self.name, 'input'))
+            else:
+                getattr(molecule, self.method)()
+            value = molecule.__dict__[self.name]
+
+        # Values restored from states saved before they were derived are taken as they are
+        elif found is None:
+            molecule.derived[self.name] = key
+
+        return value
+
+    def __set__(self, molecule, value):
+
+        if value is None:
+            molecule.__dict__.pop(self.name, None)
+            molecule.derived.pop(self.name, None)
+            return
+
+        molecule.__dict__[self.name] = value
+        if molecule.topology is not None:
+            molecule.derived[self.name] = self.key(molecule)
+
+    def key(self, molecule):
+        """The versions of the topology, and of the geometry measured, to check the value by."""
+
+        topology = molecule.topology
+        # Plain networkx graphs assigned from outside have no version; their atom and bond ends are counted instead
+        key = (topology.version,) if isinstance(topology, BondGraph) else \
+            (len(topology), sum(map(len, topology.adj.values())))
+
+        if self.measured:
+            input_type = molecule.measured_from.get(self.name, 'input')
+            key += (input_type, molecule.molecule[input_type].version)
+
+        return key
 
 
 class Molecule:
     """Base class for ligands and proteins."""
 
+    # Atomic weight dict
+    element_dict = {'H': 1.008000,  # Group 1
+                    'C': 12.011000,  # Group 4
+                    'N': 14.007000, 'P': 30.973762,  # Group 5
+                    'O': 15.999000, 'S': 32.060000,  # Group 6
+                    'F': 18.998403, 'CL': 35.450000, 'BR': 79.904000, 'I': 126.904470  # Group 7
+                    }
+
+    # Layout version of the pickled state (see __getstate__); pickles without one are from before versioning.
+    # Bump this when the layout changes and teach __setstate__ to read the older versions so old runs can restart.
+    state_version = 2
+
+    # Rebuilt when needed rather than stored
+    transient = ('xml_tree',)
+
+    # Term lists stored as integer arrays, with the number of atoms in each term
+    term_lists = {'angles': 3, 'improper_torsions': 4, 'rotatable': 2}
+
+    # Measurements stored as integer arrays of the terms and float arrays of the values
+    measurements = {'bond_lengths': 2, 'angle_values': 3, 'dih_phis': 4}
+
+    # Derived from the topology (and geometry) when first used, see Derived
+    angles = Derived('find_angles')
+    dihedrals = Derived('find_dihedrals')
+    rotatable = Derived('find_rotatable_dihedrals')
+    symm_hs = Derived('symmetrise_from_topo')
+    symmetry_classes = Derived('find_symmetry_classes')
+    canonical_ranks = Derived('find_canonical_ranks')
+    bond_lengths = Derived('get_bond_lengths', measured=True)
+    angle_values = Derived('get_angle_values', measured=True)
+    dih_phis = Derived('get_dihedral_values', measured=True)
+
+    # Parameter tables, which were dictionaries of strings before state version 2
+    parameter_tables = {'HarmonicBondForce': BondTable, 'HarmonicAngleForce': AngleTable,
+                        'PeriodicTorsionForce': TorsionTable, 'NonbondedForce': NonbondedTable}
+
     def __init__(self, filename, smiles_string=None, combination='opls'):
         """
         # Namings
         filename                str; Full filename e.g. methane.pdb
         name                    str; Molecule name e.g. methane
         smiles                  str; equal to the smiles_string if one is provided
+        charge                  int; net formal charge given by the input file (sdf, mol2, smiles) or found from
+                                the residues of a protein, None otherwise
 
         # Structure
         topology                Graph class object. Contains connection information for molecule
-        molecule                List of lists; Inner list is the atom type followed by its coords
-                                e.g. [['C', -0.022, 0.003, 0.017], ['H', -0.669, 0.889, -0.101], ...]
+        molecule                Geometries dict of the named structures ('input', 'mm', 'qm'); each is a Geometry
+                                holding an element array and an (N, 3) coordinate array (angstroms).
+                                Atoms can still be used as lists e.g. molecule['input'][0] -> ['C', -0.022, 0.003, 0.017]
+                                and lists of [element, x, y, z] lists are converted when assigned.
+        The angles, dihedrals, rotatable bonds, measurements and symmetry groups are only worked out when first used
+        and are found again if the topology or measured geometry changes (see Derived).
+
         angles                  List of tuples; Shows angles based on atom indices (+1) e.g. (1, 2, 4), (1, 2, 5)
         dihedrals               Dictionary of dihedral tuples stored under their common core bond
                                 e.g. {(1,2): [(3, 1, 2, 6), (3, 1, 2, 7)]}
-        rotatable               List of dihedral core tuples [(1,2)]
+        rotatable               List of dihedral core tuples [(1,2)], without methyl and amine/nitrile rotations
         atom_names              List of the atom names taken from the pdb file
         bond_lengths            Dictionary of bond lengths stored under the bond tuple
                                 e.g. {(1, 3): 1.115341203992107} (angstroms)
@@ -42,6 +163,15 @@ class Molecule:
                                 dihedral tuple e.g. {(3, 1, 2, 6): -70.3506776877}  (degrees)
         angle_values             Dictionary of the angle values measured in the molecule object stored under the
                                 angle tuple e.g. {(2, 1, 3): 107.2268} (degrees)
+        symm_hs                 Dictionary of the methyl and amine hydrogen groups (atom indices +1)
+        symmetry_classes        List of the symmetry class of each atom, by atom index; atoms the bonds and
+                                elements cannot tell apart share a class e.g. [0, 1, 2, 2, 2, 3]
+        canonical_ranks         List of the canonical position of each atom, by atom index; the same for the same
+                                molecule with its atoms in any order (see canonical_key and atom_map)
+        improper_torsions       List of the improper torsion tuples, central atom first; found by update()
+        measured_from           Dictionary of the geometry ('input', 'qm' ...) each measurement was taken from,
+                                if not the input e.g. {'bond_lengths': 'qm'}
+        derived                 Dictionary of what each derived attribute was found from, to tell when it is out of date
 
         # XML Info
         xml_tree                An XML class object containing the force field values
@@ -53,14 +183,17 @@ class Molecule:
         -------------------
         This section has different units due to it interacting with OpenMM
 
-        HarmonicBondForce       Dictionary of equilibrium distances and force constants stored under the bond tuple.
+        All are numeric tables (see QUBEKit.parameters) which read like dictionaries of the parameters
+        stored under the term tuple, with arrays of every term (terms) and parameter (values) for bulk work.
+
+        HarmonicBondForce       BondTable of equilibrium distances and force constants stored under the bond tuple.
                                 {(1, 2): [0.108, 405.65]} (nano meters, kj/mol)
-        HarmonicAngleForce      Dictionary of equilibrium angles and force constants stored under the angle tuple
+        HarmonicAngleForce      AngleTable of equilibrium angles and force constants stored under the angle tuple
                                 e.g. {(2, 1, 3): [2.094395, 150.00]} (radians, kj/mol)
-        PeriodicTorsionForce    Dictionary of lists of the torsions values [periodicity, k, phase] stored under the
+        PeriodicTorsionForce    TorsionTable of the torsions values [periodicity, k, phase] stored under the
                                 dihedral tuple with an improper tag only for improper torsions
                                 e.g. {(3, 1, 2, 6): [[1, 0.6, 0 ] [2, 0, 3.141592653589793] .... Improper]}
-        NonbondedForce          OrderedDict; L-J params. Keys are atom index, vals are [charge, sigma, epsilon]
+        NonbondedForce          NonbondedTable; L-J params. Keys are atom index, vals are [charge, sigma, epsilon]
 
         # QUBEKit Internals
         sites                   OrderedDict of virtual site parameters {0: [(top nos parent, a .b), (p1, p2, p3), charge]}
@@ -70,12 +203,15 @@ class Molecule:
 
         # Namings
         self.filename = filename
-        self.name = filename[:-4]
+        self.name = path.splitext(filename)[0]
         self.smiles = smiles_string
+        self.charge = None
 
         # Structure
-        self.molecule = {'qm': [], 'mm': [], 'input': []}
+        self.molecule = Geometries(qm=[], mm=[], input=[])
         self.topology = None
+        self.derived = {}
+        self.measured_from = {}
         self.angles = None
         self.dihedrals = None
         self.improper_torsions = []
@@ -85,6 +221,8 @@ class Molecule:
         self.dih_phis = None
         self.angle_values = None
         self.symm_hs = None
+        self.symmetry_classes = None
+        self.canonical_ranks = None
         self.qm_energy = None
 
         # XML Info
@@ -92,27 +230,105 @@ class Molecule:
         self.AtomTypes = {}
         self.Residues = None
         self.extra_sites = None
-        self.HarmonicBondForce = {}
-        self.HarmonicAngleForce = {}
-        self.PeriodicTorsionForce = OrderedDict()
-        self.NonbondedForce = OrderedDict()
+        self.HarmonicBondForce = BondTable()
+        self.HarmonicAngleForce = AngleTable()
+        self.PeriodicTorsionForce = TorsionTable()
+        self.NonbondedForce = NonbondedTable()
         self.combination = combination
         self.sites = None
 
         # QUBEKit internals
         self.state = None
 
-        # Atomic weight dict
-        self.element_dict = {'H': 1.008000,  # Group 1
-                             'C': 12.011000,  # Group 4
-                             'N': 14.007000, 'P': 30.973762,  # Group 5
-                             'O': 15.999000, 'S': 32.060000,  # Group 6
-                             'F': 18.998403, 'CL': 35.450000, 'BR': 79.904000, 'I': 126.904470  # Group 7
-                             }
-
     def __repr__(self):
         return f'{self.__class__.__name__}({self.__dict__!r})'
 
+    def __getstate__(self):
+        """
+        Slim copy of the attributes for pickling.
+        Transient members are left out, the topology is stored as node and edge arrays, and the term lists and
+        measurement dictionaries as integer and float arrays; __setstate__ rebuilds them all.
+        """
+
+        state = self.__dict__.copy()
+
+        for key in self.transient:
+            state.pop(key, None)
+
+        arrays = {}
+
+        if isinstance(state.get('topology'), Graph):
+            topology = state.pop('topology')
+            arrays['topology'] = (array(list(topology.nodes), dtype=int32),
+                                  array(list(topology.edges), dtype=int32).reshape(-1, 2))
+
+        for key, size in self.term_lists.items():
+            if isinstance(state.get(key), list):
+                arrays[key] = array(state.pop(key), dtype=int32).reshape(-1, size)
+
+        # Dihedrals are grouped under their central bond, which is the middle of each dihedral
+        if isinstance(state.get('dihedrals'), dict):
+            dihedrals = state.pop('dihedrals')
+            arrays['dihedrals'] = array([dihedral for group in dihedrals.values() for dihedral in group],
+                                        dtype=int32).reshape(-1, 4)
+
+        for key, size in self.measurements.items():
+            if isinstance(state.get(key), dict):
+                values = state.pop(key)
+                arrays[key] = (array(list(values), dtype=int32).reshape(-1, size),
+                               array(list(values.values()), dtype=float64))
+
+        state['_state_version'] = self.state_version
+        state['_arrays'] = arrays
+
+        return state
+
+    def __setstate__(self, state):
+        """Restore a pickled molecule; states pickled before versioning are plain attribute dictionaries."""
+
+        state = dict(state)
+        version = state.pop('_state_version', 0)
+        arrays = state.pop('_arrays', {})
+
+        if version > self.state_version:
+            raise ValueError(f'This molecule was saved by a newer version of QUBEKit (state version {version}); '
+                             f'this version can only read up to {self.state_version}.')
+
+        for key in self.transient:
+            state.setdefault(key, None)
+
+        # Added after the first states were saved
+        state.setdefault('derived', {})
+        state.setdefault('measured_from', {})
+        # Ligands saved before the scan structures were kept only have the scan energies
+        if 'qm_scan_energy' in state:
+            state.setdefault('qm_scans', {})
+
+        if version < 2:
+            for key, table in self.parameter_tables.items():
+                if isinstance(state.get(key), dict):
+                    state[key] = table(state[key])
+
+        if 'topology' in arrays:
+            nodes, edges = arrays.pop('topology')
+            state['topology'] = BondGraph()
+            state['topology'].add_nodes_from(nodes.tolist())
+            state['topology'].add_edges_from(edges.tolist())
+
+        for key in self.term_lists:
+            if key in arrays:
+                state[key] = term_tuples(arrays.pop(key))
+
+        if 'dihedrals' in arrays:
+            state['dihedrals'] = group_dihedrals(arrays.pop('dihedrals'))
+
+        for key in self.measurements:
+            if key in arrays:
+                terms, values = arrays.pop(key)
+                state[key] = dict(zip(term_tuples(terms), values))
+
+        self.__dict__.update(state)
+
     def __str__(self, trunc=False):
         """
         Prints the Molecule class objects' names and values one after another with new lines between each.
@@ -142,46 +358,53 @@ class Molecule:
     def read_pdb(self, input_type='input'):
         """
         Reads the input PDB file to find the ATOM or HETATM tags, extracts the elements and xyz coordinates.
-        Then reads through the connection tags and builds a connectivity network
-        (only works if connections are present in PDB file).
+        Then reads through the connection tags and builds a connectivity network;
+        if the file has no connections the bonds are found from the coordinates (see connectivity.perceive_bonds).
         Bonds are easily found through the edges of the network.
         Can also generate a simple plot of the network.
         """
 
-        with open(self.filename, 'r') as pdb:
-            lines = pdb.readlines()
+        self.read_record(PDBFile(self.filename), input_type)
+
+    def read_input(self, input_type='input'):
+        """
+        Read the molecule from the input file, choosing the reader from the extension:
+        a pdb file, or the first molecule of an sdf, mol2 or smiles file (see readers.read_molecules).
+        """
+
+        if self.filename.lower().endswith('.pdb'):
+            self.read_pdb(input_type)
+        else:
+            self.read_record(next(iter(read_molecules(self.filename))), input_type)
 
-        molecule = []
-        self.topology = Graph()
-        self.atom_names = []
+    def read_record(self, record, input_type='input'):
+        """
+        Store the atom names, elements and coordinates of a molecule read by one of the readers
+        (a readers.PDBFile or readers.MoleculeRecord) and build the topology from its bond table,
+        or from the coordinates if it has no bonds.
+        """
 
-        # atom counter used for graph node generation
-        atom_count = 1
-        for line in lines:
-            if 'ATOM' in line or 'HETATM' in line:
-                element = str(line[76:78])
-                element = sub('[0-9]+', '', element)
-                element = element.strip()
-                self.atom_names.append(str(line.split()[2]))
+        self.atom_names = record.names.tolist()
 
-                # If the element column is missing from the pdb, extract the element from the name.
-                if not element:
-                    element = str(line.split()[2])[:-1]
-                    element = sub('[0-9]+', '', element)
+        # If the element column is missing from the pdb, extract the element from the name.
+        elements = record.elements.astype('<U2')
+        for i in (elements == '').nonzero()[0]:
+            elements[i] = sub('[0-9]+', '', self.atom_names[i][:-1])
 
-                # Also add the atom number as the node in the graph
-                self.topology.add_node(atom_count)
-                atom_count += 1
-                molecule.append([element, float(line[30:38]), float(line[38:46]), float(line[46:54])])
+        bonds = record.bonds
+        if not len(bonds):
+            bonds = perceive_bonds(elements, record.coords) + 1
 
-            if 'CONECT' in line:
-                # Now look through the connectivity section and add all edges to the graph corresponding to the bonds.
-                for i in range(2, len(line.split())):
-                    if int(line.split()[i]) != 0:
-                        self.topology.add_edge(int(line.split()[1]), int(line.split()[i]))
+        # The atom numbers are the nodes in the graph; the connections are the edges corresponding to the bonds.
+        self.topology = BondGraph()
+        self.topology.add_nodes_from(range(1, len(record) + 1))
+        self.topology.add_edges_from(bonds.tolist())
 
         # put the object back into the correct place
-        self.molecule[input_type] = molecule
+        self.molecule[input_type] = Geometry(elements, record.coords)
+
+        if getattr(record, 'charge', None) is not None:
+            self.charge = record.charge
 
     def find_impropers(self):
         """
@@ -189,12 +412,8 @@ class Molecule:
         these are atoms with 3 bonds.
         """
 
-        self.improper_torsions = []
-        for node in self.topology.nodes:
-            near = sorted(list(neighbors(self.topology, node)))
-            # if the atom has 3 bonds it could be an improper
-            if len(near) == 3:
-                self.improper_torsions.append((node, near[0], near[1], near[2]))
+        # if the atom has 3 bonds it could be an improper
+        self.improper_torsions = term_tuples(Topology.from_graph(self.topology).impropers())
 
     def find_angles(self):
         """
@@ -202,33 +421,17 @@ class Molecule:
         Checked against OPLS-AA on molecules containing 10-63 angles.
         """
 
-        self.angles = []
-
-        for node in self.topology.nodes:
-            bonded = sorted(list(neighbors(self.topology, node)))
-
-            # Check that the atom has more than one bond
-            if len(bonded) < 2:
-                continue
-
-            # Find all possible angle combinations from the list
-            for i in range(len(bonded)):
-                for j in range(i + 1, len(bonded)):
-                    atom1, atom3 = bonded[i], bonded[j]
-
-                    self.angles.append((atom1, node, atom3))
+        # Every pair of the (sorted) bonded atoms of each atom with more than one bond
+        self.angles = term_tuples(Topology.from_graph(self.topology).angles())
 
     def get_bond_lengths(self, input_type='input'):
         """For the given molecule and topology find the length of all of the bonds."""
 
-        self.bond_lengths = {}
-
-        molecule = self.molecule[input_type]
+        edges = list(self.topology.edges)
+        lengths = bond_lengths(self.molecule[input_type].coords, array(edges, dtype=int).reshape(-1, 2) - 1)
 
-        for edge in self.topology.edges:
-            atom1 = array(molecule[int(edge[0]) - 1][1:])
-            atom2 = array(molecule[int(edge[1]) - 1][1:])
-            self.bond_lengths[edge] = linalg.norm(atom2 - atom1)
+        self.measured_from['bond_lengths'] = input_type
+        self.bond_lengths = dict(zip(edges, lengths))
 
     def find_dihedrals(self):
         """
@@ -236,48 +439,32 @@ class Molecule:
         the central bond keys which describe the angle.
         """
 
-        self.dihedrals = {}
+        # Each edge is used as a central dihedral bond; the neighbours of each end not in the main bond
+        # give the outer atoms. The dihedrals come grouped by central edge, in edge order,
+        # and only edges with at least one dihedral become keys.
+        self.dihedrals = group_dihedrals(Topology.from_graph(self.topology).dihedrals()[0])
 
-        # Work through the network using each edge as a central dihedral bond
-        for edge in self.topology.edges:
-
-            for start in list(neighbors(self.topology, edge[0])):
-
-                # Check atom not in main bond
-                if start != edge[0] and start != edge[1]:
-
-                    for end in list(neighbors(self.topology, edge[1])):
-
-                        # Check atom not in main bond
-                        if end != edge[0] and end != edge[1]:
+    def rotatable_bonds(self):
+        """
+        The dihedral dictionary keys of every central bond which can rotate, including methyl and amine rotations.
+        A central bond is rotatable if removing it would split the molecule, i.e. it is a bridge of the network.
+        """
 
-                            if edge not in self.dihedrals:
-                                # Add the central edge as a key the first time it is used
-                                self.dihedrals[edge] = [(start, edge[0], edge[1], end)]
+        # All of the bridges are found in one pass without changing the network.
+        bridges = find_bridges(self.topology.adj)
 
-                            else:
-                                # Add the tuple to the correct key.
-                                self.dihedrals[edge].append((start, edge[0], edge[1], end))
+        return [key for key in self.dihedrals if key in bridges]
 
     def find_rotatable_dihedrals(self):
         """
         For each dihedral in the topology graph network and dihedrals dictionary, work out if the torsion is
         rotatable. Returns a list of dihedral dictionary keys representing the rotatable dihedrals.
-        Also exclude standard rotations such as amides and methyl groups.
+        Also exclude standard rotations such as amines and methyl groups, which are already well represented.
         """
 
-        self.rotatable = []
+        cores = set(self.methyl_amine_groups()[2])
 
-        # For each dihedral key remove the edge from the network
-        for key in self.dihedrals:
-            self.topology.remove_edge(*key)
-
-            # Check if there is still a path between the two atoms in the edges.
-            if not has_path(self.topology, key[0], key[1]):
-                self.rotatable.append(key)
-
-            # Add edge back to the network and try next key
-            self.topology.add_edge(*key)
+        self.rotatable = [key for key in self.rotatable_bonds() if key[0] not in cores and key[1] not in cores]
 
     def get_dihedral_values(self, input_type='input'):
         """
@@ -285,21 +472,17 @@ class Molecule:
         angle keys and values. Also an option to only supply the keys of the dihedrals you want to calculate.
         """
 
-        self.dih_phis = {}
-
-        # Check if a rotatable tuple list is supplied, else calculate the angles for all dihedrals in the molecule.
-        keys = self.rotatable if self.rotatable else list(self.dihedrals.keys())
+        # Measure the torsions about the rotatable bonds (methyl and amine rotations included) if there are any,
+        # else calculate the angles for all dihedrals in the molecule.
+        dihedrals = self.dihedrals
+        keys = self.rotatable_bonds() or list(dihedrals.keys())
 
-        molecule = self.molecule[input_type]
+        # Measure every torsion in one go; the topology is counted from 1, the coordinates from 0
+        torsions = [torsion for key in keys for torsion in dihedrals[key]]
+        phis = dihedral_values(self.molecule[input_type].coords, array(torsions, dtype=int).reshape(-1, 4) - 1)
 
-        for key in keys:
-            for torsion in self.dihedrals[key]:
-                # Calculate the dihedral angle in the molecule using the molecule data array.
-                x1, x2, x3, x4 = [array(molecule[int(torsion[i]) - 1][1:]) for i in range(4)]
-                b1, b2, b3 = x2 - x1, x3 - x2, x4 - x3
-                t1 = linalg.norm(b2) * dot(b1, cross(b2, b3))
-                t2 = dot(cross(b1, b2), cross(b2, b3))
-                self.dih_phis[torsion] = degrees(arctan2(t1, t2))
+        self.measured_from['dih_phis'] = input_type
+        self.dih_phis = dict(zip(torsions, phis))
 
     def get_angle_values(self, input_type='input'):
         """
@@ -307,261 +490,442 @@ class Molecule:
         then return a dictionary of angles and values.
         """
 
-        self.angle_values = {}
+        values = angle_values(self.molecule[input_type].coords, array(self.angles, dtype=int).reshape(-1, 3) - 1)
 
-        molecule = self.molecule[input_type]
+        self.measured_from['angle_values'] = input_type
+        self.angle_values = dict(zip(self.angles, values))
 
-        for angle in self.angles:
-            x1 = array(molecule[int(angle[0]) - 1][1:])
-            x2 = array(molecule[int(angle[1]) - 1][1:])
-            x3 = array(molecule[int(angle[2]) - 1][1:])
-            b1, b2 = x1 - x2, x3 - x2
-            cosine_angle = dot(b1, b2) / (linalg.norm(b1) * linalg.norm(b2))
-            self.angle_values[angle] = degrees(arccos(cosine_angle))
+    def write_parameters(self, name=None, protein=False, collapse=False):
+        """
+        Take the molecule's parameter set and write an xml file for the molecule.
+        The file is streamed section by section, so no copy of the whole document is held in memory.
+        With collapse, atoms with identical parameters share one type and class (see collapse_types)
+        and each bonded term is written once per class, which keeps protein files small.
+        """
 
-    def write_parameters(self, name=None, protein=False):
-        """Take the molecule's parameter set and write an xml file for the molecule."""
+        with open(f'{name if name is not None else self.name}.xml', 'w+') as xml_doc:
+            writer = XMLWriter(xml_doc)
+            self.layout_parameters(writer, protein, collapse)
+            writer.close()
 
-        # First build the xml tree
-        self.build_tree(protein=protein)
+    def build_tree(self, protein, collapse=False):
+        """Separates the parameters and builds an xml tree ready to be used."""
 
-        tree = self.xml_tree.getroot()
-        messy = tostring(tree, 'utf-8')
+        builder = TreeBuilder()
+        self.layout_parameters(builder, protein, collapse)
 
-        pretty_xml_as_string = parseString(messy).toprettyxml(indent="")
+        # Store the tree back into the molecule
+        self.xml_tree = ElementTree(builder.close())
 
-        with open(f'{name if name is not None else self.name}.xml', 'w+') as xml_doc:
-            xml_doc.write(pretty_xml_as_string)
+    def layout_parameters(self, builder, protein, collapse=False):
+        """
+        Lay out the force field xml, one section at a time, through the start(tag, attrs) / end(tag) calls of
+        builder: an xml.etree.ElementTree.TreeBuilder to build a tree or a QUBEKit.writers.XMLWriter to write a file.
+        """
 
-    def build_tree(self, protein):
-        """Separates the parameters and builds an xml tree ready to be used."""
+        def element(tag, attrs):
+            builder.start(tag, attrs)
+            builder.end(tag)
 
-        # Create XML layout
-        root = Element('ForceField')
-        AtomTypes = SubElement(root, "AtomTypes")
-        Residues = SubElement(root, "Residues")
-        if protein:
-            Residue = SubElement(Residues, "Residue", name="QUP")
-        else:
-            Residue = SubElement(Residues, "Residue", name="UNK")
-        HarmonicBondForce = SubElement(root, "HarmonicBondForce")
-        HarmonicAngleForce = SubElement(root, "HarmonicAngleForce")
-        PeriodicTorsionForce = SubElement(root, "PeriodicTorsionForce")
+        # Each atom is written with the type of the first atom of its class; every atom is its own class by default
+        types = self.collapse_types() if collapse else list(range(len(self.AtomTypes)))
+        written = set()
 
-        # Assign the combination rule
-        l14 = '0.5'
-        c14 = '0.83333' if self.combination == 'amber' else '0.5'
+        def first_of_class(key, improper=False):
+            """Whether a bonded term is the first with its atom classes, as OpenMM matches them."""
 
-        NonbondedForce = SubElement(root, "NonbondedForce", attrib={'coulomb14scale': c14, 'lj14scale': l14})
+            if not collapse:
+                return True
 
+            classes = tuple(types[atom] for atom in key)
+            classes = (classes[0], *sorted(classes[1:])) if improper else min(classes, classes[::-1])
+            if (improper, classes) in written:
+                return False
+
+            written.add((improper, classes))
+            return True
+
+        # Virtual sites, if there are any
+        sites = self.sites or {}
+
+        builder.start('ForceField', {})
+
+        # Atom types, then the types of any virtual sites
+        builder.start('AtomTypes', {})
         for key, val in self.AtomTypes.items():
-            SubElement(AtomTypes, "Type", attrib={
+            if types[key] != key:
+                continue
+            element('Type', {
                 'name': val[1], 'class': val[2],
                 'element': self.molecule['input'][key][0],
                 'mass': str(self.element_dict[self.molecule['input'][key][0].upper()])})
 
-            SubElement(Residue, "Atom", attrib={'name': val[0], 'type': val[1]})
+        for key in sites:
+            element('Type', {'name': f'v-site{key + 1}', 'class': f'X{key + 1}', 'mass': '0'})
+        builder.end('AtomTypes')
 
-        # Add the bonds / connections
-        for key, val in self.HarmonicBondForce.items():
-            SubElement(Residue, "Bond", attrib={'from': str(key[0]), 'to': str(key[1])})
-
-            SubElement(HarmonicBondForce, "Bond", attrib={
-                'class1': self.AtomTypes[key[0]][2],
-                'class2': self.AtomTypes[key[1]][2],
-                'length': val[0], 'k': val[1]})
+        # The residue: atoms, bonds / connections then the virtual site atoms with their local coords
+        builder.start('Residues', {})
+        builder.start('Residue', {'name': 'QUP' if protein else 'UNK'})
+        for key, val in self.AtomTypes.items():
+            element('Atom', {'name': val[0], 'type': self.AtomTypes[types[key]][1]})
+
+        for key in self.HarmonicBondForce:
+            element('Bond', {'from': str(key[0]), 'to': str(key[1])})
+
+        for key, val in sites.items():
+            element('Atom', {'name': f'X{key + 1}', 'type': f'v-site{key + 1}'})
+
+            element('VirtualSite', {
+                'type': 'localCoords', 'index': str(key + len(self.atom_names)),
+                'atom1': str(val[0][0]), 'atom2': str(val[0][1]), 'atom3': str(val[0][2]),
+                'wo1': '1.0', 'wo2': '0.0', 'wo3': '0.0', 'wx1': '-1.0', 'wx2': '1.0', 'wx3': '0.0',
+                'wy1': '-1.0', 'wy2': '0.0', 'wy3': '1.0',
+                'p1': f'{float(val[1][0]):.4f}',
+                'p2': f'{float(val[1][1]):.4f}',
+                'p3': f'{float(val[1][2]):.4f}'})
+        builder.end('Residue')
+        builder.end('Residues')
+
+        # Add the bonds; the parameters are only turned into strings here
+        builder.start('HarmonicBondForce', {})
+        for key, (length, k) in zip(self.HarmonicBondForce, self.HarmonicBondForce.values.tolist()):
+            if not first_of_class(key):
+                continue
+            element('Bond', {
+                'class1': self.AtomTypes[types[key[0]]][2],
+                'class2': self.AtomTypes[types[key[1]]][2],
+                'length': str(length), 'k': str(k)})
+        builder.end('HarmonicBondForce')
 
         # Add the angles
-        for key, val in self.HarmonicAngleForce.items():
-            SubElement(HarmonicAngleForce, "Angle", attrib={
-                'class1': self.AtomTypes[key[0]][2],
-                'class2': self.AtomTypes[key[1]][2],
-                'class3': self.AtomTypes[key[2]][2],
-                'angle': val[0], 'k': val[1]})
+        builder.start('HarmonicAngleForce', {})
+        for key, (angle, k) in zip(self.HarmonicAngleForce, self.HarmonicAngleForce.values.tolist()):
+            if not first_of_class(key):
+                continue
+            element('Angle', {
+                'class1': self.AtomTypes[types[key[0]]][2],
+                'class2': self.AtomTypes[types[key[1]]][2],
+                'class3': self.AtomTypes[types[key[2]]][2],
+                'angle': str(angle), 'k': str(k)})
+        builder.end('HarmonicAngleForce')
 
         # add the proper and improper torsion terms
-        for key in self.PeriodicTorsionForce.keys():
-            if self.PeriodicTorsionForce[key][-1] == 'Improper':
-                tor_type = 'Improper'
-            else:
-                tor_type = 'Proper'
-            SubElement(PeriodicTorsionForce, tor_type, attrib={
-                'class1': self.AtomTypes[key[0]][2],
-                'class2': self.AtomTypes[key[1]][2],
-                'class3': self.AtomTypes[key[2]][2],
-                'class4': self.AtomTypes[key[3]][2],
-                'k1': self.PeriodicTorsionForce[key][0][1],
-                'k2': self.PeriodicTorsionForce[key][1][1],
-                'k3': self.PeriodicTorsionForce[key][2][1],
-                'k4': self.PeriodicTorsionForce[key][3][1],
+        builder.start('PeriodicTorsionForce', {})
+        torsions = self.PeriodicTorsionForce
+        for key, val, improper in zip(torsions, torsions.values.tolist(), torsions.impropers.tolist()):
+            if not first_of_class(key, improper):
+                continue
+            element('Improper' if improper else 'Proper', {
+                'class1': self.AtomTypes[types[key[0]]][2],
+                'class2': self.AtomTypes[types[key[1]]][2],
+                'class3': self.AtomTypes[types[key[2]]][2],
+                'class4': self.AtomTypes[types[key[3]]][2],
+                'k1': str(val[0]), 'k2': str(val[1]), 'k3': str(val[2]), 'k4': str(val[3]),
                 'periodicity1': '1', 'periodicity2': '2',
                 'periodicity3': '3', 'periodicity4': '4',
-                'phase1': self.PeriodicTorsionForce[key][0][2],
-                'phase2': self.PeriodicTorsionForce[key][1][2],
-                'phase3': self.PeriodicTorsionForce[key][2][2],
-                'phase4': self.PeriodicTorsionForce[key][3][2]})
-
-        # add the non-bonded parameters
-        for key in self.NonbondedForce.keys():
-            SubElement(NonbondedForce, "Atom", attrib={
+                'phase1': str(val[4]), 'phase2': str(val[5]), 'phase3': str(val[6]), 'phase4': str(val[7])})
+        builder.end('PeriodicTorsionForce')
+
+        # Assign the combination rule
+        l14 = '0.5'
+        c14 = '0.83333' if self.combination == 'amber' else '0.5'
+
+        # add the non-bonded parameters, then those of the virtual sites
+        builder.start('NonbondedForce', {'coulomb14scale': c14, 'lj14scale': l14})
+        for key, (charge, sigma, epsilon) in zip(self.NonbondedForce, self.NonbondedForce.values.tolist()):
+            if types[key] != key:
+                continue
+            element('Atom', {
                 'type': self.AtomTypes[key][1],
-                'charge': self.NonbondedForce[key][0],
-                'sigma': self.NonbondedForce[key][1],
-                'epsilon': self.NonbondedForce[key][2]})
-
-        # Add all of the virtual site info if present
-        if self.sites:
-            # Add the atom type to the top
-            for key, val in self.sites.items():
-                SubElement(AtomTypes, "Type", attrib={'name': f'v-site{key + 1}', 'class': f'X{key + 1}', 'mass': '0'})
-
-                # Add the atom info
-                SubElement(Residue, "Atom", attrib={'name': f'X{key + 1}', 'type': f'v-site{key + 1}'})
-
-                # Add the local coords site info
-                SubElement(Residue, "VirtualSite", attrib={
-                    'type': 'localCoords', 'index': str(key + len(self.atom_names)),
-                    'atom1': str(val[0][0]), 'atom2': str(val[0][1]), 'atom3': str(val[0][2]),
-                    'wo1': '1.0', 'wo2': '0.0', 'wo3': '0.0', 'wx1': '-1.0', 'wx2': '1.0', 'wx3': '0.0',
-                    'wy1': '-1.0', 'wy2': '0.0', 'wy3': '1.0',
-                    'p1': f'{float(val[1][0]):.4f}',
-                    'p2': f'{float(val[1][1]):.4f}',
-                    'p3': f'{float(val[1][2]):.4f}'})
-
-                # Add the nonbonded info
-                SubElement(NonbondedForce, "Atom", attrib={
-                    'type': f'v-site{key + 1}',
-                    'charge': f'{val[2]}',
-                    'sigma': '1.000000',
-                    'epsilon': '0.000000'})
+                'charge': str(charge), 'sigma': str(sigma), 'epsilon': str(epsilon)})
 
-        # Store the tree back into the molecule
-        self.xml_tree = ElementTree(root)
+        for key, val in sites.items():
+            element('Atom', {
+                'type': f'v-site{key + 1}',
+                'charge': f'{val[2]}',
+                'sigma': '1.000000',
+                'epsilon': '0.000000'})
+        builder.end('NonbondedForce')
+
+        builder.end('ForceField')
+
+    def collapse_types(self):
+        """
+        Group the atoms into classes which can share one xml atom type and class, so that large molecules
+        such as proteins get compact force field files which OpenMM reads quickly.
+
+        Atoms start in classes of the same element, number of bonds and non-bonded parameters.
+        Classes are then split wherever OpenMM, matching bonded terms by class, could give a term
+        different parameters to the ones it has (see topology.conflicting_terms); first on the classes of the
+        neighbouring atoms, then on the atoms' symmetry classes and, if that does not separate them,
+        by giving the atoms involved classes of their own.
+        Returns a list of the representative (lowest index) atom of the class of each atom, by atom index.
+        """
+
+        topology = Topology.from_graph(self.topology)
+        # Atom index (counted from 0 as in the parameter dictionaries) of each position in the topology
+        atoms = topology.nodes - 1
+
+        # Every bonded term OpenMM would look for, with an id of its parameters or -1 where it has none
+        def term_table(candidates, parameters, selected=None, improper=False):
+            """Atom indices and parameter ids of the terms; a term stored either way round is only counted once."""
+
+            def unique_key(term):
+                return (term[0], *sorted(term[1:])) if improper else min(term, term[::-1])
+
+            table = OrderedDict((unique_key(term), (term, -1)) for term in candidates)
+
+            ids = unique(parameters.values, axis=0, return_inverse=True)[1].ravel().tolist()
+            for term, val, keep in zip(parameters.terms.tolist(), ids, selected if selected is not None else ids):
+                if keep is not False:
+                    table[unique_key(tuple(term))] = (tuple(term), val)
+
+            terms = array([term for term, _ in table.values()], dtype=int).reshape(-1, parameters.size)
+            return terms, array([val for _, val in table.values()], dtype=int), improper
+
+        # OpenMM tries an improper on every combination of three neighbours of atoms with three or more bonds
+        impropers = []
+        bonded, offsets = (topology.nodes[topology.sorted_neighbours()] - 1).tolist(), topology.offsets.tolist()
+        for pos, atom in enumerate(atoms.tolist()):
+            if offsets[pos + 1] - offsets[pos] > 2:
+                impropers.extend((atom, *outer) for outer in combinations(bonded[offsets[pos]:offsets[pos + 1]], 3))
+
+        torsions = self.PeriodicTorsionForce
+        forces = [
+            term_table(term_tuples(topology.edges() - 1), self.HarmonicBondForce),
+            term_table(term_tuples(topology.angles() - 1), self.HarmonicAngleForce),
+            term_table(term_tuples(topology.dihedrals()[0] - 1), torsions, (~torsions.impropers).tolist()),
+            term_table(impropers, torsions, torsions.impropers.tolist(), True)]
+
+        # Start from the element, number of bonds and non-bonded parameters
+        start = {}
+        classes = empty(len(atoms), dtype=int)
+        nonbonded = dict(zip(self.NonbondedForce, map(tuple, self.NonbondedForce.values.tolist())))
+        for atom, degree in zip(atoms.tolist(), topology.degrees.tolist()):
+            classes[atom] = start.setdefault(
+                (self.molecule['input'][atom][0], degree, nonbonded.get(atom)), len(start))
+
+        # Splitting a class can only remove conflicts, so this stops; after a few rounds of splitting
+        # on neighbours (which only looks one bond further each time) the remaining atoms are split by symmetry,
+        # and any still in conflict after that get classes of their own
+        symmetry = empty(len(atoms), dtype=int)
+        symmetry[atoms] = symmetry_classes(topology, classes[atoms])
+        rounds = 0
+        while True:
+            conflicted = zeros(len(atoms), dtype=bool)
+            for terms, values, improper in forces:
+                conflicted[terms[conflicting_terms(classes, terms, values, improper)].ravel()] = True
+
+            if not conflicted.any():
+                break
+
+            refined = empty(len(atoms), dtype=int)
+            refined[atoms] = refine_colours(topology, classes[atoms])
+            split = unique(column_stack([classes, where(conflicted, refined, -1)]), axis=0,
+                           return_inverse=True)[1].ravel()
+
+            rounds += 1
+            if split.max() == classes.max() or rounds > 3:
+                split = unique(column_stack([classes, where(conflicted, symmetry, -1)]), axis=0,
+                               return_inverse=True)[1].ravel()
+
+            if split.max() == classes.max():
+                split = classes.copy()
+                split[conflicted] = classes.max() + 1 + arange(int(conflicted.sum()))
+
+            classes = split
+
+        first = full(classes.max() + 1, len(atoms), dtype=int)
+        minimum.at(first, classes, arange(len(atoms)))
+
+        return first[classes].tolist()
 
     def write_xyz(self, input_type='input', name=None):
         """Write a general xyz file. QM and MM decide where it will be written from in the ligand class."""
 
-        with open(f'{name if name is not None else self.name}.xyz', 'w+') as xyz_file:
+        molecule = self.molecule[input_type]
 
-            xyz_file.write(f'{len(self.molecule[input_type])}\n')
-            xyz_file.write('xyz file generated with QUBEKit\n')
+        with open(f'{name if name is not None else self.name}.xyz', 'w+') as xyz_file:
 
-            for atom in self.molecule[input_type]:
-                xyz_file.write(f'{atom[0]}       {atom[1]: .10f}   {atom[2]: .10f}   {atom[3]: .10f} \n')
+            xyz_file.write(f'{len(molecule)}\nxyz file generated with QUBEKit\n' +
+                           format_rows('%s       % .10f   % .10f   % .10f \n', molecule.elements, *molecule.coords.T))
 
     def write_gromacs_file(self, input_type='input'):
         """To a gromacs file, write and format the necessary variables."""
 
+        molecule = self.molecule[input_type]
+        positions = arange(1, len(molecule) + 1)
+
         with open(f'{self.name}.gro', 'w+') as gro_file:
-            gro_file.write(f'NEW {self.name.upper()} GRO FILE\n')
-            gro_file.write(f'{len(self.molecule[input_type]):>5}\n')
-            for pos, atom in enumerate(self.molecule[input_type], 1):
-                # 'mol number''mol name'  'atom name'   'atom count'   'x coord'   'y coord'   'z coord'
-                # 1WATER  OW1    1   0.126   1.624   1.679
-                gro_file.write(f'    1{self.name.upper()}  {atom[0]}{pos}   {pos}   {atom[1]: .3f}   {atom[2]: .3f}   {atom[3]: .3f}\n')
+            # 'mol number''mol name'  'atom name'   'atom count'   'x coord'   'y coord'   'z coord'
+            # 1WATER  OW1    1   0.126   1.624   1.679
+            template = f'    1{self.name.upper()}  '.replace('%', '%%') + '%s%d   %d   % .3f   % .3f   % .3f\n'
+            gro_file.write(f'NEW {self.name.upper()} GRO FILE\n{len(molecule):>5}\n' +
+                           format_rows(template, molecule.elements, positions, positions, *molecule.coords.T))
 
     def pickle(self, state=None):
         """
-        Pickles the Molecule object in its current state to the (hidden) pickle file.
-        If other pickle objects already exist for the particular object:
-            the latest object is put to the top.
+        Pickles the Molecule object in its current state to its own file in the (hidden) .QUBEKit_states folder.
+        Only this state is written; if the state already exists it is overwritten.
         """
 
-        mols = OrderedDict()
-        # First check if the pickle file exists
-        try:
-            # Try to load a hidden pickle file; make sure to get all objects
-            with open(f'.QUBEKit_states', 'rb') as pickle_jar:
-                while True:
-                    try:
-                        mol = load(pickle_jar)
-                        mols[mol.state] = mol
-                    except:
-                        break
-        except FileNotFoundError:
-            pass
-
-        # Now we can save the items; first assign the location
         self.state = state
-        mols[self.state] = self
-
-        # Open the pickle jar which will always be the ligand object's name
-        with open(f'.QUBEKit_states', 'wb') as pickle_jar:
-            # If there were other molecules of the same state in the jar: overwrite them
-
-            for val in mols.values():
-                dump(val, pickle_jar)
+        StateStore().save(self)
 
     def symmetrise_from_topo(self):
         """
         Based on the Molecule self.topology, symmetrise the methyl/amine Hydrogens.
         If there's a carbon, does it have 3 hydrogens? -> symmetrise
         If there's a Nitrogen, does it have 2 hydrogens? -> symmetrise
-        Also keep a list of the methyl carbons and amine/nitrle nitrogens
-        then exclude these bonds from the rotatable torsions list.
+        """
+
+        methyl_hs, amine_hs, _ = self.methyl_amine_groups()
+
+        self.symm_hs = {'methyl': methyl_hs, 'amine': amine_hs}
+
+    def methyl_amine_groups(self):
+        """
+        Lists of the methyl hydrogens, the amine hydrogens and the methyl carbons and amine/nitrile nitrogens (cores);
+        the rotations about these cores are left out of the rotatable torsions.
         """
 
         methyl_hs = []
         amine_hs = []
         methyl_amine_nitride_cores = []
-        for pos, atom_coords in enumerate(self.molecule['input']):
-            if atom_coords[0] == 'C' or atom_coords[0] == 'N':
-
-                hs = []
-                for atom in self.topology.neighbors(pos + 1):
-                    if len(list(self.topology.neighbors(atom))) == 1:
-                        # now make sure it is a hydrogen (as halogens could be caught here)
-                        if self.molecule['input'][atom - 1][0] == 'H':
-                            hs.append(atom)
-                if atom_coords[0] == 'C' and len(hs) == 3:
-                    methyl_hs.append(hs)
-                    methyl_amine_nitride_cores.append(pos + 1)
-                if atom_coords[0] == 'N' and len(hs) == 2:
-                    amine_hs.append(hs)
-                    methyl_amine_nitride_cores.append(pos + 1)
-                if atom_coords[0] == 'N' and len(hs) == 1:
-                    methyl_amine_nitride_cores.append(pos + 1)
 
-        self.symm_hs = {'methyl': methyl_hs, 'amine': amine_hs}
+        topology = Topology.from_graph(self.topology)
+        elements = self.molecule['input'].elements
+
+        # Terminal atoms (one bond) in the neighbour lists; make sure they are hydrogens as halogens could be caught
+        bonded = topology.nodes[topology.neighbours]
+        terminal_hs = (topology.degrees[topology.neighbours] == 1) & (elements[bonded - 1] == 'H')
+        h_counts = bincount(topology.rows()[terminal_hs], minlength=len(topology))
+        h_counts = h_counts[topology.positions[arange(1, len(elements) + 1)]]
 
-        # now modify the rotatable list to remove methyl and amine/ nitrile torsions
-        # these are already well represented in most FF's
-        remove_list = []
-        if self.rotatable:
-            rotatable = self.rotatable
-            for key in rotatable:
-                if key[0] in methyl_amine_nitride_cores or key[1] in methyl_amine_nitride_cores:
-                    remove_list.append(key)
+        cores = ((elements == 'C') & (h_counts == 3)) | ((elements == 'N') & ((h_counts == 1) | (h_counts == 2)))
 
-            # now remove the keys
-            for torsion in remove_list:
-                rotatable.remove(torsion)
+        for pos in cores.nonzero()[0].tolist():
+            start, end = topology.offsets[topology.positions[pos + 1]:topology.positions[pos + 1] + 2]
+            hs = bonded[start:end][terminal_hs[start:end]].tolist()
 
-            self.rotatable = rotatable
+            if elements[pos] == 'C':
+                methyl_hs.append(hs)
+            elif len(hs) == 2:
+                amine_hs.append(hs)
+            methyl_amine_nitride_cores.append(pos + 1)
+
+        return methyl_hs, amine_hs, methyl_amine_nitride_cores
+
+    def find_symmetry_classes(self):
+        """
+        Give each atom a symmetry class from the topology and elements (see topology.symmetry_classes);
+        atoms in the same class should share their charges and L-J parameters.
+        """
+
+        topology = Topology.from_graph(self.topology)
+        elements = unique(self.molecule['input'].elements, return_inverse=True)[1].ravel()
+
+        classes = empty(len(topology), dtype=int)
+        classes[topology.nodes - 1] = symmetry_classes(topology, elements[topology.nodes - 1])
+        self.symmetry_classes = classes.tolist()
+
+    def find_canonical_ranks(self):
+        """
+        Give each atom its canonical position from the topology and elements (see topology.canonical_ranks),
+        so the same molecule read with its atoms in another order has the same atoms in the same positions.
+        """
+
+        self.canonical_ranks = self.rank_atoms().tolist()
+
+    def rank_atoms(self, input_type=None, decimals=4):
+        """
+        Array of the canonical position of each atom (see find_canonical_ranks); if input_type is given,
+        atoms alike are ranked by their coordinates in that geometry, rounded to decimals (angstroms).
+        """
+
+        topology = Topology.from_graph(self.topology)
+        elements = unique(self.molecule['input'].elements, return_inverse=True)[1].ravel()
+        positions = topology.nodes - 1
+
+        ties = None
+        if input_type is not None:
+            # Adding 0 turns -0.0 into 0.0 so coordinates which round to zero sort and hash alike
+            ties = self.molecule[input_type].coords.round(decimals)[positions] + 0.0
+
+        ranks = empty(len(topology), dtype=int)
+        ranks[positions] = canonical_ranks(topology, elements[positions], ties)
+
+        return ranks
+
+    def canonical_key(self, charge=None, multiplicity=1, input_type=None, decimals=4):
+        """
+        Key of the molecule for cache look ups and finding repeats: a sha256 hex digest of the elements and bonds
+        in canonical atom order, the formal charge (default: the charge read with the molecule, else 0)
+        and the multiplicity. The key is the same however the atoms are ordered.
+        If input_type is given ('input', 'qm' ...), the coordinates of that geometry in canonical order,
+        rounded to decimals (angstroms), are part of the key too, so only the same structure matches.
+        """
+
+        if input_type is None:
+            ranks = array(self.canonical_ranks)
+        else:
+            ranks = self.rank_atoms(input_type, decimals)
+        order = ranks.argsort()
+
+        edges = ranks[array(list(self.topology.edges), dtype=int).reshape(-1, 2) - 1]
+        edges.sort(axis=1)
+        edges = edges[lexsort((edges[:, 1], edges[:, 0]))]
+
+        if charge is None:
+            charge = self.charge or 0
+
+        key = sha256()
+        key.update(' '.join(self.molecule['input'].elements[order]).encode())
+        key.update(edges.astype(int64).tobytes())
+        key.update(f'{int(charge)} {int(multiplicity)}'.encode())
+
+        if input_type is not None:
+            coords = self.molecule[input_type].coords[order].round(decimals) + 0.0
+            key.update(coords.astype(float64).tobytes())
+
+        return key.hexdigest()
+
+    def atom_map(self, other):
+        """
+        Index of the matching atom in other (the same molecule, maybe with its atoms in another order)
+        of each atom of this molecule, as an array; per atom results of other are moved onto this molecule
+        with values[molecule.atom_map(other)]. Atoms are matched up to symmetry, e.g. the hydrogens of a methyl
+        group in any order, so the values of atoms alike should be alike. Raises ValueError if the molecules differ.
+        """
+
+        if self.canonical_key() != other.canonical_key():
+            raise ValueError(f'{self.name} and {other.name} are not the same molecule so their atoms cannot be mapped.')
+
+        return array(other.canonical_ranks).argsort()[array(self.canonical_ranks)]
 
     def update(self, input_type='input'):
         """After the protein has been passed to the parameterisation class we get back the bond info
-        use this to update all missing terms."""
+        use this to update all missing terms.
+        Only the impropers are found here; the new bonds mean the other terms are found again when they are used,
+        with the measurements taken from input_type."""
 
         # using the new harmonic bond force dict we can add the bond edges to the topology graph
-        for key in self.HarmonicBondForce.keys():
-            self.topology.add_edge(key[0] + 1, key[1] + 1)
-
-        self.find_angles()
-        self.find_dihedrals()
-        self.find_rotatable_dihedrals()
-        self.get_dihedral_values(input_type=input_type)
-        self.get_bond_lengths(input_type=input_type)
-        self.get_angle_values(input_type=input_type)
+        self.topology.add_edges_from((self.HarmonicBondForce.terms + 1).tolist())
+
+        for key in self.measurements:
+            self.measured_from[key] = input_type
+
         self.find_impropers()
-        # this creates the dictionary of terms that should be symmetrise
-        self.symmetrise_from_topo()
 
 
 class Ligand(Molecule):
 
-    def __init__(self, filename, smiles_string=None, combination='opls'):
+    def __init__(self, filename, smiles_string=None, combination='opls', record=None):
         """
+        record                  Optional readers.MoleculeRecord to build the ligand from rather than reading filename
+                                (see read_ligands); filename is then the pdb file the ligand will be written to.
+
         scan_order              A list of the dihedral cores to be scaned in the scan order
         mm_optimised            List of lists; Inner list is the atom type followed by its coords for mm optimised
                                 e.g. [['C', -0.022, 0.003, 0.017], ['H', -0.669, 0.889, -0.101], ...]
@@ -570,6 +934,8 @@ class Ligand(Molecule):
         hessian                 2d numpy array; matrix of size 3N x 3N where N is number of atoms in the molecule
         modes                   A list of the qm predicted frequency modes
         QM_scan_energy
+        qm_scans                Dictionary of the QM torsion scans as Conformers (structures with their energies and
+                                dihedral values) using the scan orders as the keys
         descriptors
         symmetry_types          list; symmetrised atom types
         """
@@ -582,16 +948,13 @@ class Ligand(Molecule):
         self.modes = None
 
         self.qm_scan_energy = {}
+        self.qm_scans = {}
         self.descriptors = {}
 
-        self.read_pdb()
-        self.find_angles()
-        self.find_dihedrals()
-        self.find_rotatable_dihedrals()
-        self.get_dihedral_values()
-        self.get_bond_lengths()
-        self.get_angle_values()
-        self.symmetrise_from_topo()
+        if record is None:
+            self.read_input()
+        else:
+            self.read_record(record)
 
     def read_xyz(self, name=None, input_type='input'):
         """Read an xyz file to store the molecule structure."""
@@ -624,22 +987,14 @@ class Ligand(Molecule):
 
         molecule = self.molecule[input_type]
 
-        with open(f'{name if name is not None else self.name}.pdb', 'w+') as pdb_file:
-
-            # Write out the atomic xyz coordinates
-            pdb_file.write(f'REMARK   1 CREATED WITH QUBEKit {datetime.now()}\n')
-            pdb_file.write(f'COMPND    {self.name:<20}\n')
-            for i, atom in enumerate(molecule):
-                pdb_file.write(
-                    f'HETATM{i+1:>5} {self.atom_names[i]:>4} UNL     1{atom[1]:12.3f}{atom[2]:8.3f}{atom[3]:8.3f}  1.00  0.00          {atom[0]:2}\n')
+        # Write out the atomic xyz coordinates then add the connection terms, all in one go
+        atoms = format_rows('HETATM%5d %4s UNL     1%12.3f%8.3f%8.3f  1.00  0.00          %-2s\n',
+                            arange(1, len(molecule) + 1), self.atom_names[:len(molecule)], *molecule.coords.T,
+                            molecule.elements)
 
-            # Now add the connection terms
-            for node in self.topology.nodes:
-                bonded = sorted(list(neighbors(self.topology, node)))
-                if len(bonded) > 1:
-                    pdb_file.write(f'CONECT{node:5}{"".join(f"{x:5}" for x in bonded)}\n')
-
-            pdb_file.write('END\n')
+        with open(f'{name if name is not None else self.name}.pdb', 'w+') as pdb_file:
+            pdb_file.write(f'REMARK   1 CREATED WITH QUBEKit {datetime.now()}\nCOMPND    {self.name:<20}\n' + atoms +
+                           conect_records(Topology.from_graph(self.topology)) + 'END\n')
 
 
 class Protein(Molecule):
@@ -655,84 +1010,73 @@ class Protein(Molecule):
     def read_pdb(self, input_type='input'):
         """
         Read the pdb file which probably does not have the right connections,
-        so we need to find them using QUBE.xml
-        """
-
-        with open(self.filename, 'r') as pdb:
-            lines = pdb.readlines()
-
-        protein = []
-        self.topology = Graph()
-        self.atom_names = []
-        self.residues = []
-        self.Residues = []
-        self.pdb_names = []
-
-        # atom counter used for graph node generation
-        atom_count = 1
-        for line in lines:
-            if 'ATOM' in line or 'HETATM' in line:
-                element = str(line[76:78])
-                element = sub('[0-9]+', '', element)
-                element = element.strip()
-
-                # If the element column is missing from the pdb, extract the element from the name.
-                if not element:
-                    element = str(line.split()[2])
-                    element = sub('[0-9]+', '', element)
-
-                # now make sure we have a valid element
-                if element.lower() == 'cl' or element.lower() == 'br':
-                    pass
-                else:
-                    element = element[0]
-
-                self.atom_names.append(f'{element}{atom_count}')
-                self.pdb_names.append(str(line.split()[2]))
-
-                # also get the residue order from the pdb file so we can rewrite the file
-                self.Residues.append(str(line.split()[3]))
-
-                # Also add the atom number as the node in the graph
-                self.topology.add_node(atom_count)
-                atom_count += 1
-                protein.append([element, float(line[30:38]), float(line[38:46]), float(line[46:54])])
-
-            if 'CONECT' in line:
-                # Now look through the connectivity section and add all edges to the graph corresponding to the bonds.
-                for i in range(2, len(line.split())):
-                    if int(line.split()[i]) != 0:
-                        self.topology.add_edge(int(line.split()[1]), int(line.split()[i]))
+        so we need to find them using QUBE.xml.
+        If it has none at all they are found from the residue templates (see connectivity.template_bonds).
+        """
+
+        pdb = PDBFile(self.filename)
+
+        self.pdb_names = pdb.names.tolist()
+
+        # also get the residue order from the pdb file so we can rewrite the file
+        self.Residues = pdb.residues.tolist()
+
+        elements = []
+        for element, name in zip(pdb.elements.tolist(), self.pdb_names):
+            # If the element column is missing from the pdb, extract the element from the name.
+            if not element:
+                element = sub('[0-9]+', '', name)
+
+            # now make sure we have a valid element
+            if element.lower() != 'cl' and element.lower() != 'br':
+                element = element[0]
+
+            elements.append(element)
+
+        self.atom_names = [f'{element}{atom}' for atom, element in enumerate(elements, 1)]
 
         # check if there are any conect terms in the file first
-        if len(self.topology.edges) == 0:
-            print('No connections found!')
+        bonds = pdb.bonds
+        if not len(bonds):
+            print('No connections found; using the residue templates.')
+            bonds = template_bonds(pdb.names, pdb.residues, pdb.residue_ids, elements, pdb.coords) + 1
+
+        # The atom numbers are the nodes in the graph; the connections are the edges corresponding to the bonds.
+        self.topology = BondGraph()
+        self.topology.add_nodes_from(range(1, len(pdb) + 1))
+        self.topology.add_edges_from(bonds.tolist())
 
         # Remove duplicates
         self.residues = [res for res, group in groupby(self.Residues)]
 
-        self.molecule[input_type] = protein
+        self.molecule[input_type] = Geometry(elements, pdb.coords)
+
+        self.charge = residue_charge(pdb.names, pdb.residues, pdb.residue_ids)
 
     def write_pdb(self, name=None):
         """This method replaces the ligand method as all of the atom names and residue names have to be replaced."""
 
         molecule = self.molecule['input']
 
-        with open(f'{name if name else self.name}.pdb', 'w+') as pdb_file:
+        # we have to transform the atom name while writing out the pdb file
+        # TODO conditional printing
+        positions = arange(1, len(molecule) + 1)
+        names = char.add(molecule.elements, positions.astype(str))
+        atoms = format_rows('HETATM%5d%5s QUP     1%12.3f%8.3f%8.3f  1.00  0.00          %-2s\n',
+                            positions, names, *molecule.coords.T, molecule.elements)
 
-            # Write out the atomic xyz coordinates
-            pdb_file.write(f'REMARK   1 CREATED WITH QUBEKit {datetime.now()}\n')
+        with open(f'{name if name else self.name}.pdb', 'w+') as pdb_file:
             # pdb_file.write(f'COMPND    {self.name:<20}\n')
-            # we have to transform the atom name while writing out the pdb file
-            for i, atom in enumerate(molecule):
-                # TODO conditional printing
-                pdb_file.write(
-                    f'HETATM{i+1:>5}{atom[0] + str(i+1):>5} QUP     1{atom[1]:12.3f}{atom[2]:8.3f}{atom[3]:8.3f}  1.00  0.00          {atom[0]:2}\n')
-
-            # Now add the connection terms
-            for node in self.topology.nodes:
-                bonded = sorted(list(neighbors(self.topology, node)))
-                if len(bonded) > 1:
-                    pdb_file.write(f'CONECT{node:5}{"".join(f"{x:5}" for x in bonded)}\n')
-
-            pdb_file.write('END\n')
+            pdb_file.write(f'REMARK   1 CREATED WITH QUBEKit {datetime.now()}\n' + atoms +
+                           conect_records(Topology.from_graph(self.topology)) + 'END\n')
+
+
+def read_ligands(filename, combination='opls'):
+    """
+    Build a Ligand from each molecule of an sdf, mol2 or smiles library in turn, as the file is read,
+    with the topology from the file's bonds. Each is named from the file and would be written to name.pdb;
+    no files are written here, so a large library can be worked through without a pdb file per molecule.
+    """
+
+    for record in read_molecules(filename):
+        yield Ligand(f'{record.name}.pdb', combination=combination, record=record)
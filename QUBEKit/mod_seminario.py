@@ -7,7 +7,7 @@ Reference using AEA Allen, MC Payne, DJ Cole, J. Chem. Theory Comput. (2018), do
 
 from QUBEKit.decorators import for_all_methods, timer_logger
 
-from numpy import cross, linalg, empty, zeros, reshape, dot, real, average
+from numpy import cross, linalg, empty, zeros, dot, real, average
 from math import degrees, acos, sin, cos
 from operator import itemgetter
 
@@ -152,9 +152,8 @@ class ModSeminario:
         molecule coordinates.
         """
 
-        coords = [atom[j + 1] for atom in self.molecule.molecule['qm'] for j in range(3)]
-        size_mol = len(self.molecule.molecule['qm'])
-        coords = reshape(coords, (size_mol, 3))
+        coords = self.molecule.molecule['qm'].coords
+        size_mol = len(coords)
         hessian = self.molecule.hessian
 
         # Find bond lengths and create empty matrix of correct size.
@@ -301,7 +300,7 @@ class ModSeminario:
                 bond_file.write(f'{k_b[pos]:.3f}   {bond_len_list[pos]:.3f}   {bond[0]}   {bond[1]}\n')
 
                 # Add ModSem values to ligand object.
-                self.molecule.HarmonicBondForce[(bond[0] - 1, bond[1] - 1)] = [str(bond_len_list[pos] / 10), str(conversion * k_b[pos])]
+                self.molecule.HarmonicBondForce[(bond[0] - 1, bond[1] - 1)] = [bond_len_list[pos] / 10, conversion * k_b[pos]]
 
                 unique_values_bonds.append([self.atom_names[bond[0] - 1], self.atom_names[bond[1] - 1], k_b[pos], bond_len_list[pos], 1])
 
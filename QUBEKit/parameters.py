@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+
+"""
+Numeric storage for the force field parameters of a molecule.
+Each force is held as an integer array of the atoms in each term and a float64 array of the parameters of each term,
+rather than a dictionary of lists of strings; dictionary style access still works through light weight views
+so parameters can be read, assigned and edited term by term, or all at once through the arrays.
+Parameters are only turned into strings when the force field xml is written.
+"""
+
+from numpy import array, asarray, concatenate, delete, empty, float64, int64, zeros
+
+from collections.abc import MutableMapping
+
+
+class ParameterView:
+    """
+    List style view of the parameters of one term of a ParameterTable, in the order of the table's fields.
+    Reads and writes go straight through to the table's arrays.
+    """
+
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+
+        self.table = table
+        self.row = row
+
+    def __repr__(self):
+        return repr(self.to_list())
+
+    def __len__(self):
+        return len(self.table.fields)
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __eq__(self, other):
+
+        try:
+            return self.to_list() == [float(value) for value in other]
+        except (TypeError, ValueError):
+            return NotImplemented
+
+    def __getitem__(self, item):
+
+        if isinstance(item, slice):
+            return self.to_list()[item]
+
+        return float(self.table.values[self.row, item])
+
+    def __setitem__(self, item, value):
+
+        if isinstance(item, slice):
+            for pos, val in zip(range(len(self))[item], value):
+                self[pos] = val
+            return
+
+        self.table.values[self.row, item] = float(value)
+
+    def to_list(self):
+        """Return the parameters as a new list of floats."""
+
+        return self.table.values[self.row].tolist()
+
+
+class ParameterTable(MutableMapping):
+    """
+    Parameters of one force, stored under the tuple of atoms (counted from 0) of each term:
+        terms           (T, size) int array of the atoms of each term, in the order the terms were added
+        values          (T, len(fields)) float64 array of the parameters of each term
+    Behaves like the old dictionaries: table[term] gives a ParameterView which can be indexed and assigned,
+    and assigning any sequence of numbers (or numeric strings) adds or replaces a term.
+    Terms of a single atom (size 1) are stored under the atom index itself.
+
+    Subclasses set the number of atoms in each term (size) and the names of the parameters (fields).
+    """
+
+    size = None
+    fields = ()
+
+    def __init__(self, *args, **kwargs):
+
+        self._terms = empty((0, self.size), dtype=int64)
+        self._values = empty((0, len(self.fields)), dtype=float64)
+        self.index = {}
+
+        self.update(*args, **kwargs)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({dict((key, val.to_list()) for key, val in self.items())!r})'
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        return self.view(self.index[key])
+
+    def __setitem__(self, key, value):
+
+        row = self.index.get(key)
+        if row is None:
+            row = self.add_row(key)
+
+        self.set_row(row, value)
+
+    def __delitem__(self, key):
+
+        row = self.index.pop(key)
+        count = len(self.index)
+
+        self._terms = delete(self._terms[:count + 1], row, axis=0)
+        self._values = delete(self._values[:count + 1], row, axis=0)
+
+        for term, pos in self.index.items():
+            if pos > row:
+                self.index[term] = pos - 1
+
+    def __getstate__(self):
+
+        # The index is rebuilt from the terms
+        state = self.__dict__.copy()
+        del state['index']
+        state['_terms'], state['_values'] = self.terms.copy(), self.values.copy()
+
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+        self.index = {self.key(term): row for row, term in enumerate(self._terms.tolist())}
+
+    @classmethod
+    def from_arrays(cls, terms, values):
+        """Build a table from arrays of every term and its parameters at once (see set_arrays)."""
+
+        table = cls()
+        table.set_arrays(terms, values)
+
+        return table
+
+    def set_arrays(self, terms, values):
+        """
+        Replace every term with the rows of a (T, size) array of terms and a (T, len(fields)) array of parameters,
+        without going through the terms one at a time. A term given more than once is kept where it first appears
+        with its last parameters, as assigning the rows in turn would.
+        Returns the rows of terms kept, in table order.
+        """
+
+        terms = asarray(terms, dtype=int64).reshape(-1, self.size)
+        values = asarray(values, dtype=float64).reshape(-1, len(self.fields))
+
+        # Position of the last row of each term, in the order the terms first appear
+        last = {}
+        for row, term in enumerate(terms.tolist()):
+            last[self.key(term)] = row
+        rows = array(list(last.values()), dtype=int64)
+
+        self._terms, self._values = terms[rows], values[rows]
+        self.index = {key: row for row, key in enumerate(last)}
+
+        return rows
+
+    @property
+    def terms(self):
+        """(T, size) array of the atoms of each term; terms are not edited through this."""
+
+        return self._terms[:len(self)]
+
+    @property
+    def values(self):
+        """(T, len(fields)) array of the parameters of each term, for reading or editing in bulk."""
+
+        return self._values[:len(self)]
+
+    def column(self, field):
+        """The values of one named parameter of every term, e.g. table.column('k'); edits go to the table."""
+
+        return self.values[:, self.fields.index(field)]
+
+    def rows(self, keys):
+        """Row positions in terms and values of the terms stored under keys."""
+
+        return array([self.index[key] for key in keys], dtype=int64)
+
+    def key(self, term):
+        """The key a row of terms is stored under."""
+
+        return term[0] if self.size == 1 else tuple(term)
+
+    def view(self, row):
+        return ParameterView(self, row)
+
+    def add_row(self, key):
+        """Add an empty row for a new term, growing the arrays in blocks, and return its position."""
+
+        row = len(self.index)
+
+        if row == len(self._terms):
+            extra = max(16, row)
+            self._terms = concatenate([self._terms, empty((extra, self.size), dtype=int64)])
+            self._values = concatenate([self._values, zeros((extra, len(self.fields)), dtype=float64)])
+
+        self._terms[row] = key if self.size != 1 or isinstance(key, tuple) else (key,)
+        self.index[key] = row
+
+        return row
+
+    def set_row(self, row, value):
+        """Store the parameters of a term from any sequence of numbers or numeric strings."""
+
+        value = [float(val) for val in value]
+        if len(value) != len(self.fields):
+            raise ValueError(f'{len(value)} parameters given for a {self.__class__.__name__} term; '
+                             f'expected {", ".join(self.fields)}.')
+
+        self._values[row] = value
+
+
+class BondTable(ParameterTable):
+    """Harmonic bonds: equilibrium length (nm) and force constant (kJ / mol / nm^2)."""
+
+    size = 2
+    fields = ('length', 'k')
+
+
+class AngleTable(ParameterTable):
+    """Harmonic angles: equilibrium angle (radians) and force constant (kJ / mol / radian^2)."""
+
+    size = 3
+    fields = ('angle', 'k')
+
+
+class NonbondedTable(ParameterTable):
+    """Non-bonded parameters of each atom (stored under the atom index): charge, sigma (nm) and epsilon (kJ / mol)."""
+
+    size = 1
+    fields = ('charge', 'sigma', 'epsilon')
+
+
+class TorsionTermView:
+    """List style view of one periodicity of a torsion: [periodicity, k, phase]; k and phase can be assigned."""
+
+    __slots__ = ('table', 'row', 'order')
+
+    def __init__(self, table, row, order):
+
+        self.table = table
+        self.row = row
+        self.order = order
+
+    def __repr__(self):
+        return repr(self.to_list())
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __eq__(self, other):
+
+        try:
+            return self.to_list() == [float(value) for value in other]
+        except (TypeError, ValueError):
+            return NotImplemented
+
+    def __getitem__(self, item):
+        return self.to_list()[item]
+
+    def __setitem__(self, item, value):
+
+        if item in (1, -2):
+            self.table.values[self.row, self.order] = float(value)
+
+        elif item in (2, -1):
+            self.table.values[self.row, 4 + self.order] = float(value)
+
+        else:
+            raise IndexError('Only the k and phase of a torsion term can be changed.')
+
+    def to_list(self):
+
+        values = self.table.values[self.row]
+        return [self.order + 1, float(values[self.order]), float(values[4 + self.order])]
+
+
+class TorsionView:
+    """
+    List style view of a torsion in the old form: four [periodicity, k, phase] terms in periodicity order,
+    followed by 'Improper' for improper torsions. The barriers and phases are also available as arrays (k, phase).
+    """
+
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+
+        self.table = table
+        self.row = row
+
+    def __repr__(self):
+        return repr(self.to_list())
+
+    def __len__(self):
+        return 5 if self.improper else 4
+
+    def __iter__(self):
+        return iter([TorsionTermView(self.table, self.row, order) for order in range(4)] +
+                    (['Improper'] if self.improper else []))
+
+    def __eq__(self, other):
+
+        try:
+            return self.to_list() == self.table.parse(other)[2]
+        except (TypeError, ValueError, IndexError):
+            return NotImplemented
+
+    def __getitem__(self, item):
+
+        if isinstance(item, slice):
+            return list(self)[item]
+
+        if item < 0:
+            item += len(self)
+
+        if 0 <= item < 4:
+            return TorsionTermView(self.table, self.row, item)
+
+        if item == 4 and self.improper:
+            return 'Improper'
+
+        raise IndexError('Torsion index out of range.')
+
+    @property
+    def k(self):
+        """Array of the four barrier heights (periodicity 1 to 4); edits go to the table."""
+
+        return self.table.values[self.row, :4]
+
+    @property
+    def phase(self):
+        """Array of the four phases (radians); edits go to the table."""
+
+        return self.table.values[self.row, 4:]
+
+    @property
+    def improper(self):
+        return bool(self.table.impropers[self.row])
+
+    def to_list(self):
+        """Return the torsion in the old nested list form (with numbers rather than strings)."""
+
+        return ([[order + 1, float(self.k[order]), float(self.phase[order])] for order in range(4)] +
+                (['Improper'] if self.improper else []))
+
+
+class TorsionTable(ParameterTable):
+    """
+    Periodic torsions, proper and improper (the central atom first), each with the four periodicities 1 to 4:
+    barriers k1 to k4 (kJ / mol) then phases phase1 to phase4 (radians), plus impropers, a bool array marking
+    the improper torsions. Terms can be assigned in the old nested form, [[periodicity, k, phase], ...]
+    with 'Improper' last for impropers; any periodicity left out gets no barrier and the default phase.
+    """
+
+    size = 4
+    fields = ('k1', 'k2', 'k3', 'k4', 'phase1', 'phase2', 'phase3', 'phase4')
+
+    # Phase of each periodicity when none is given
+    default_phases = (0, 3.141592653589793, 0, 3.141592653589793)
+
+    def __init__(self, *args, **kwargs):
+
+        self._impropers = zeros(0, dtype=bool)
+
+        super().__init__(*args, **kwargs)
+
+    def __delitem__(self, key):
+
+        row = self.index[key]
+        self._impropers = delete(self._impropers[:len(self)], row)
+
+        super().__delitem__(key)
+
+    def __getstate__(self):
+
+        state = super().__getstate__()
+        state['_impropers'] = self.impropers.copy()
+
+        return state
+
+    @classmethod
+    def from_arrays(cls, terms, values, impropers=None):
+        """Build a table from arrays of every torsion, its parameters and (T,) improper flags (default none)."""
+
+        table = cls()
+        rows = table.set_arrays(terms, values)
+        table._impropers = zeros(len(rows), dtype=bool) if impropers is None else asarray(impropers, dtype=bool)[rows]
+
+        return table
+
+    @property
+    def impropers(self):
+        """(T,) bool array marking the improper torsions."""
+
+        return self._impropers[:len(self)]
+
+    def view(self, row):
+        return TorsionView(self, row)
+
+    def add_row(self, key):
+
+        row = super().add_row(key)
+        if row >= len(self._impropers):
+            self._impropers = concatenate([self._impropers, zeros(len(self._terms) - len(self._impropers), dtype=bool)])
+
+        return row
+
+    def parse(self, value):
+        """Barriers, phases and improper flag of a torsion given in the nested list form (or as a TorsionView)."""
+
+        if isinstance(value, TorsionView):
+            return value.k.tolist(), value.phase.tolist(), value.to_list()
+
+        terms = list(value)
+        improper = bool(terms) and terms[-1] == 'Improper'
+        if improper:
+            terms = terms[:-1]
+
+        k, phase = [0.0] * 4, [float(val) for val in self.default_phases]
+        for term in terms:
+            order = int(float(term[0])) - 1
+            k[order], phase[order] = float(term[1]), float(term[2])
+
+        nested = [[order + 1, k[order], phase[order]] for order in range(4)] + (['Improper'] if improper else [])
+
+        return k, phase, nested
+
+    def set_row(self, row, value):
+
+        k, phase, nested = self.parse(value)
+
+        self._values[row] = k + phase
+        self._impropers[row] = nested[-1] == 'Improper'
@@ -2,15 +2,18 @@
 
 from QUBEKit.decorators import for_all_methods, timer_logger
 from QUBEKit.helpers import append_to_log
+from QUBEKit.parameters import AngleTable, BondTable, NonbondedTable, TorsionTable
+from QUBEKit.readers import PDBFile
+from QUBEKit.topology import Topology, index_torsions
 
+from itertools import chain
 from tempfile import TemporaryDirectory
 from shutil import copy
 from os import getcwd, chdir, path
 from subprocess import run as sub_run
-from collections import OrderedDict
-from copy import deepcopy
 
-from xml.etree.ElementTree import parse as parse_tree
+from numpy import arange, argsort, array, concatenate, empty, float64, int64, ones, repeat, sort, tile, zeros
+from simtk import unit
 from simtk.openmm import app, XmlSerializer
 from openeye import oechem
 
@@ -24,8 +27,8 @@ from openforcefield.utils import get_data_filename, generateTopologyFromOEMol
 class Parametrisation:
     """
     Class of methods which perform the initial parametrisation for the molecule.
-    The Parameters will be stored into the molecule as dictionaries as this is easy to manipulate and convert
-    to a parameter tree.
+    The Parameters will be stored into the molecule as parameter tables (see parameters.py) which can be used
+    like dictionaries, or edited in bulk through their arrays, and are only turned into strings for the xml.
 
     Note all parameters gathered here are indexed from 0,
     whereas the ligand object indices start from 1 for all networkx related properties such as bonds!
@@ -47,29 +50,35 @@ class Parametrisation:
 
     Residues : dictionary of residue names indexed by the order they appear.
 
-    HarmonicBondForce: dictionary of equilibrium distances and force constants stored under the bond tuple.
+    HarmonicBondForce: BondTable of equilibrium distances and force constants stored under the bond tuple.
                 {(0, 1): [eqr=456, fc=984375]}
 
-    HarmonicAngleForce: dictionary of equilibrium  angles and force constant stored under the angle tuple.
+    HarmonicAngleForce: AngleTable of equilibrium  angles and force constant stored under the angle tuple.
 
-    PeriodicTorsionForce : dictionary of periodicity, barrier and phase stored under the torsion tuple.
+    PeriodicTorsionForce : TorsionTable of periodicity, barrier and phase stored under the torsion tuple.
 
-    NonbondedForce : dictionary of charge, sigma and epsilon stored under the original atom ordering.
+    NonbondedForce : NonbondedTable of charge, sigma and epsilon stored under the original atom ordering.
+
+    The parameters are read straight from the OpenMM System each engine makes (system);
+    set write_serialised to also write it to serialised.xml for debugging.
     """
 
+    write_serialised = False
+
     def __init__(self, molecule, input_file=None, fftype=None, mol2_file=None):
 
         self.molecule = molecule
         self.input_file = input_file
         self.fftype = fftype
         self.gaff_types = {}
+        self.system = None
 
     def __repr__(self):
         return f'{self.__class__.__name__}({self.__dict__!r})'
 
     def gather_parameters(self):
         """
-        This method parses the serialised xml file and collects the parameters ready to pass them
+        This method collects the parameters of the OpenMM system made by serialise_system ready to pass them
         to build tree.
         """
 
@@ -79,86 +88,116 @@ class Parametrisation:
                                           str(self.molecule.molecule['input'][i][0]) + str(800 + i),
                                           self.gaff_types[atom]]
 
-        input_xml_file = 'serialised.xml'
-        in_root = parse_tree(input_xml_file).getroot()
-
-        # Extract all bond data
-        for Bond in in_root.iter('Bond'):
-            bond = (int(Bond.get('p1')), int(Bond.get('p2')))
-            self.molecule.HarmonicBondForce[bond] = [Bond.get('d'), Bond.get('k')]
-
-        # Extract all angle data
-        for Angle in in_root.iter('Angle'):
-            angle = int(Angle.get('p1')), int(Angle.get('p2')), int(Angle.get('p3'))
-            self.molecule.HarmonicAngleForce[angle] = [Angle.get('a'), Angle.get('k')]
-
-        # Extract all non-bonded data
-        i = 0
-        for Atom in in_root.iter('Particle'):
-            if "eps" in Atom.attrib:
-                self.molecule.NonbondedForce[i] = [Atom.get('q'), Atom.get('sig'), Atom.get('eps')]
-                i += 1
-
-        # Extract all of the torsion data
-        phases = ['0', '3.141592653589793', '0', '3.141592653589793']
-        for Torsion in in_root.iter('Torsion'):
-            tor_string_forward = tuple(int(Torsion.get(f'p{i}')) for i in range(1, 5))
-            tor_string_back = tuple(reversed(tor_string_forward))
-
-            if tor_string_forward not in self.molecule.PeriodicTorsionForce.keys() and tor_string_back not in self.molecule.PeriodicTorsionForce.keys():
-                self.molecule.PeriodicTorsionForce[tor_string_forward] = [
-                    [Torsion.get('periodicity'), Torsion.get('k'), phases[int(Torsion.get('periodicity')) - 1]]]
-            elif tor_string_forward in self.molecule.PeriodicTorsionForce.keys():
-                self.molecule.PeriodicTorsionForce[tor_string_forward].append(
-                    [Torsion.get('periodicity'), Torsion.get('k'), phases[int(Torsion.get('periodicity')) - 1]])
-            elif tor_string_back in self.molecule.PeriodicTorsionForce.keys():
-                self.molecule.PeriodicTorsionForce[tor_string_back].append([Torsion.get('periodicity'),
-                                                                            Torsion.get('k'), phases[
-                                                                                int(Torsion.get('periodicity')) - 1]])
-        # Now we have all of the torsions from the openMM system
-        # we should check if any torsions we found in the molecule do not have parameters
-        # if they don't give them the default 0 parameter this will not change the energy
-        for tor_list in self.molecule.dihedrals.values():
-            for torsion in tor_list:
-                # change the indexing to check if they match
-                param = tuple(torsion[i] - 1 for i in range(4))
-                if param not in self.molecule.PeriodicTorsionForce.keys() and tuple(reversed(param)) not in self.molecule.PeriodicTorsionForce.keys():
-                    self.molecule.PeriodicTorsionForce[param] = [['1', '0', '0'], ['2', '0', '3.141592653589793'], ['3', '0', '0'], ['4', '0', '3.141592653589793']]
-
-        # Now we need to fill in all blank phases of the Torsions
-        for key in self.molecule.PeriodicTorsionForce.keys():
-            vns = ['1', '2', '3', '4']
-            if len(self.molecule.PeriodicTorsionForce[key]) < 4:
-                # now need to add the missing terms from the torsion force
-                for force in self.molecule.PeriodicTorsionForce[key]:
-                    vns.remove(force[0])
-                for i in vns:
-                    self.molecule.PeriodicTorsionForce[key].append([i, '0', phases[int(i) - 1]])
-        # sort by periodicity using lambda function
-        for key in self.molecule.PeriodicTorsionForce.keys():
-            self.molecule.PeriodicTorsionForce[key].sort(key=lambda x: x[0])
-
-        # now we need to tag the proper and improper torsions and reorder them so the first atom is the central
-        improper_torsions = OrderedDict()
-        for improper in self.molecule.improper_torsions:
-            for key in self.molecule.PeriodicTorsionForce:
-                # for each improper find the corresponding torsion parameters and save
-                if sorted(key) == sorted(tuple([x - 1 for x in improper])):
-                    # if they match tag the dihedral
-                    self.molecule.PeriodicTorsionForce[key].append('Improper')
-                    # replace the key with the strict improper order first atom is center
-                    improper_torsions[tuple([x - 1 for x in improper])] = self.molecule.PeriodicTorsionForce[key]
-
-        torsions = deepcopy(self.molecule.PeriodicTorsionForce)
-        # Remake the torsion store in the ligand
-        self.molecule.PeriodicTorsionForce = OrderedDict((v, k) for v, k in torsions.items() if k[-1] != 'Improper')
-        # now we need to add the impropers at the end of the torsion object
-        for key in improper_torsions.keys():
-            self.molecule.PeriodicTorsionForce[key] = improper_torsions[key]
+        self.store_forces()
+
+    def force_arrays(self, system):
+        """
+        Atoms (T, atoms) and parameter values (T, fields) of every term of each force of an OpenMM system,
+        as two arrays under the force name; the NonbondedForce has a row for each atom and no atom columns.
+        Each force is read term by term into the arrays rather than going through a serialised xml file.
+        Values are in the OpenMM units, as the xml holds them (nm, kJ/mol, radians, e).
+        """
+
+        forces = {force.__class__.__name__: force for force in system.getForces()}
+
+        arrays = {}
+        for name, count, getter, atoms, fields in (
+                ('HarmonicBondForce', 'getNumBonds', 'getBondParameters', 2, 2),
+                ('HarmonicAngleForce', 'getNumAngles', 'getAngleParameters', 3, 2),
+                ('NonbondedForce', 'getNumParticles', 'getParticleParameters', 0, 3),
+                # One row per periodicity of each torsion: periodicity, phase, k
+                ('PeriodicTorsionForce', 'getNumTorsions', 'getTorsionParameters', 4, 3)):
+
+            force = forces.get(name)
+            if force is None:
+                arrays[name] = empty((0, atoms), dtype=int64), empty((0, fields))
+                continue
+
+            terms = [getattr(force, getter)(i) for i in range(getattr(force, count)())]
+            indices = array([term[:atoms] for term in terms], dtype=int64).reshape(len(terms), atoms)
+            values = array([[value.value_in_unit_system(unit.md_unit_system) if unit.is_quantity(value) else value
+                             for value in term[atoms:]] for term in terms], dtype=float64).reshape(len(terms), fields)
+
+            arrays[name] = indices, values
+
+        return arrays
+
+    def store_forces(self, update=False, forces=None):
+        """
+        Store the parameters of the force objects of the OpenMM system (self.system) in the molecule's tables.
+
+        update          Add the system's bonds to the molecule (see Molecule.update) before the torsions are
+                        matched to its dihedrals and impropers, for proteins read without their bonds.
+        forces          The arrays of each force (see force_arrays) to store instead of reading the system,
+                        e.g. those put together from residue templates by XMLProtein.
+        """
+
+        if forces is None:
+            forces = self.force_arrays(self.system)
+
+        self.molecule.HarmonicBondForce = BondTable.from_arrays(*forces['HarmonicBondForce'])
+
+        if update:
+            self.molecule.update()
+
+        self.molecule.HarmonicAngleForce = AngleTable.from_arrays(*forces['HarmonicAngleForce'])
+
+        values = forces['NonbondedForce'][1]
+        self.molecule.NonbondedForce = NonbondedTable.from_arrays(arange(len(values)), values)
+
+        torsions, values = forces['PeriodicTorsionForce']
+        self.store_torsions(torsions, values[:, 0].astype(int64), values[:, 2])
+
+    def store_torsions(self, torsions, periodicities, barriers):
+        """
+        Build the torsion table from one row per periodicity of each torsion (atoms counted from 0).
+        Rows of the same torsion, given in either direction, are joined under the direction first given,
+        each periodicity left out gets no barrier, and every phase is the default of its periodicity.
+        Dihedrals of the molecule with no parameters are given none, so they do not change the energy.
+        Torsions over the atoms of an improper of the molecule are stored under the improper, centre first,
+        after the propers.
+        """
+
+        # Dihedrals of the molecule without parameters are added after them with no barriers
+        dihedrals = array([torsion for tor_list in self.molecule.dihedrals.values() for torsion in tor_list],
+                          dtype=int64).reshape(-1, 4) - 1
+        impropers = array(self.molecule.improper_torsions, dtype=int64).reshape(-1, 4) - 1
+
+        terms, rows, improper, sources = index_torsions(concatenate([torsions, dihedrals]), impropers)
+
+        values = zeros((len(terms), 8))
+        values[:, 4:] = TorsionTable.default_phases
+        values[rows[:len(torsions)], periodicities - 1] = barriers
+
+        # Torsions over the same atoms as an improper are moved to the improper, the last one found giving its values
+        found = sources >= 0
+
+        self.molecule.PeriodicTorsionForce = TorsionTable.from_arrays(
+            concatenate([terms[~improper], impropers[found]]),
+            concatenate([values[~improper], values[sources[found]]]),
+            concatenate([zeros((~improper).sum(), dtype=bool), ones(found.sum(), dtype=bool)]))
+
+    def write_system(self, system):
+        """Keep the OpenMM system, and write it to serialised.xml too when write_serialised is set (for debugging)."""
+
+        self.system = system
+
+        if self.write_serialised:
+            with open('serialised.xml', 'w+') as out:
+                out.write(XmlSerializer.serializeSystem(system))
 
     def get_gaff_types(self, fftype='gaff', file=None):
-        """Convert the pdb file into a mol2 antechamber file and get the gaff atom types
-        and gaff bonds if there were """
+        """Convert the pdb file into a mol2 antechamber file and get the gaff atom types.
+        The bonds are not taken from antechamber; a pdb without connections had them found from the coordinates
+        when it was read (see connectivity.perceive_bonds), and is rewritten with them here."""
+
+        # Write the bonds found when the molecule was read so antechamber and OpenMM are given the same ones
+        if self.molecule.filename.endswith('.pdb') and not len(PDBFile(self.molecule.filename).bonds):
+            self.molecule.write_pdb(input_type='input', name=f'{self.molecule.name}_qube')
+            self.molecule.filename = f'{self.molecule.name}_qube.pdb'
+            print(f'Molecule connections updated new pdb file made and used: {self.molecule.name}_qube.pdb')
+            # Update the input file name for the xml
+            self.input_file = f'{self.molecule.name}.xml'
 
         # call Antechamber to convert if we don't have the mol2 file
         if file is None:
@@ -187,51 +226,22 @@ class Parametrisation:
                 copy('out.mol2', mol2)
                 chdir(cwd)
 
-        # Get the gaff atom types and bonds in case we don't have this info
-        gaff_bonds = {}
+        # Get the gaff atom types
         with open(file, 'r') as mol_in:
             atoms = False
-            bonds = False
             for line in mol_in.readlines():
 
-                # TODO Surely this can be simplified?!
                 if '@<TRIPOS>ATOM' in line:
                     atoms = True
                     continue
-                elif '@<TRIPOS>BOND' in line:
+                elif '@<TRIPOS>' in line:
                     atoms = False
-                    bonds = True
-                    continue
-                elif '@<TRIPOS>SUBSTRUCTURE' in line:
-                    bonds = False
                     continue
                 if atoms:
                     self.gaff_types[self.molecule.atom_names[int(line.split()[0]) - 1]] = str(line.split()[5])
-                if bonds:
-                    try:
-                        gaff_bonds[int(line.split()[1])].append(int(line.split()[2]))
-                    except KeyError:
-                        gaff_bonds[int(line.split()[1])] = [int(line.split()[2])]
 
         append_to_log(f'GAFF types: {self.gaff_types}', msg_type='minor')
 
-        # Check if the molecule already has bonds; if not apply these bonds
-        if not list(self.molecule.topology.edges):
-            # add the bonds to the molecule
-            for key, value in gaff_bonds.items():
-                for node in value:
-                    self.molecule.topology.add_edge(key, node)
-
-            self.molecule.update()
-
-            # Warning this rewrites the pdb file and re
-            # Write a new pdb with the connection information
-            self.molecule.write_pdb(input_type='input', name=f'{self.molecule.name}_qube')
-            self.molecule.filename = f'{self.molecule.name}_qube.pdb'
-            print(f'Molecule connections updated new pdb file made and used: {self.molecule.name}_qube.pdb')
-            # Update the input file name for the xml
-            self.input_file = f'{self.molecule.name}.xml'
-
 
 @for_all_methods(timer_logger)
 class XML(Parametrisation):
@@ -247,7 +257,7 @@ class XML(Parametrisation):
         self.molecule.parameter_engine = 'XML input ' + self.fftype
 
     def serialise_system(self):
-        """Serialise the input XML system using openmm."""
+        """Make the OpenMM system from the input XML."""
 
         pdb = app.PDBFile(self.molecule.filename)
         modeller = app.Modeller(pdb.topology, pdb.positions)
@@ -261,26 +271,39 @@ class XML(Parametrisation):
                 raise FileNotFoundError('No .xml type file found.')
 
         system = forcefield.createSystem(modeller.topology, nonbondedMethod=app.NoCutoff, constraints=None)
-
-        xml = XmlSerializer.serializeSystem(system)
-        with open('serialised.xml', 'w+') as out:
-            out.write(xml)
+        self.write_system(system)
 
 
 @for_all_methods(timer_logger)
 class XMLProtein(Parametrisation):
-    """Read in the parameters for a protein from the QUBEKit_general XML file and store them into the protein."""
+    """
+    Read in the parameters for a protein from the QUBEKit_general XML file and store them into the protein.
+
+    A protein is a few residue templates repeated many times, so rather than making the OpenMM system of the whole
+    protein, a system is made for each distinct residue (by name, atom names and bonds, so each terminal and
+    protonation variant is its own residue) and for each distinct pair of bonded residues (peptide bonds and
+    disulphides); their parameters are then copied onto every residue and link of the protein by indexing.
+    The system of the whole protein is made instead when cache_residues is False (the class default can be
+    overridden for one protein with the cache_residues argument) or write_serialised is set,
+    or if a bonded term of the protein spans three residues, which the pairs would miss.
+    """
+
+    cache_residues = True
 
-    def __init__(self, protein, input_file='QUBE_general_pi.xml', fftype='CM1A/OPLS'):
+    def __init__(self, protein, input_file='QUBE_general_pi.xml', fftype='CM1A/OPLS', cache_residues=None):
 
         super().__init__(protein, input_file, fftype)
 
+        if cache_residues is not None:
+            self.cache_residues = cache_residues
+        self.forces = None
+
         self.serialise_system()
         self.gather_parameters()
         self.molecule.parameter_engine = 'XML input ' + self.fftype
 
     def serialise_system(self):
-        """Serialise the input XML system using openmm."""
+        """Make the OpenMM systems from the input XML."""
 
         pdb = app.PDBFile(self.molecule.filename)
         modeller = app.Modeller(pdb.topology, pdb.positions)
@@ -293,15 +316,137 @@ class XMLProtein(Parametrisation):
             except FileNotFoundError:
                 raise FileNotFoundError('No .xml type file found.')
 
-        system = forcefield.createSystem(modeller.topology, nonbondedMethod=app.NoCutoff, constraints=None)
+        if self.cache_residues and not self.write_serialised:
+            self.forces = self.residue_forces(forcefield, modeller.topology)
+
+        if self.forces is None:
+            system = forcefield.createSystem(modeller.topology, nonbondedMethod=app.NoCutoff, constraints=None)
+            self.write_system(system)
+
+    def residue_forces(self, forcefield, topology):
+        """
+        Put together the arrays of each force of the protein (see force_arrays) from the systems of its distinct
+        residues and bonded pairs of residues, so only one small system is made per template or link.
+        Returns None if a bonded term spans three residues.
+        """
 
-        xml = XmlSerializer.serializeSystem(system)
-        with open('serialised.xml', 'w+') as out:
-            out.write(xml)
+        residues = list(topology.residues())
+        members = [[atom.index for atom in residue.atoms()] for residue in residues]
+        atom_count = topology.getNumAtoms()
+
+        # Residue of each atom and its position in the residue
+        residue = empty(atom_count, dtype=int64)
+        local = empty(atom_count, dtype=int64)
+        for index, atoms in enumerate(members):
+            residue[atoms] = index
+            local[atoms] = arange(len(atoms))
+
+        bonds = array([(a.index, b.index) for a, b in topology.bonds()], dtype=int64).reshape(-1, 2)
+
+        # Every angle and dihedral (so every improper too) must lie within a residue or a bonded pair of them
+        connections = Topology.from_edges(bonds, arange(atom_count))
+        for terms in (connections.angles(), connections.dihedrals()[0]):
+            spanned = sort(residue[terms], axis=1)
+            if ((spanned[:, 1:] != spanned[:, :-1]).sum(axis=1) > 1).any():
+                return None
+
+        # Bonds within each residue, and links between pairs of residues, by position in their residues
+        internal = [[] for _ in residues]
+        links = {}
+        owner, position = residue.tolist(), local.tolist()
+        for a, b in bonds.tolist():
+            if owner[a] == owner[b]:
+                internal[owner[a]].append(tuple(sorted((position[a], position[b]))))
+            else:
+                # The earlier residue of the pair first
+                if owner[a] > owner[b]:
+                    a, b = b, a
+                links.setdefault((owner[a], owner[b]), []).append((position[a], position[b]))
+
+        # Residues with the same name, atom names (in order) and bonds share a template, as do the pairs of
+        # templates with the same links; each template lists the residues (or pairs) it is used for
+        templates = {}
+        for index, res in enumerate(residues):
+            key = (res.name, tuple(atom.name for atom in res.atoms()), tuple(sorted(internal[index])))
+            templates.setdefault(key, []).append((index, ))
+
+        kinds = [0] * len(residues)
+        for kind, occurrences in enumerate(templates.values()):
+            for index, in occurrences:
+                kinds[index] = kind
+
+        pairs = {}
+        for (first, second), linked in links.items():
+            pairs.setdefault((kinds[first], kinds[second], tuple(sorted(linked))), []).append((first, second))
+
+        names = ('HarmonicBondForce', 'HarmonicAngleForce', 'PeriodicTorsionForce')
+        stamped = {name: [] for name in names}
+        nonbonded = zeros((atom_count, 3))
+
+        for occurrences in chain(templates.values(), pairs.values()):
+            occurrences = array(occurrences, dtype=int64)
+            first = occurrences[0].tolist()
+
+            # Atoms of each occurrence in the order of the fragment: those of the first residue then the second
+            atoms = concatenate([array([members[index] for index in column], dtype=int64)
+                                 for column in occurrences.T.tolist()], axis=1)
+
+            # Bonds of the fragment by position in it
+            split = len(members[first[0]])
+            fragment_bonds = list(internal[first[0]])
+            if len(first) == 2:
+                fragment_bonds.extend((a + split, b + split) for a, b in internal[first[1]])
+                fragment_bonds.extend((a, b + split) for a, b in links[tuple(first)])
+
+            forces = self.fragment_forces(forcefield, [residues[index] for index in first], fragment_bonds)
+
+            # Residues take every term; pairs only the terms which span both residues, the rest are the residues'
+            for name in names:
+                terms, values = forces[name]
+                if len(first) == 2:
+                    spans = (terms < split).any(axis=1) & (terms >= split).any(axis=1)
+                    terms, values = terms[spans], values[spans]
+
+                # Each copy belongs to the last residue it touches, so the terms can be put in residue order
+                stamped[name].append((atoms[:, terms].reshape(-1, terms.shape[1]), tile(values, (len(atoms), 1)),
+                                      repeat(occurrences[:, -1], len(terms))))
+
+            if len(first) == 1:
+                nonbonded[atoms.ravel()] = tile(forces['NonbondedForce'][1], (len(atoms), 1))
+
+        arrays = {'NonbondedForce': (empty((atom_count, 0), dtype=int64), nonbonded)}
+        for name in names:
+            terms, values, owners = (concatenate(parts) for parts in zip(*stamped[name]))
+            order = argsort(owners, kind='stable')
+            arrays[name] = terms[order], values[order]
+
+        return arrays
+
+    def fragment_forces(self, forcefield, residues, bonds):
+        """
+        Arrays of each force (see force_arrays) of a system made of copies of just the given residues,
+        with bonds given by position in the fragment (the residues' atoms in order).
+        Bonds to residues left out are ignored when the residues are matched to the templates.
+        """
+
+        fragment = app.Topology()
+        fragment_chain = fragment.addChain()
+        atoms = []
+        for residue in residues:
+            fragment_residue = fragment.addResidue(residue.name, fragment_chain)
+            atoms.extend(fragment.addAtom(atom.name, atom.element, fragment_residue) for atom in residue.atoms())
+
+        for a, b in bonds:
+            fragment.addBond(atoms[a], atoms[b])
+
+        system = forcefield.createSystem(fragment, nonbondedMethod=app.NoCutoff, constraints=None,
+                                         ignoreExternalBonds=True)
+
+        return self.force_arrays(system)
 
     def gather_parameters(self):
-        """This method parses the serialised xml file and collects the parameters ready to pass them
-        to build tree.
+        """This method collects the parameters of the OpenMM system (or the residue systems) ready to pass them
+        to build tree; the protein is given the bonds of the system first.
         """
 
         # Try to gather the AtomTypes first
@@ -309,86 +454,7 @@ class XMLProtein(Parametrisation):
             self.molecule.AtomTypes[i] = [atom, 'QUBE_' + str(i),
                                           str(self.molecule.molecule['input'][i][0]) + str(i)]
 
-        input_xml_file = 'serialised.xml'
-        in_root = parse_tree(input_xml_file).getroot()
-
-        # Extract all bond data
-        for Bond in in_root.iter('Bond'):
-            self.molecule.HarmonicBondForce[(int(Bond.get('p1')), int(Bond.get('p2')))] = [Bond.get('d'), Bond.get('k')]
-
-        # before we continue update the protein class
-        self.molecule.update()
-
-        # Extract all angle data
-        for Angle in in_root.iter('Angle'):
-            self.molecule.HarmonicAngleForce[int(Angle.get('p1')), int(Angle.get('p2')), int(Angle.get('p3'))] = [
-                Angle.get('a'), Angle.get('k')]
-
-        # Extract all non-bonded data
-        i = 0
-        for Atom in in_root.iter('Particle'):
-            if "eps" in Atom.attrib:
-                self.molecule.NonbondedForce[i] = [Atom.get('q'), Atom.get('sig'), Atom.get('eps')]
-                i += 1
-
-        # Extract all of the torsion data
-        phases = ['0', '3.141592653589793', '0', '3.141592653589793']
-        for Torsion in in_root.iter('Torsion'):
-            tor_string_forward = tuple(int(Torsion.get(f'p{i}')) for i in range(1, 5))
-            tor_string_back = tuple(reversed(tor_string_forward))
-
-            if tor_string_forward not in self.molecule.PeriodicTorsionForce.keys() and tor_string_back not in self.molecule.PeriodicTorsionForce.keys():
-                self.molecule.PeriodicTorsionForce[tor_string_forward] = [
-                    [Torsion.get('periodicity'), Torsion.get('k'), phases[int(Torsion.get('periodicity')) - 1]]]
-            elif tor_string_forward in self.molecule.PeriodicTorsionForce.keys():
-                self.molecule.PeriodicTorsionForce[tor_string_forward].append(
-                    [Torsion.get('periodicity'), Torsion.get('k'), phases[int(Torsion.get('periodicity')) - 1]])
-            elif tor_string_back in self.molecule.PeriodicTorsionForce.keys():
-                self.molecule.PeriodicTorsionForce[tor_string_back].append([Torsion.get('periodicity'),
-                                                                            Torsion.get('k'), phases[
-                                                                                int(Torsion.get('periodicity')) - 1]])
-        # Now we have all of the torsions from the openMM system
-        # we should check if any torsions we found in the molecule do not have parameters
-        # if they don't give them the default 0 parameter this will not change the energy
-        for tor_list in self.molecule.dihedrals.values():
-            for torsion in tor_list:
-                # change the indexing to check if they match
-                param = tuple(torsion[i] - 1 for i in range(4))
-                if param not in self.molecule.PeriodicTorsionForce.keys() and tuple(
-                        reversed(param)) not in self.molecule.PeriodicTorsionForce.keys():
-                    self.molecule.PeriodicTorsionForce[param] = [['1', '0', '0'], ['2', '0', '3.141592653589793'],
-                                                                 ['3', '0', '0'], ['4', '0', '3.141592653589793']]
-
-        # Now we need to fill in all blank phases of the Torsions
-        for key in self.molecule.PeriodicTorsionForce.keys():
-            vns = ['1', '2', '3', '4']
-            if len(self.molecule.PeriodicTorsionForce[key]) < 4:
-                # now need to add the missing terms from the torsion force
-                for force in self.molecule.PeriodicTorsionForce[key]:
-                    vns.remove(force[0])
-                for i in vns:
-                    self.molecule.PeriodicTorsionForce[key].append([i, '0', phases[int(i) - 1]])
-        # sort by periodicity using lambda function
-        for key in self.molecule.PeriodicTorsionForce.keys():
-            self.molecule.PeriodicTorsionForce[key].sort(key=lambda x: x[0])
-
-        # now we need to tag the proper and improper torsions and reorder them so the first atom is the central
-        improper_torsions = OrderedDict()
-        for improper in self.molecule.improper_torsions:
-            for key in self.molecule.PeriodicTorsionForce:
-                # for each improper find the corresponding torsion parameters and save
-                if sorted(key) == sorted(tuple([x - 1 for x in improper])):
-                    # if they match tag the dihedral
-                    self.molecule.PeriodicTorsionForce[key].append('Improper')
-                    # replace the key with the strict improper order first atom is center
-                    improper_torsions[tuple([x - 1 for x in improper])] = self.molecule.PeriodicTorsionForce[key]
-
-        torsions = deepcopy(self.molecule.PeriodicTorsionForce)
-        # now we should remake the torsion store in the ligand
-        self.molecule.PeriodicTorsionForce = OrderedDict((v, k) for v, k in torsions.items() if k[-1] != 'Improper')
-        # now we need to add the impropers at the end of the torsion object
-        for key in improper_torsions.keys():
-            self.molecule.PeriodicTorsionForce[key] = improper_torsions[key]
+        self.store_forces(update=True, forces=self.forces)
 
 
 @for_all_methods(timer_logger)
@@ -410,13 +476,11 @@ class AnteChamber(Parametrisation):
         self.molecule.parameter_engine = 'AnteChamber ' + self.fftype
 
     def serialise_system(self):
-        """Serialise the amber style files into an openmm object."""
+        """Make the OpenMM system from the amber style files."""
 
         prmtop = app.AmberPrmtopFile(self.prmtop)
         system = prmtop.createSystem(nonbondedMethod=app.NoCutoff, constraints=None)
-
-        with open('serialised.xml', 'w+') as out:
-            out.write(XmlSerializer.serializeSystem(system))
+        self.write_system(system)
 
     def antechamber_cmd(self):
         """Method to run Antechamber, parmchk2 and tleap."""
@@ -491,7 +555,7 @@ class AnteChamber(Parametrisation):
 class OpenFF(Parametrisation):
     """
     This class uses the openFF in openeye to parametrise the molecule using frost.
-    A serialised XML is then stored in the parameter dictionaries.
+    The parameters of the OpenMM system are then stored in the parameter tables.
     """
 
     def __init__(self, molecule, input_file=None, fftype='frost', mol2_file=None):
@@ -503,7 +567,7 @@ class OpenFF(Parametrisation):
         self.molecule.parameter_engine = 'OpenFF ' + self.fftype
 
     def serialise_system(self):
-        """Create the OpenMM system; parametrise using frost; serialise the system."""
+        """Create the OpenMM system; parametrise using frost."""
 
         # Load molecule using OpenEye tools
         mol = oechem.OEGraphMol()
@@ -520,9 +584,7 @@ class OpenFF(Parametrisation):
         topology = generateTopologyFromOEMol(mol)
         system = forcefield.createSystem(topology, [mol])
 
-        # Serialise the OpenMM system into the xml file
-        with open('serialised.xml', 'w+') as out:
-            out.write(XmlSerializer.serializeSystem(system))
+        self.write_system(system)
 
         # get the gaff atom types
         self.get_gaff_types()
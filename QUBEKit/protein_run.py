@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 from QUBEKit.ligand import Protein
+from QUBEKit.engines import ONETEP
 from QUBEKit.parametrisation import XMLProtein
 from QUBEKit.lennard_jones import LennardJones
 from QUBEKit.protein_tools import qube_general, pdb_reformat, get_water
@@ -12,7 +13,7 @@ import argparse
 def main():
     """
     This script is used to prepare proteins with the QUBE FF
-    1) prepare the protein for onetep using --setup which prints an xyz of the system
+    1) prepare the protein for onetep using --setup which prints an xyz and a minimal cell ONETEP input of the system
     2) after the onetep calculation bring back the ddec.onetep file and parametrise the system with --build
     this must be the same pdb used in setup as the atom order must be retained.
     """
@@ -27,9 +28,12 @@ def main():
             print('starting protein prep, reading pdb file...')
             protein = Protein(values)
             print(f'{len(protein.Residues)} residues found!')
-            # TODO find the magic numbers for the box for onetep
             protein.write_xyz(name='protein')
-            print(f'protein.xyz file made for ONETEP\n Run this file')
+            # The net charge comes from the residues; the protein is always closed shell here
+            print(f'Net charge {protein.charge}')
+            configs = [{'charge': protein.charge, 'multiplicity': 1}, {}, {}, {}]
+            ONETEP(protein, configs).generate_input(name='protein')
+            print(f'protein.xyz and protein.dat files made for ONETEP\n Run the protein.dat file')
             exit()
 
     class BuildAction(argparse.Action):
@@ -41,14 +45,15 @@ def main():
             pro = Protein(values)
             # print the QUBE general FF to use in the parametrisation
             qube_general()
-            # now we want to add the connections and parametrise the protein
+            # now we want to add the connections and parametrise the protein;
+            # each distinct residue and linked pair of residues is parametrised once and copied over the protein
             XMLProtein(pro)
             # this updates the bonded info that is now in the object
 
             # finally we need the non-bonded parameters from onetep
-            # fake configs as this will always be true
+            # The charges must add up to the net charge of the residues
             # TODO should we also have the ability to get DDEC6 charges from the cube file?
-            configs = [{'charge': 0}, {'charges_engine': 'onetep', 'density_engine': 'onetep'}, {}, {}]
+            configs = [{'charge': pro.charge}, {'charges_engine': 'onetep', 'density_engine': 'onetep'}, {}, {}]
             lj = LennardJones(pro, config_dict=configs)
             pro.NonbondedForce = lj.calculate_non_bonded_force()
 
@@ -57,7 +62,8 @@ def main():
             print('Writing pdb file with conections...')
             pro.write_pdb(name='QUBE_pro')
             print('Writing XML file for the system...')
-            pro.write_parameters(name='QUBE_pro', protein=True)
+            # atoms with identical parameters share types so OpenMM can read the file quickly
+            pro.write_parameters(name='QUBE_pro', protein=True, collapse=True)
             # now remove the qube general file
             remove('QUBE_general_pi.xml')
             print('Done')
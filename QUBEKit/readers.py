@@ -0,0 +1,712 @@
+#!/usr/bin/env python
+
+from numpy import array, concatenate, cross, dot, empty, float64, int64, repeat, stack
+from numpy.lib.format import open_memmap
+
+from itertools import islice
+from math import ceil
+from mmap import mmap, ACCESS_READ
+from os import close, path, remove, replace
+from re import sub
+from tempfile import mkstemp
+
+
+class CubeFile:
+    """
+    Memory-mapped reader for Gaussian style cube files (as written by PSI4 cubeprop, Gaussian and ONETEP).
+
+    The volumetric data in a cube file is plain text, so it cannot be mapped directly.
+    On first use the values are streamed, a block of lines at a time, into a binary .npy sidecar
+    (e.g. total_density.cube.npy) which is then memory-mapped. The sidecar is reused while it is newer than the cube,
+    so only the pages of the grid which are actually touched are ever read into RAM.
+
+    inputs
+    ---------------
+    filename                    The cube file to read
+    dtype                       The dtype used to store the grid in the sidecar file (float64 by default)
+    cache_file                  Optional name of the binary sidecar file; defaults to filename + '.npy'
+    chunk_lines                 Number of text lines converted per block while building the sidecar
+
+    attributes
+    ---------------
+    comments                    The two comment lines at the top of the file
+    origin                      numpy array of the grid origin (bohr)
+    shape                       tuple of the number of grid points along each axis (nx, ny, nz)
+    axes                        3 x 3 numpy array; each row is the step vector of one axis (bohr)
+    atomic_numbers              numpy int array of the atomic numbers of the atoms in the header
+    nuclear_charges             numpy array of the nuclear charges of the atoms in the header
+    coords                      (N, 3) numpy array of the atomic positions (bohr)
+    mo_indices                  List of the molecular orbital numbers if the cube holds orbitals
+    grid                        (nx, ny, nz) read-only numpy memmap of the volumetric data
+    """
+
+    bohr_to_angs = 0.529177
+
+    def __init__(self, filename, dtype=float64, cache_file=None, chunk_lines=100000):
+
+        self.filename = filename
+        self.dtype = dtype
+        self.cache_file = cache_file if cache_file is not None else f'{filename}.npy'
+        self.chunk_lines = chunk_lines
+
+        self.comments = None
+        self.origin = None
+        self.shape = None
+        self.axes = None
+        self.atomic_numbers = None
+        self.nuclear_charges = None
+        self.coords = None
+        self.mo_indices = []
+
+        # Number of header lines before the volumetric data starts
+        self.data_start = None
+        self._grid = None
+
+        self.read_header()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(filename={self.filename!r}, shape={self.shape!r})'
+
+    def read_header(self):
+        """Read the comments, grid definition and atoms from the top of the cube file."""
+
+        with open(self.filename, 'r') as cube:
+            self.comments = [cube.readline().rstrip('\n'), cube.readline().rstrip('\n')]
+
+            atom_line = cube.readline().split()
+            n_atoms = int(atom_line[0])
+            self.origin = array([float(val) for val in atom_line[1:4]])
+
+            shape, axes = [], []
+            for _ in range(3):
+                axis_line = cube.readline().split()
+                shape.append(int(axis_line[0]))
+                axes.append([float(val) for val in axis_line[1:4]])
+
+            # A negative number of points means the axis vectors are given in angstroms
+            axes = array(axes)
+            for axis in range(3):
+                if shape[axis] < 0:
+                    shape[axis] = abs(shape[axis])
+                    axes[axis] /= self.bohr_to_angs
+
+            self.shape = tuple(shape)
+            self.axes = axes
+
+            atoms = [cube.readline().split() for _ in range(abs(n_atoms))]
+            self.atomic_numbers = array([int(atom[0]) for atom in atoms], dtype=int)
+            self.nuclear_charges = array([float(atom[1]) for atom in atoms])
+            self.coords = array([[float(val) for val in atom[2:5]] for atom in atoms]).reshape(-1, 3)
+
+            self.data_start = 6 + abs(n_atoms)
+
+            # A negative number of atoms means there is an extra line listing the orbitals in the file
+            if n_atoms < 0:
+                mo_line = cube.readline().split()
+                self.mo_indices = [int(val) for val in mo_line[1:]]
+                self.data_start += 1
+
+    def n_values(self):
+        """Number of values in the grid, over every orbital of orbital cubes."""
+
+        return self.shape[0] * self.shape[1] * self.shape[2] * max(len(self.mo_indices), 1)
+
+    def cache_is_current(self):
+        """
+        Check if the binary sidecar exists, is newer than the cube file and holds a grid of the right size and dtype.
+        Only the .npy header is read.
+        """
+
+        if not path.exists(self.cache_file):
+            return False
+
+        if path.getmtime(self.cache_file) < path.getmtime(self.filename):
+            return False
+
+        try:
+            cached = open_memmap(self.cache_file, mode='r')
+        except (OSError, ValueError):
+            return False
+
+        return cached.shape == (self.n_values(),) and cached.dtype == self.dtype
+
+    def build_cache(self):
+        """
+        Stream the text grid into the binary sidecar file.
+        Only chunk_lines lines of text are held in memory at any one time.
+        The sidecar is built under a temporary name and renamed into place once it is complete,
+        so an interrupted or failed build never leaves a partial sidecar to be trusted next time.
+        """
+
+        n_values = self.n_values()
+
+        handle, temp = mkstemp(dir=path.dirname(path.abspath(self.cache_file)), prefix='.', suffix='.npy.tmp')
+        close(handle)
+
+        try:
+            flat = open_memmap(temp, mode='w+', dtype=self.dtype, shape=(n_values,))
+
+            filled = 0
+            with open(self.filename, 'r') as cube:
+                for _ in range(self.data_start):
+                    cube.readline()
+
+                while True:
+                    lines = list(islice(cube, self.chunk_lines))
+                    if not lines:
+                        break
+
+                    values = array(' '.join(lines).split(), dtype=float64)
+                    if filled + len(values) > n_values:
+                        raise EOFError(f'More grid values found in {self.filename} than the header describes.')
+
+                    flat[filled:filled + len(values)] = values
+                    filled += len(values)
+
+            if filled != n_values:
+                raise EOFError(f'Expected {n_values} grid values in {self.filename} but only found {filled}.')
+
+            # Make sure everything is on disk before the file is renamed and re-opened read only
+            flat.flush()
+            del flat
+
+        except BaseException:
+            remove(temp)
+            raise
+
+        replace(temp, self.cache_file)
+
+    @property
+    def grid(self):
+        """
+        The volumetric data as a read-only (nx, ny, nz) memmap;
+        orbital cubes have an extra trailing axis with one entry per orbital.
+        """
+
+        if self._grid is None:
+            if not self.cache_is_current():
+                self.build_cache()
+
+            shape = self.shape + ((len(self.mo_indices),) if len(self.mo_indices) > 1 else ())
+
+            self._grid = open_memmap(self.cache_file, mode='r').reshape(shape)
+
+        return self._grid
+
+    def view(self, start=(0, 0, 0), stop=None, step=(1, 1, 1)):
+        """
+        Return a zero-copy strided view of a sub-box of the grid, in grid index units.
+        e.g. view(step=(2, 2, 2)) gives every other point along each axis without reading the rest.
+        """
+
+        stop = self.shape if stop is None else stop
+
+        return self.grid[start[0]:stop[0]:step[0], start[1]:stop[1]:step[1], start[2]:stop[2]:step[2]]
+
+    def box(self, lower, upper, step=(1, 1, 1)):
+        """
+        Return a view of all grid points inside the box defined by the lower and upper corners (bohr).
+        Only valid for grids whose axes are aligned with x, y and z (which is always the case for QUBEKit cubes).
+        Also returns the origin of the returned sub-grid.
+        """
+
+        spacing = array([self.axes[axis][axis] for axis in range(3)])
+
+        start = [max(int((lower[axis] - self.origin[axis]) // spacing[axis]), 0) for axis in range(3)]
+        stop = [min(ceil((upper[axis] - self.origin[axis]) / spacing[axis]) + 1, self.shape[axis])
+                for axis in range(3)]
+
+        sub_origin = self.origin + array(start) * spacing
+
+        return self.view(start, stop, step), sub_origin
+
+    def downsample(self, factor=2):
+        """
+        Block-average the grid by an integer factor along each axis.
+        Works through the grid one slab of x planes at a time so memory use is bounded by the output size.
+        Points which do not fill a whole block at the upper edges are dropped.
+        Orbital cubes keep their trailing orbital axis; each orbital is averaged separately.
+        Returns the smaller grid as a normal numpy array with the matching axes.
+        """
+
+        nx, ny, nz = (size // factor for size in self.shape)
+        orbitals = self.grid.shape[3:]
+        reduced = empty((nx, ny, nz) + orbitals, dtype=float64)
+
+        for i in range(nx):
+            # Only this slab of factor planes is paged in from disk
+            slab = array(self.grid[i * factor:(i + 1) * factor, :ny * factor, :nz * factor], dtype=float64)
+            reduced[i] = slab.reshape((factor, ny, factor, nz, factor) + orbitals).mean(axis=(0, 2, 4))
+
+        return reduced, self.axes * factor
+
+    def points(self, indices):
+        """Convert an (M, 3) array of integer grid indices to cartesian positions (bohr)."""
+
+        return self.origin + array(indices) @ self.axes
+
+    def integrate(self):
+        """Integrate the grid (e.g. to get the number of electrons from a density cube) one slab at a time."""
+
+        # Volume of a single grid cell
+        volume = abs(dot(self.axes[0], cross(self.axes[1], self.axes[2])))
+
+        total = 0.0
+        for i in range(self.shape[0]):
+            total += float(self.grid[i].sum())
+
+        return total * volume
+
+
+class WFXFile:
+    """
+    Lazy reader for AIMAll style wfx wavefunction files (as written by Gaussian with OUTPUT=WFX).
+
+    The file is memory-mapped and nothing is parsed on instancing.
+    Each header section is only located and parsed the first time it is asked for, then cached.
+    The large primitive and coefficient sections are never touched unless explicitly requested with section().
+
+    e.g.
+        wfx = WFXFile('methane.wfx')
+        wfx.number_of_nuclei        -> 5
+        wfx.nuclear_names           -> ['C1', 'H2', 'H3', 'H4', 'H5']
+        wfx.nuclear_coordinates     -> (5, 3) numpy array (bohr)
+    """
+
+    # Sections written after the (very large) orbital coefficients; these are searched for from the end of the file.
+    trailing_tags = ('Energy', 'Virial Ratio (-V/T)', 'Nuclear Cartesian Energy Gradients', 'Nuclear Virial of Energy-Gradient-Based Forces on Nuclei, W')
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        self._cache = {}
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(filename={self.filename!r})'
+
+    def section(self, tag):
+        """
+        Return the raw text between <tag> and </tag> as a list of stripped, non-empty lines.
+        Raises KeyError if the section is not in the file.
+        """
+
+        open_tag, close_tag = f'<{tag}>'.encode(), f'</{tag}>'.encode()
+
+        with open(self.filename, 'rb') as wfx_file:
+            with mmap(wfx_file.fileno(), 0, access=ACCESS_READ) as wfx:
+                if tag in self.trailing_tags:
+                    start = wfx.rfind(open_tag)
+                else:
+                    start = wfx.find(open_tag)
+
+                if start == -1:
+                    raise KeyError(f'Cannot find the {tag} section in {self.filename}.')
+
+                start += len(open_tag)
+                end = wfx.find(close_tag, start)
+                if end == -1:
+                    raise EOFError(f'The {tag} section in {self.filename} is not closed.')
+
+                text = wfx[start:end].decode()
+
+        return [line.strip() for line in text.splitlines() if line.strip()]
+
+    def _get(self, key, tag, convert):
+        """Parse a section the first time it is requested and cache the converted result."""
+
+        if key not in self._cache:
+            self._cache[key] = convert(self.section(tag))
+
+        return self._cache[key]
+
+    @staticmethod
+    def _values(lines, dtype=float):
+        """Convert all whitespace separated values in a list of lines to a numpy array."""
+
+        return array(' '.join(lines).replace('D', 'E').split(), dtype=dtype)
+
+    @property
+    def title(self):
+        return self._get('title', 'Title', lambda lines: ' '.join(lines))
+
+    @property
+    def number_of_nuclei(self):
+        return self._get('number_of_nuclei', 'Number of Nuclei', lambda lines: int(lines[0]))
+
+    @property
+    def number_of_occupied_molecular_orbitals(self):
+        return self._get('number_of_occupied_mos', 'Number of Occupied Molecular Orbitals', lambda lines: int(lines[0]))
+
+    @property
+    def number_of_primitives(self):
+        return self._get('number_of_primitives', 'Number of Primitives', lambda lines: int(lines[0]))
+
+    @property
+    def net_charge(self):
+        return self._get('net_charge', 'Net Charge', lambda lines: float(lines[0]))
+
+    @property
+    def number_of_electrons(self):
+        return self._get('number_of_electrons', 'Number of Electrons', lambda lines: float(lines[0]))
+
+    @property
+    def multiplicity(self):
+        return self._get('multiplicity', 'Electronic Spin Multiplicity', lambda lines: int(lines[0]))
+
+    @property
+    def nuclear_names(self):
+        return self._get('nuclear_names', 'Nuclear Names', lambda lines: [name for line in lines for name in line.split()])
+
+    @property
+    def atomic_numbers(self):
+        return self._get('atomic_numbers', 'Atomic Numbers', lambda lines: self._values(lines, dtype=int))
+
+    @property
+    def nuclear_charges(self):
+        return self._get('nuclear_charges', 'Nuclear Charges', self._values)
+
+    @property
+    def nuclear_coordinates(self):
+        """(N, 3) numpy array of the nuclear positions (bohr)."""
+
+        return self._get('nuclear_coordinates', 'Nuclear Cartesian Coordinates',
+                         lambda lines: self._values(lines).reshape(-1, 3))
+
+    @property
+    def occupation_numbers(self):
+        return self._get('occupation_numbers', 'Molecular Orbital Occupation Numbers', self._values)
+
+    @property
+    def orbital_energies(self):
+        return self._get('orbital_energies', 'Molecular Orbital Energies', self._values)
+
+    @property
+    def energy(self):
+        """Total energy (hartree) from the end of the file."""
+
+        return self._get('energy', 'Energy', lambda lines: float(lines[0].replace('D', 'E')))
+
+
+class PDBFile:
+    """
+    Streaming fixed-column reader for PDB files.
+
+    The file is read once, a block of lines at a time; each ATOM/HETATM record is cut into its columns
+    without splitting and the coordinates of a whole block are converted to floats in one numpy call.
+    CONECT records are read from their fixed 5 character fields, so atom serial numbers of 10000 and above
+    (where the fields run together) are still read correctly, and are stored as an edge array.
+
+    inputs
+    ---------------
+    filename                    The pdb file to read
+    chunk_lines                 Number of lines processed per block
+
+    attributes
+    ---------------
+    names                       numpy str array of the atom names (columns 12-16)
+    residues                    numpy str array of the residue name of each atom (columns 18-21)
+    residue_ids                 numpy str array of the chain, residue number and insertion code of each atom
+                                (columns 22-27), which tell neighbouring residues of the same name apart
+    elements                    numpy str array of the element column (77-78) with any digits removed;
+                                '' where the column is missing so the caller can decide how to fill it in
+    coords                      (N, 3) float64 numpy array of the coordinates (angstroms)
+    bonds                       (B, 2) int numpy array of the CONECT pairs, using the atom serial numbers of the file
+    """
+
+    # Element columns sometimes hold charges or numbers; they are removed like sub('[0-9]+', '', element)
+    remove_digits = str.maketrans('', '', '0123456789')
+
+    def __init__(self, filename, chunk_lines=100000):
+
+        self.filename = filename
+        self.chunk_lines = chunk_lines
+
+        self.names = None
+        self.residues = None
+        self.residue_ids = None
+        self.elements = None
+        self.coords = None
+        self.bonds = None
+
+        self.read()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(filename={self.filename!r}, atoms={len(self)})'
+
+    def __len__(self):
+        return len(self.names)
+
+    def read(self):
+        """Read the atom records and connections into numpy arrays."""
+
+        # Each block adds to the lists; the arrays are joined once the whole file has been read
+        names, residues, residue_ids, elements, coords, bonds = [], [], [], [], [], []
+
+        with open(self.filename, 'r') as pdb:
+            while True:
+                lines = list(islice(pdb, self.chunk_lines))
+                if not lines:
+                    break
+
+                atoms = [line for line in lines if line.startswith(('ATOM', 'HETATM'))]
+
+                # Column 11 is blank in a standard file but QUBEKit protein files let long names spill into it
+                names.extend(line[11:16].strip() for line in atoms)
+                residues.extend(line[17:21].strip() for line in atoms)
+                residue_ids.extend(line[21:27] for line in atoms)
+                elements.extend(line[76:78].translate(self.remove_digits).strip() for line in atoms)
+
+                # Cut the 24 character coordinate fields into three 8 character fields and convert them together;
+                # numpy converts byte strings to numbers much faster than str
+                try:
+                    coords.append(array([line[30:54] for line in atoms], dtype='S24').view('S8').astype(float64))
+                except ValueError:
+                    raise ValueError(f'Cannot read the coordinates in {self.filename}; '
+                                     f'are the x, y, z columns (31-54) complete?')
+
+                # Pad the CONECT fields with zeros (no bond) to a common width and cut them into 5 character columns
+                conect = [line[6:].rstrip() for line in lines if line.startswith('CONECT')]
+                if conect:
+                    width = max(5, -(-max(len(body) for body in conect) // 5) * 5)
+                    serials = array([body.ljust(width, '0') for body in conect], dtype=f'S{width}')
+                    serials = serials.view('S5').reshape(len(conect), -1).astype(int64)
+
+                    pairs = stack([repeat(serials[:, :1], serials.shape[1] - 1, axis=1), serials[:, 1:]], axis=-1)
+                    bonds.append(pairs[serials[:, 1:] != 0])
+
+        self.names = array(names, dtype=str)
+        self.residues = array(residues, dtype=str)
+        self.residue_ids = array(residue_ids, dtype=str)
+        self.elements = array(elements, dtype=str)
+        self.coords = concatenate(coords).reshape(-1, 3) if coords else empty((0, 3), dtype=float64)
+        self.bonds = concatenate(bonds) if bonds else empty((0, 2), dtype=int64)
+
+
+class MoleculeRecord:
+    """
+    One molecule read from a multi-molecule file, with the same arrays as PDBFile so a Molecule can be built
+    from either (see Molecule.read_record).
+
+    attributes
+    ---------------
+    name                        The molecule name, made safe and unique within the file by the reader
+    names                       numpy str array of the atom names; the element and a count of that element (C1, C2, H1)
+                                when the file gives none
+    elements                    numpy str array of the element of each atom
+    coords                      (N, 3) float64 numpy array of the coordinates (angstroms)
+    bonds                       (B, 2) int numpy array of the bonded atoms, counted from 1
+    charge                      The net formal charge of the molecule, or None if the file does not give it
+    """
+
+    def __init__(self, name, elements, coords, bonds, names=None, charge=None):
+
+        self.name = name
+        self.elements = array(elements, dtype=str)
+        self.coords = array(coords, dtype=float64).reshape(-1, 3)
+        self.bonds = array(bonds, dtype=int64).reshape(-1, 2)
+        self.names = array(names if names is not None else self.element_names(self.elements), dtype=str)
+        self.charge = charge
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(name={self.name!r}, atoms={len(self)})'
+
+    def __len__(self):
+        return len(self.elements)
+
+    @staticmethod
+    def element_names(elements):
+        """Atom names from the elements, numbering each element separately: C1, C2, O1, H1 ..."""
+
+        counts = {}
+        names = []
+        for element in elements:
+            counts[element] = counts.get(element, 0) + 1
+            names.append(f'{element}{counts[element]}')
+
+        return names
+
+
+class MoleculeStream:
+    """
+    Base of the streaming readers for multi-molecule files.
+
+    Iterating reads the file from the start, yielding one MoleculeRecord at a time, so only the current molecule is
+    ever held in memory however large the library is. Each molecule is named from the file with anything but
+    letters, digits, '-' and '_' replaced by '_', or by the file name and position (library_12) if it has no name;
+    repeated names are numbered (name_2, name_3 ...) so every molecule can have its own working directory.
+
+    Subclasses read the molecules in records().
+    """
+
+    def __init__(self, filename):
+
+        self.filename = filename
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(filename={self.filename!r})'
+
+    def __iter__(self):
+
+        stem = path.splitext(path.basename(self.filename))[0]
+        seen = {}
+
+        for position, record in enumerate(self.records(), 1):
+            name = sub(r'[^\w\-]', '_', record.name.strip()) or f'{stem}_{position}'
+
+            seen[name] = seen.get(name, 0) + 1
+            record.name = name if seen[name] == 1 else f'{name}_{seen[name]}'
+
+            yield record
+
+    def records(self):
+        raise NotImplementedError
+
+
+class SDFFile(MoleculeStream):
+    """
+    Streaming reader for SD files (V2000 molfiles separated by $$$$ lines), such as exported compound libraries.
+    The net charge is the sum of the M  CHG formal charges, or of the atom block charges in older files.
+    """
+
+    # Atom block charge codes of the old molfile format
+    charge_codes = {1: 3, 2: 2, 3: 1, 5: -1, 6: -2, 7: -3}
+
+    def records(self):
+
+        with open(self.filename, 'r') as sdf:
+            block = []
+            for line in sdf:
+                if line.startswith('$$$$'):
+                    yield self.read_block(block)
+                    block = []
+                else:
+                    block.append(line.rstrip('\n'))
+
+            # The last molecule need not be followed by $$$$
+            if any(line.strip() for line in block):
+                yield self.read_block(block)
+
+    def read_block(self, block):
+        """Read one molfile (the lines between $$$$ separators) into a MoleculeRecord."""
+
+        counts = block[3]
+        if 'V3000' in counts:
+            raise ValueError(f'{block[0].strip() or "A molecule"} in {self.filename} is a V3000 molfile; '
+                             f'only V2000 molfiles can be read.')
+
+        n_atoms, n_bonds = int(counts[0:3]), int(counts[3:6])
+        atoms = block[4:4 + n_atoms]
+
+        # All of the fields are fixed width and may run together, e.g. in large molecules or with long coordinates
+        coords = [(line[0:10], line[10:20], line[20:30]) for line in atoms]
+        bonds = [(int(line[0:3]), int(line[3:6])) for line in block[4 + n_atoms:4 + n_atoms + n_bonds]]
+        charges = [self.charge_codes.get(int(line[36:39] or 0), 0) for line in atoms]
+
+        # Any M  CHG line replaces all of the atom block charges
+        properties = [line for line in block[4 + n_atoms + n_bonds:] if line.startswith('M  CHG')]
+        if properties:
+            charges = [0] * n_atoms
+            for line in properties:
+                fields = line.split()[3:]
+                for atom, charge in zip(fields[0::2], fields[1::2]):
+                    charges[int(atom) - 1] = int(charge)
+
+        return MoleculeRecord(block[0], [line[31:34].strip() for line in atoms], coords, bonds, charge=sum(charges))
+
+
+class Mol2File(MoleculeStream):
+    """
+    Streaming reader for (multi-)mol2 files, one molecule per @<TRIPOS>MOLECULE section.
+    The elements come from the SYBYL atom types (C.ar -> C); the net charge is the sum of the partial charges,
+    rounded, unless the file says it has no charges.
+    """
+
+    def records(self):
+
+        with open(self.filename, 'r') as mol2:
+            block = []
+            for line in mol2:
+                if line.startswith('@<TRIPOS>MOLECULE') and block:
+                    yield self.read_block(block)
+                    block = []
+                block.append(line.rstrip('\n'))
+
+            if block:
+                yield self.read_block(block)
+
+    @staticmethod
+    def sections(block):
+        """The lines of each @<TRIPOS> section of one molecule, without blank and comment lines."""
+
+        sections, lines = {}, None
+        for line in block:
+            if line.startswith('@<TRIPOS>'):
+                lines = sections.setdefault(line[9:].strip(), [])
+            elif lines is not None and line.strip() and not line.startswith('#'):
+                lines.append(line)
+
+        return sections
+
+    def read_block(self, block):
+        """Read one @<TRIPOS>MOLECULE section and the sections after it into a MoleculeRecord."""
+
+        sections = self.sections(block)
+        header = sections['MOLECULE']
+        atoms = [line.split() for line in sections.get('ATOM', [])]
+        bonds = [line.split() for line in sections.get('BOND', [])]
+
+        # Atom ids need not run from 1; bonds are stored by position
+        positions = {atom[0]: pos for pos, atom in enumerate(atoms, 1)}
+
+        charge = None
+        if len(header) < 4 or header[3].strip() != 'NO_CHARGES':
+            charges = [float(atom[8]) for atom in atoms if len(atom) > 8]
+            charge = int(round(sum(charges))) if len(charges) == len(atoms) else None
+
+        return MoleculeRecord(header[0], [atom[5].split('.')[0] for atom in atoms], [atom[2:5] for atom in atoms],
+                              [(positions[bond[1]], positions[bond[2]]) for bond in bonds],
+                              names=[atom[1] for atom in atoms], charge=charge)
+
+
+class SMILESFile(MoleculeStream):
+    """
+    Streaming reader for SMILES files: one molecule per line, the SMILES string then optionally its name.
+    Blank lines and lines starting with # are skipped. Each molecule is given hydrogens and 3D coordinates by RDKit
+    as it is read (see smiles.smiles_to_record), so no pdb files are written.
+    Lines RDKit cannot read or embed are reported and skipped, so one bad molecule does not stop a library.
+    """
+
+    def records(self):
+
+        # RDKit is only needed for SMILES input
+        from QUBEKit.smiles import smiles_to_record
+
+        with open(self.filename, 'r') as smiles:
+            for number, line in enumerate(smiles, 1):
+                fields = line.split(None, 1)
+                if not fields or fields[0].startswith('#'):
+                    continue
+
+                try:
+                    record = smiles_to_record(fields[0], fields[1].strip() if len(fields) > 1 else '')
+                except ValueError as error:
+                    print(f'{error} Skipping line {number} of {self.filename}.')
+                    continue
+
+                yield record
+
+
+# The streaming reader used for each file extension
+molecule_readers = {'.sdf': SDFFile, '.sd': SDFFile, '.mol': SDFFile, '.mol2': Mol2File,
+                    '.smi': SMILESFile, '.smiles': SMILESFile}
+
+
+def read_molecules(filename):
+    """Streaming reader of the molecules in an SDF, mol2 or SMILES file, chosen from its extension."""
+
+    extension = path.splitext(filename)[1].lower()
+    if extension not in molecule_readers:
+        raise ValueError(f'Cannot read molecules from {filename}; '
+                         f'the file must be one of {", ".join(sorted(molecule_readers))}.')
+
+    return molecule_readers[extension](filename)
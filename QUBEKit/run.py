@@ -3,8 +3,8 @@
 from QUBEKit.smiles import smiles_to_pdb, smiles_mm_optimise, rdkit_descriptors
 from QUBEKit.mod_seminario import ModSeminario
 from QUBEKit.lennard_jones import LennardJones
-from QUBEKit.engines import PSI4, Chargemol, Gaussian, ONETEP
-from QUBEKit.ligand import Ligand
+from QUBEKit.engines import PSI4, Chargemol, Gaussian, ONETEP, FakeQM
+from QUBEKit.ligand import Ligand, read_ligands
 from QUBEKit.dihedrals import TorsionScan, TorsionOptimiser
 from QUBEKit.parametrisation import OpenFF, AnteChamber, XML
 from QUBEKit.decorators import exception_logger
@@ -54,7 +54,7 @@ class Main:
                                   ('torsion_optimise', self.torsion_optimise),
                                   ('finalise', self.finalise)])
 
-        self.engine_dict = {'psi4': PSI4, 'g09': Gaussian, 'onetep': ONETEP}
+        self.engine_dict = {'psi4': PSI4, 'g09': Gaussian, 'onetep': ONETEP, 'fake': FakeQM}
 
         # Argparse will only return if we are doing a QUBEKit run bulk or normal
         self.args = self.parse_commands()
@@ -242,12 +242,13 @@ We welcome any suggestions for additions or changes.""")
                             help='Enter the ddec version for charge partitioning, does not effect ONETEP partitioning.')
         parser.add_argument('-geo', '--geometric', choices=[True, False], type=bool,
                             help='Turn on geometric to use this during the qm optimisations, recommended.')
-        parser.add_argument('-bonds', '--bonds_engine', choices=['psi4', 'g09'],
-                            help='Choose the QM code to calculate the bonded terms.')
+        parser.add_argument('-bonds', '--bonds_engine', choices=['psi4', 'g09', 'fake'],
+                            help='Choose the QM code to calculate the bonded terms; fake is only for benchmarking.')
         parser.add_argument('-charges', '--charges_engine', choices=['onetep', 'chargemol'],
                             help='Choose the method to do the charge partioning.')
-        parser.add_argument('-density', '--density_engine', choices=['onetep', 'g09', 'psi4'],
-                            help='Enter the name of the QM code to calculate the electron density of the molecule.')
+        parser.add_argument('-density', '--density_engine', choices=['onetep', 'g09', 'psi4', 'fake'],
+                            help='Enter the name of the QM code to calculate the electron density of the molecule; '
+                                 'fake is only for benchmarking.')
         parser.add_argument('-solvent', '--solvent',
                             help='Enter the dielectric constant or the name of the solvent you wish to use.')
         # maybe separate into known solvents and IPCM constants?
@@ -289,11 +290,13 @@ We welcome any suggestions for additions or changes.""")
         groups.add_argument('-sm', '--smiles', help='Enter the smiles string of a molecule as a starting point.')
         groups.add_argument('-bulk', '--bulk_run',
                             help='Enter the name of the csv file to run as bulk, bulk will use smiles unless it finds '
-                                 'a molecule file with the same name.')
+                                 'a molecule file with the same name. An sdf, mol2 or smiles library can be given '
+                                 'instead; its molecules are read one at a time and run with the command line options.')
         groups.add_argument('-csv', '--csv_filename',
                             help='Enter the name of the csv file you would like to create for bulk runs.',
                             action=CSVAction)
-        groups.add_argument('-i', '--input', help='Enter the molecule input pdb file (only pdb so far!)')
+        groups.add_argument('-i', '--input', help='Enter the molecule input pdb file, or an sdf, mol2 or smiles file '
+                                                  'holding the molecule.')
 
         return parser.parse_args()
 
@@ -305,6 +308,10 @@ We welcome any suggestions for additions or changes.""")
         csv_file = self.args.bulk_run
         printf(self.start_up_msg)
 
+        # Molecule libraries are streamed rather than listed in a csv
+        if not csv_file.endswith('.csv'):
+            self.bulk_stream(csv_file)
+
         bulk_data = mol_data_from_csv(csv_file)
 
         # Run full analysis for each smiles string or pdb in the .csv file.
@@ -313,6 +320,9 @@ We welcome any suggestions for additions or changes.""")
         # This allows self.order to be built up after each run.
         temp = self.order
 
+        # Name of the first row of each molecule and run settings run from the start, under its canonical key
+        seen = {}
+
         for name in names:
             printf(f'\nAnalysing: {name}\n')
 
@@ -341,6 +351,18 @@ We welcome any suggestions for additions or changes.""")
                 else:
                     self.file = name
 
+                # Rows of a molecule already run (in any atom order) with exactly the same settings are skipped;
+                # the same molecule with another config file, end stage or torsion order is still run
+                molecule = Ligand(self.file, combination=self.args.combination)
+                settings = tuple(sorted((column, value) for column, value in bulk_data[name].items()
+                                        if column != 'smiles string'))
+                key = (molecule.canonical_key(self.defaults_dict['charge'], self.defaults_dict['multiplicity']),
+                       settings)
+                if key in seen:
+                    printf(f'{name} is the same molecule with the same settings as {seen[key]}; skipping.\n')
+                    continue
+                seen[key] = name
+
                 self.create_log()
 
             # If starting from the middle somewhere, FIND (not create) the folder, and log and pdb files, then execute
@@ -355,9 +377,55 @@ We welcome any suggestions for additions or changes.""")
                 self.file = [file for file in files if file.endswith('.pdb') and not file.endswith('optimised.pdb')][0]
 
                 self.continue_log()
+                molecule = None
 
             # if we have a torsion order add it here
-            self.execute(torsion_options)
+            self.execute(torsion_options, molecule)
+            chdir('../')
+
+        sys_exit('\nFinished bulk run. Use the command -progress to view which stages have completed.')
+
+    def bulk_stream(self, library):
+        """
+        Run a bulk QUBEKit job in serial mode over every molecule of an sdf, mol2 or smiles library.
+        Each Ligand is built from the file as it is reached, with the bonds from the file, and its pdb file is only
+        written into its own working directory; so large libraries need no pdb file per molecule up front.
+        Every molecule is run from the start to the -end stage with the command line options,
+        using the charge from the library where it gives one.
+        """
+
+        end_point = self.args.end if self.args.end is not None else 'finalise'
+        stages = [key for key in self.order]
+        extra = 1 if end_point != 'finalise' else 0
+        stages = stages[:stages.index(end_point) + extra] + ['finalise']
+        self.order = OrderedDict(pair for pair in self.order.items() if pair[0] in set(stages))
+
+        # Name of the first entry of each molecule, under its canonical key
+        seen = {}
+
+        for molecule in read_ligands(library, combination=self.args.combination):
+            printf(f'\nAnalysing: {molecule.name}\n')
+
+            # Configs
+            self.defaults_dict = {'charge': molecule.charge if molecule.charge is not None else self.args.charge,
+                                  'multiplicity': self.args.multiplicity,
+                                  'config': self.args.config_file}
+
+            # Every other run setting comes from the command line and is shared by the whole library,
+            # so a repeated molecule and charge is a repeated run
+            key = molecule.canonical_key(self.defaults_dict['charge'], self.defaults_dict['multiplicity'])
+            if key in seen:
+                printf(f'{molecule.name} is the same molecule with the same settings as {seen[key]}; skipping.\n')
+                continue
+            seen[key] = molecule.name
+
+            self.qm, self.fitting, self.descriptions = Configure.load_config(self.defaults_dict['config'])
+            self.all_configs = [self.defaults_dict, self.qm, self.fitting, self.descriptions]
+
+            self.file = molecule.filename
+            self.create_log(molecule)
+
+            self.execute(molecule=molecule)
             chdir('../')
 
         sys_exit('\nFinished bulk run. Use the command -progress to view which stages have completed.')
@@ -383,9 +451,10 @@ We welcome any suggestions for additions or changes.""")
                 log_file.write('\n')
             log_file.write('\n')
 
-    def create_log(self):
+    def create_log(self, molecule=None):
         """
         Creates the working directory for the job as well as the log file.
+        The input pdb is copied into the directory, or written there from molecule if one is given.
         This log file is then extended when:
             - decorators.timer_logger wraps a called method;
             - helpers.append_to_log() is called;
@@ -397,19 +466,23 @@ We welcome any suggestions for additions or changes.""")
 
         # Define name of working directory.
         # This is formatted as 'QUBEKit_molecule name_yyyy_mm_dd_log_string'.
-        dir_string = f'QUBEKit_{self.file[:-4]}_{date}_{self.descriptions["log"]}'
+        dir_string = f'QUBEKit_{path.splitext(self.file)[0]}_{date}_{self.descriptions["log"]}'
         mkdir(dir_string)
 
         # Copy active pdb into new directory.
-        abspath = path.abspath(self.file)
-        copy(abspath, f'{dir_string}/{self.file}')
-        chdir(dir_string)
+        if molecule is None:
+            abspath = path.abspath(self.file)
+            copy(abspath, f'{dir_string}/{self.file}')
+            chdir(dir_string)
+        else:
+            chdir(dir_string)
+            molecule.write_pdb()
 
         with open(self.log_file, 'w+') as log_file:
 
             log_file.write(f'Beginning log file: {datetime.now()}\n\n')
             log_file.write(str(f'The commands given were: {key}: {val}\n\n' for key, val in vars(self.args).items() if val is not None))
-            log_file.write(f'Analysing: {self.file[:-4]}\n\n')
+            log_file.write(f'Analysing: {path.splitext(self.file)[0]}\n\n')
 
             # Writes the config dictionaries to the log file.
             log_file.write('The defaults being used are:\n')
@@ -526,7 +599,11 @@ We welcome any suggestions for additions or changes.""")
 
         else:
             qm_engine.generate_input(input_type='mm', optimise=True)
-            molecule.molecule['qm'] = qm_engine.optimised_structure()
+            # PSI4 also returns the energy of the optimised structure
+            if self.qm['bonds_engine'] == 'g09':
+                molecule.molecule['qm'] = qm_engine.optimised_structure()
+            else:
+                molecule.molecule['qm'], molecule.qm_energy = qm_engine.optimised_structure()
 
         append_to_log(f'Optimised structure calculated{" with geometric" if self.qm["geometric"] else ""}')
 
@@ -569,6 +646,8 @@ We welcome any suggestions for additions or changes.""")
 
         if self.qm['density_engine'] == 'g09':
             append_to_log('Gaussian analysis complete')
+        elif self.qm['density_engine'] == 'fake':
+            append_to_log('Fake density analysis complete')
         else:
             # If we use onetep we have to stop after this step
             append_to_log('ONETEP file made')
@@ -584,7 +663,13 @@ We welcome any suggestions for additions or changes.""")
 
         # TODO add option to use chargemol on onetep cube files.
         copy(f'../density/{molecule.name}.wfx', f'{molecule.name}.wfx')
-        c_mol = Chargemol(molecule, self.all_configs)
+
+        # Engines with a stand-in DDEC step (the fake engine) replace only the Chargemol binary,
+        # so the job file and the DDEC cache are used just as in a real run
+        engine = self.engine_dict[self.qm['density_engine']]
+        partition = engine(molecule, self.all_configs).ddec if engine.partitions_charges else None
+
+        c_mol = Chargemol(molecule, self.all_configs, partition=partition)
         c_mol.generate_input()
 
         append_to_log(f'Chargemol analysis with DDEC{self.qm["ddec_version"]} complete')
@@ -684,12 +769,13 @@ We welcome any suggestions for additions or changes.""")
 
         return molecule
 
-    @exception_logger_decorator
-    def execute(self, torsion_options=None):
+    @exception_logger
+    def execute(self, torsion_options=None, molecule=None):
         """
         Calls all the relevant classes and methods for the full QM calculation in the correct order.
         Exceptions are added to log (if raised).
         Will also add the extra options dictionary to the molecule.
+        A molecule already read (e.g. from a library in a bulk run) is used rather than reading self.file.
         """
 
         # split the torsion list
@@ -699,7 +785,8 @@ We welcome any suggestions for additions or changes.""")
         # Check if starting from the beginning; if so:
         if 'parametrise' in [key for key in self.order]:
             # Initialise ligand object fully before pickling it
-            molecule = Ligand(self.file, combination=self.args.combination)
+            if molecule is None:
+                molecule = Ligand(self.file, combination=self.args.combination)
 
             # If there are extra options add them to the molecule
             if torsion_options is not None:
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+from QUBEKit.readers import MoleculeRecord
+
 from rdkit.Chem import AllChem, MolFromPDBFile, Descriptors
 from rdkit.Chem.rdForceFieldHelpers import MMFFOptimizeMolecule, UFFOptimizeMolecule
 
@@ -18,7 +20,8 @@ def smiles_to_pdb(smiles_string, name=None):
         name = input('Please enter a name for the molecule:\n>')
     m.SetProp('_Name', name)
     m_h = AllChem.AddHs(m)
-    AllChem.EmbedMolecule(m_h, AllChem.ETKDG())
+    if AllChem.EmbedMolecule(m_h, AllChem.ETKDG()) == -1:
+        raise ValueError(f'RDKit could not make 3D coordinates for the smiles string {smiles_string}.')
     AllChem.SanitizeMol(m_h)
 
     print(AllChem.MolToMolBlock(m_h), file=open(f'{name}.mol', 'w+'))
@@ -61,3 +64,24 @@ def rdkit_descriptors(pdb_file):
                    'LogP': Descriptors.MolLogP(mol)}
 
     return descriptors
+
+
+def smiles_to_record(smiles_string, name=''):
+    """
+    Give a smiles string hydrogens and 3D coordinates in memory, without writing any files;
+    returns a readers.MoleculeRecord with the bonds and formal charge of the molecule.
+    """
+
+    m = AllChem.MolFromSmiles(smiles_string)
+    if m is None:
+        raise ValueError(f'Cannot read the smiles string {smiles_string}.')
+
+    m_h = AllChem.AddHs(m)
+    # Embedding gives -1 rather than raising when no conformer can be made
+    if AllChem.EmbedMolecule(m_h, AllChem.ETKDG()) == -1:
+        raise ValueError(f'RDKit could not make 3D coordinates for the smiles string {smiles_string}.')
+
+    bonds = [(bond.GetBeginAtomIdx() + 1, bond.GetEndAtomIdx() + 1) for bond in m_h.GetBonds()]
+
+    return MoleculeRecord(name, [atom.GetSymbol() for atom in m_h.GetAtoms()], m_h.GetConformer().GetPositions(),
+                          bonds, charge=AllChem.GetFormalCharge(m_h))
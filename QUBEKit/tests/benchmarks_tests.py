@@ -0,0 +1,104 @@
+from QUBEKit.benchmarks import Recorder, combine, compare
+
+from collections import OrderedDict
+from copy import deepcopy
+
+import unittest
+
+
+class Counter:
+    """Something with a method for Recorder.patch to wrap."""
+
+    def add(self, value):
+        return value + 1
+
+
+class TestRecorder(unittest.TestCase):
+
+    def test_measure(self):
+
+        recorder = Recorder()
+
+        def outer():
+            # Nested blocks are recorded separately; the inner one holds the larger allocation
+            recorder.measure('inner', lambda: bytearray(4 * 2 ** 20))
+            return 'done'
+
+        self.assertEqual('done', recorder.measure('outer', outer))
+        recorder.measure('outer', outer)
+
+        self.assertEqual(['inner', 'outer'], list(recorder.results))
+        self.assertEqual(2, recorder.results['outer']['calls'])
+        self.assertEqual(2, recorder.results['inner']['calls'])
+        self.assertGreaterEqual(recorder.results['inner']['peak_mb'], 3.9)
+        self.assertGreaterEqual(recorder.results['outer']['wall'], recorder.results['inner']['wall'])
+
+        # Without memory tracing no peak is recorded
+        recorder = Recorder(memory=False)
+        recorder.measure('block', sum, [1, 2])
+        self.assertIsNone(recorder.results['block']['peak_mb'])
+
+    def test_patch_and_restore(self):
+
+        recorder = Recorder(memory=False)
+        originals = recorder.patch([(Counter, 'add')])
+
+        self.assertEqual(3, Counter().add(2))
+        self.assertEqual(1, recorder.results['Counter.add']['calls'])
+
+        recorder.restore(originals)
+        Counter().add(2)
+        self.assertEqual(1, recorder.results['Counter.add']['calls'])
+
+
+class TestCompare(unittest.TestCase):
+
+    def setUp(self):
+
+        def entry(wall, peak):
+            return {'calls': 1, 'wall': wall, 'cpu': wall, 'peak_mb': peak}
+
+        self.baseline = OrderedDict([
+            ('molecules', OrderedDict([('alkanol_02', OrderedDict([
+                ('atoms', 9),
+                ('total', entry(2.0, 10.0)),
+                ('stages', OrderedDict([('hessian', entry(1.0, 5.0))])),
+                ('functions', OrderedDict([('PSI4.hessian', entry(0.001, None))]))]))])),
+            ('micro', OrderedDict([('alkanol_02', OrderedDict([('read_pdb', entry(0.5, 1.0))]))])),
+            ('large', OrderedDict([('protein_read_pdb', entry(3.0, 50.0))]))])
+
+    def test_no_regressions(self):
+
+        self.assertEqual([], compare(deepcopy(self.baseline), self.baseline))
+
+    def test_regressions(self):
+
+        results = deepcopy(self.baseline)
+        molecule = results['molecules']['alkanol_02']
+        # Slower beyond the tolerance, more memory, and a tiny function slower only within the timer noise floor
+        molecule['stages']['hessian']['wall'] = 1.5
+        molecule['total']['peak_mb'] = 20.0
+        molecule['functions']['PSI4.hessian']['wall'] = 0.005
+        results['large']['protein_read_pdb']['cpu'] = 6.0
+        # Faster is never a regression
+        results['micro']['alkanol_02']['read_pdb']['wall'] = 0.1
+
+        self.assertEqual([('alkanol_02', 'total', 'total', 'peak_mb', 10.0, 20.0),
+                          ('alkanol_02', 'stages', 'hessian', 'wall', 1.0, 1.5),
+                          ('large', 'micro', 'protein_read_pdb', 'cpu', 3.0, 6.0)],
+                         compare(results, self.baseline))
+
+        # Within a looser tolerance only the doubled values regress
+        self.assertEqual(2, len(compare(results, self.baseline, tolerance=0.6)))
+
+    def test_combine(self):
+
+        runs = [{'block': {'calls': 1, 'wall': 2.0, 'cpu': 1.0, 'peak_mb': 3.0}},
+                {'block': {'calls': 1, 'wall': 1.0, 'cpu': 2.0, 'peak_mb': 4.0}}]
+
+        self.assertEqual({'calls': 1, 'wall': 1.0, 'cpu': 1.0, 'peak_mb': 4.0}, combine(runs)['block'])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
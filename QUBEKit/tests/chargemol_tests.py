@@ -0,0 +1,84 @@
+from QUBEKit.engines import Chargemol, FakeQM
+from QUBEKit.helpers import Configure
+from QUBEKit.ligand import Ligand
+
+from os import chdir, getcwd, listdir, path, remove
+from tempfile import TemporaryDirectory
+
+import unittest
+
+
+class TestChargemol(unittest.TestCase):
+
+    def setUp(self):
+
+        self.home = getcwd()
+        self.temp = TemporaryDirectory()
+        chdir(self.temp.name)
+
+        # Keep the DDEC cache of these tests out of the user's cache
+        self.cache_folder, Configure.cache_folder = Configure.cache_folder, path.join(self.temp.name, 'cache/')
+
+        with open('methanol.pdb', 'w+') as pdb:
+            pdb.write('HETATM    1  C1  UNL     1      -0.047   0.665   0.000  1.00  0.00           C\n'
+                      'HETATM    2  O1  UNL     1       0.047  -0.758   0.000  1.00  0.00           O\n'
+                      'HETATM    3  H1  UNL     1      -1.103   0.978   0.000  1.00  0.00           H\n'
+                      'HETATM    4  H2  UNL     1       0.438   1.084   0.889  1.00  0.00           H\n'
+                      'HETATM    5  H3  UNL     1       0.438   1.084  -0.889  1.00  0.00           H\n'
+                      'HETATM    6  H4  UNL     1       0.979  -1.036   0.000  1.00  0.00           H\n'
+                      'CONECT    1    2    3    4    5\nCONECT    2    1    6\nEND\n')
+        with open('methanol.wfx', 'w+') as wfx:
+            wfx.write('<Title>\n methanol\n</Title>\n')
+
+        self.molecule = Ligand('methanol.pdb')
+        self.configs = [{'charge': 0, 'multiplicity': 1}, {'theory': 'B3LYP', 'ddec_version': 6, 'threads': 2}, {},
+                        {'chargemol': '/opt/chargemol'}]
+
+        # The fake engine's stand-in partitioning, recording the DDEC version of each call
+        self.calls = []
+        fake = FakeQM(self.molecule, self.configs)
+
+        def partition(ddec_version):
+            self.calls.append(ddec_version)
+            fake.ddec(ddec_version)
+
+        self.partition = partition
+
+    def tearDown(self):
+
+        Configure.cache_folder = self.cache_folder
+        chdir(self.home)
+        self.temp.cleanup()
+
+    def test_partition_and_cache(self):
+
+        files = Chargemol.ddec_files[6]
+
+        Chargemol(self.molecule, self.configs, partition=self.partition).generate_input()
+
+        with open('job_control.txt') as job:
+            job = job.read()
+        self.assertIn('methanol.wfx', job)
+        self.assertIn('DDEC6', job)
+        self.assertEqual([6], self.calls)
+        self.assertTrue(all(path.exists(file) for file in files))
+        self.assertEqual(1, len(listdir(path.join(Configure.cache_folder, 'ddec'))))
+
+        # The same wfx and DDEC version are copied from the cache without partitioning again
+        for file in files:
+            remove(file)
+        Chargemol(self.molecule, self.configs, partition=self.partition).generate_input()
+        self.assertEqual([6], self.calls)
+        self.assertTrue(all(path.exists(file) for file in files))
+
+        # A different density is partitioned again
+        with open('methanol.wfx', 'a') as wfx:
+            wfx.write('<Keywords>\n GTO\n</Keywords>\n')
+        Chargemol(self.molecule, self.configs, partition=self.partition).generate_input()
+        self.assertEqual([6, 6], self.calls)
+        self.assertEqual(2, len(listdir(path.join(Configure.cache_folder, 'ddec'))))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,95 @@
+from QUBEKit.connectivity import close_pairs, perceive_bonds, residue_charge, template_bonds
+from QUBEKit.ligand import Ligand
+
+from numpy import array, random
+from os import chdir, getcwd
+from tempfile import TemporaryDirectory
+
+import unittest
+
+
+class TestBondPerception(unittest.TestCase):
+
+    def setUp(self):
+
+        self.elements = ['C', 'O', 'H', 'H', 'H', 'H']
+        self.coords = array([[-0.047, 0.665, 0.000], [0.047, -0.758, 0.000], [-1.103, 0.978, 0.000],
+                             [0.438, 1.084, 0.889], [0.438, 1.084, -0.889], [0.979, -1.036, 0.000]])
+
+    def test_close_pairs(self):
+
+        # The cell list finds the same pairs as comparing every pair of atoms
+        coords = random.RandomState(4).uniform(0, 12, (400, 3))
+        distances = ((coords[:, None] - coords[None]) ** 2).sum(axis=2) ** 0.5
+        expected = [[a, b] for a in range(400) for b in range(a + 1, 400) if distances[a, b] <= 1.7]
+
+        self.assertEqual(expected, close_pairs(coords, 1.7).tolist())
+        self.assertEqual((0, 2), close_pairs(coords[:1], 1.7).shape)
+
+    def test_methanol(self):
+
+        self.assertEqual([[0, 1], [0, 2], [0, 3], [0, 4], [1, 5]], perceive_bonds(self.elements, self.coords).tolist())
+
+        # A hydrogen pushed between the carbon and oxygen keeps only its closer bond
+        coords = self.coords.copy()
+        coords[5] = [0.25, 0.15, 0.0]
+        self.assertNotIn([1, 5], perceive_bonds(self.elements, coords).tolist())
+        self.assertIn([0, 5], perceive_bonds(self.elements, coords).tolist())
+
+        with self.assertRaises(ValueError):
+            perceive_bonds(['C', 'Xx'], self.coords[:2])
+
+    def test_pdb_without_conect(self):
+
+        home = getcwd()
+        with TemporaryDirectory() as temp:
+            chdir(temp)
+            with open('methanol.pdb', 'w+') as pdb:
+                for atom, (element, (x, y, z)) in enumerate(zip(self.elements, self.coords), 1):
+                    pdb.write(f'HETATM{atom:>5}  {element}{atom:<2} UNL     1    {x:8.3f}{y:8.3f}{z:8.3f}'
+                              f'  1.00  0.00          {element:>2}\n')
+                pdb.write('END\n')
+
+            molecule = Ligand('methanol.pdb')
+            chdir(home)
+
+        self.assertEqual([(1, 2), (1, 3), (1, 4), (1, 5), (2, 6)], sorted(molecule.topology.edges))
+
+    def test_residue_templates(self):
+
+        # Alanine then glycine; the glycine oxygen is placed close to the alanine side chain
+        names = ['N', 'H', 'CA', 'CB', 'C', 'O', 'N', 'CA', 'C', 'O', 'OXT']
+        residues = ['ALA'] * 6 + ['GLY'] * 5
+        residue_ids = ['A   1 '] * 6 + ['A   2 '] * 5
+        elements = [name[0] for name in names]
+        coords = array([[0.0, 0.0, 0.0], [-0.5, 0.85, 0.0], [1.45, 0.0, 0.0], [2.0, 1.4, 0.0], [2.0, -1.4, 0.0],
+                        [1.4, -2.4, 0.0], [3.3, -1.5, 0.0], [4.0, -2.8, 0.0], [5.5, -2.6, 0.0], [6.0, -1.5, 0.0],
+                        [6.3, -3.6, 0.0]])
+        coords[9] = [2.9, 2.6, 0.0]
+
+        bonds = template_bonds(names, residues, residue_ids, elements, coords).tolist()
+        self.assertEqual([[0, 1], [0, 2], [2, 3], [2, 4], [4, 5], [4, 6], [6, 7], [7, 8], [8, 9], [8, 10]], bonds)
+
+    def test_residue_charge(self):
+
+        # Heavy atoms only: charged side chains by name and the C terminal carboxylate
+        residues = [('LYS', ['N', 'CA', 'NZ']), ('ASP', ['N', 'CA', 'OD1']), ('GLU', ['N', 'CA']),
+                    ('ALA', ['N', 'CA', 'C', 'O', 'OXT'])]
+        names = [name for _, atoms in residues for name in atoms]
+        residue_names = [residue for residue, atoms in residues for _ in atoms]
+        residue_ids = [f'A{number:>4} ' for number, (_, atoms) in enumerate(residues, 1) for _ in atoms]
+        self.assertEqual(-2, residue_charge(names, residue_names, residue_ids))
+
+        # With hydrogens: a charged N terminus, neutral Lys and Asp, doubly protonated His and a capped C terminus
+        residues = [('ALA', ['N', 'H1', 'H2', 'H3', 'CA']), ('LYS', ['N', 'H', 'NZ', 'HZ1', 'HZ2']),
+                    ('ASP', ['N', 'H', 'OD2', 'HD2']), ('HIS', ['N', 'H', 'HD1', 'HE2']),
+                    ('GLY', ['N', 'H', 'C', 'O', 'OXT', 'HXT'])]
+        names = [name for _, atoms in residues for name in atoms]
+        residue_names = [residue for residue, atoms in residues for _ in atoms]
+        residue_ids = [f'A{number:>4} ' for number, (_, atoms) in enumerate(residues, 1) for _ in atoms]
+        self.assertEqual(2, residue_charge(names, residue_names, residue_ids))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
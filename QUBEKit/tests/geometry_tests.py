@@ -0,0 +1,345 @@
+from QUBEKit.geometry import Geometry, Geometries, Conformers, bond_lengths, angle_values, dihedral_values
+from QUBEKit.ligand import Ligand
+
+from copy import deepcopy
+from numpy import allclose, array, stack, cos, sin, radians, isnan, shares_memory, zeros
+from os import chdir, getcwd
+from pickle import dumps, loads
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import unittest
+
+
+class TestGeometry(unittest.TestCase):
+
+    def setUp(self):
+
+        self.atoms = [['C', 0.0, 0.0, 0.0], ['O', 1.2, 0.0, 0.0], ['H', -0.5, 0.9, 0.0]]
+        self.geometry = Geometry.from_list(self.atoms)
+
+    def test_arrays(self):
+
+        self.assertEqual((3, 3), self.geometry.coords.shape)
+        self.assertEqual(['C', 'O', 'H'], list(self.geometry.elements))
+        self.assertEqual([6, 8, 1], list(self.geometry.atomic_numbers))
+
+    def test_list_compatibility(self):
+
+        # Atoms index, slice, iterate and compare like the old lists
+        self.assertEqual(self.atoms, self.geometry)
+        self.assertEqual(self.atoms[1], self.geometry[1])
+        self.assertEqual([1.2, 0.0, 0.0], self.geometry[1][1:])
+        self.assertEqual('H', self.geometry[-1][0])
+        self.assertEqual(self.atoms[1:], [atom.to_list() for atom in self.geometry[1:]])
+        self.assertEqual(1, self.geometry.index(['O', 1.2, 0.0, 0.0]))
+        self.assertEqual(4, len(self.geometry[0]))
+
+    def test_write_through(self):
+
+        # Writing to an atom view changes the arrays
+        self.geometry[1][1] = 1.4
+        self.assertAlmostEqual(1.4, self.geometry.coords[1, 0])
+
+        self.geometry[2] = ['F', 0.0, 1.0, 2.0]
+        self.assertEqual('F', self.geometry.elements[2])
+        self.assertTrue(allclose([0.0, 1.0, 2.0], self.geometry.coords[2]))
+
+    def test_versions(self):
+
+        # Moving an atom or assigning new coordinates gives a new version; the array itself cannot be written to
+        versions = [self.geometry.version]
+        self.geometry[0][3] = 0.5
+        versions.append(self.geometry.version)
+        self.geometry.coords = self.geometry.coords + 1.0
+        versions.append(self.geometry.version)
+        self.geometry.append(['H', 0.0, 0.0, 1.0])
+        versions.append(self.geometry.version)
+
+        self.assertEqual(4, len(set(versions)))
+        self.assertAlmostEqual(1.5, self.geometry.coords[0, 2])
+        with self.assertRaises(ValueError):
+            self.geometry.coords[0, 0] = 1.0
+
+        # Copies are separate geometries with their own versions
+        for copied in (self.geometry.copy(), deepcopy(self.geometry), loads(dumps(self.geometry))):
+            self.assertEqual(self.geometry, copied)
+            self.assertNotEqual(self.geometry.version, copied.version)
+            self.assertFalse(copied.coords.flags.writeable)
+
+        # Geometries pickled before the versions were added hold their slots in a tuple
+        old = Geometry.__new__(Geometry)
+        old.__setstate__((None, {'elements': self.geometry.elements, 'coords': self.geometry.coords.copy()}))
+        self.assertEqual(self.geometry, old)
+
+    def test_geometries_convert_lists(self):
+
+        geometries = Geometries(qm=[], input=self.atoms)
+        geometries['mm'] = self.atoms
+
+        self.assertIsInstance(geometries['mm'], Geometry)
+        self.assertFalse(geometries['qm'])
+
+        # Copies and pickles keep the arrays
+        copied = loads(dumps(deepcopy(geometries)))
+        self.assertIsInstance(copied, Geometries)
+        self.assertEqual(self.atoms, copied['input'])
+
+
+class TestInternalCoordinates(unittest.TestCase):
+
+    def setUp(self):
+
+        # A four atom chain with a 60 degree torsion about the 1-2 bond
+        self.coords = array([[1.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 1.5, 0.0],
+                             [cos(radians(60)), 1.5, sin(radians(60))]])
+
+    def test_single_frame(self):
+
+        self.assertTrue(allclose([1.0, 1.5, 1.0], bond_lengths(self.coords, [(0, 1), (1, 2), (2, 3)])))
+        self.assertTrue(allclose([90.0, 90.0], angle_values(self.coords, [(0, 1, 2), (1, 2, 3)])))
+        self.assertTrue(allclose([-60.0], dihedral_values(self.coords, [(0, 1, 2, 3)])))
+        self.assertEqual((0,), dihedral_values(self.coords, []).shape)
+
+    def test_stacked_frames(self):
+
+        # Rotate the last atom through a scan; every frame is measured at once
+        angles = [-150, -60, 0, 90, 180]
+        frames = stack([self.coords] * len(angles))
+        for frame, angle in zip(frames, angles):
+            frame[3] = [cos(radians(angle)), 1.5, -sin(radians(angle))]
+
+        phis = dihedral_values(frames, array([[0, 1, 2, 3], [3, 2, 1, 0]]))
+        self.assertEqual((5, 2), phis.shape)
+        self.assertTrue(allclose(angles[:-1], phis[:-1, 0]))
+        self.assertAlmostEqual(180.0, abs(phis[-1, 0]))
+        self.assertTrue(allclose(phis[:, 0], phis[:, 1]))
+        self.assertTrue(allclose(1.0, bond_lengths(frames, [(2, 3)])))
+
+
+class TestConformers(unittest.TestCase):
+
+    def setUp(self):
+
+        self.conformers = Conformers()
+        for frame in range(20):
+            self.conformers.append(zeros((3, 3)) + frame, source='qm scan', qm_energy=-frame, dihedral=15 * frame)
+
+    def test_append_and_slice(self):
+
+        self.assertEqual((20, 3, 3), self.conformers.coords.shape)
+        self.assertEqual(-4, self.conformers.qm_energy[4])
+        self.assertTrue(isnan(self.conformers.mm_energy).all())
+
+        # Slices share the arrays until they are appended to
+        part = self.conformers[5:10]
+        self.assertTrue(shares_memory(part.coords, self.conformers.coords))
+        part.mm_energy[:] = 1.5
+        self.assertEqual(1.5, self.conformers.mm_energy[5])
+
+        part.append(zeros((3, 3)), source='mm drive')
+        self.assertEqual(6, len(part))
+        self.assertEqual(10, self.conformers[10][0, 0])
+
+        self.conformers.extend(part)
+        self.assertEqual(26, len(self.conformers))
+        self.assertEqual('mm drive', self.conformers.source[-1])
+
+        with self.assertRaises(ValueError):
+            self.conformers.append(zeros((4, 3)))
+
+    def test_files(self):
+
+        with TemporaryDirectory() as temp:
+            self.conformers.save(f'{temp}/scan.npy')
+            loaded = Conformers.load(f'{temp}/scan.npy')
+
+            with open(f'{temp}/scan.xyz', 'w+') as xyz:
+                for angle in (-165, -150):
+                    xyz.write(f'2\nDihedral ({angle},) Energy -1.5\nC  0.0  0.0  0.0\nO  1.2  0.0  {angle}\n')
+            scan = Conformers.from_xyz(f'{temp}/scan.xyz')
+
+        self.assertTrue(allclose(self.conformers.coords, loaded.coords))
+        self.assertEqual(self.conformers.dihedral.tolist(), loaded.dihedral.tolist())
+        self.assertEqual('qm scan', loaded.source[0])
+
+        self.assertEqual((2, 2, 3), scan.coords.shape)
+        self.assertEqual([-165.0, -150.0], scan.dihedral.tolist())
+        self.assertEqual([-1.5, -1.5], scan.qm_energy.tolist())
+
+        copied = loads(dumps(self.conformers))
+        self.assertEqual(self.conformers.qm_energy.tolist(), copied.qm_energy.tolist())
+
+
+class TestLigandGeometry(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.home = getcwd()
+        cls.temp = TemporaryDirectory()
+        chdir(cls.temp.name)
+
+        with open('methanol.pdb', 'w+') as pdb:
+            pdb.write('HETATM    1  C1  UNL     1      -0.047   0.665   0.000  1.00  0.00           C\n'
+                      'HETATM    2  O1  UNL     1       0.047  -0.758   0.000  1.00  0.00           O\n'
+                      'HETATM    3  H1  UNL     1      -1.103   0.978   0.000  1.00  0.00           H\n'
+                      'HETATM    4  H2  UNL     1       0.438   1.084   0.889  1.00  0.00           H\n'
+                      'HETATM    5  H3  UNL     1       0.438   1.084  -0.889  1.00  0.00           H\n'
+                      'HETATM    6  H4  UNL     1       0.979  -1.036   0.000  1.00  0.00           H\n'
+                      'CONECT    1    2    3    4    5\nCONECT    2    1    6\nEND\n')
+
+        cls.molecule = Ligand('methanol.pdb')
+
+    @classmethod
+    def tearDownClass(cls):
+
+        chdir(cls.home)
+        cls.temp.cleanup()
+
+    def test_pdb_geometry(self):
+
+        self.assertIsInstance(self.molecule.molecule['input'], Geometry)
+        self.assertEqual(6, len(self.molecule.molecule['input']))
+        self.assertAlmostEqual(1.426, self.molecule.bond_lengths[(1, 2)], places=3)
+        self.assertEqual(5, len(self.molecule.bond_lengths))
+        self.assertEqual(3, len(self.molecule.dih_phis))
+        self.assertTrue(all(100 < angle < 115 for angle in self.molecule.angle_values.values()))
+
+    def test_symmetry_classes(self):
+
+        # The methyl hydrogens are alike; the carbon, oxygen and hydroxyl hydrogen are each on their own
+        classes = self.molecule.symmetry_classes
+        self.assertEqual(classes[2], classes[3])
+        self.assertEqual(classes[2], classes[4])
+        self.assertEqual(4, len(set(classes)))
+
+    def test_derived_values_follow_changes(self):
+
+        molecule = loads(dumps(self.molecule))
+        self.assertEqual([], molecule.rotatable)
+        self.assertEqual([[3, 4, 5]], molecule.symm_hs['methyl'])
+
+        # Measurements are taken again when the coordinates move, from the geometry they were asked for
+        molecule.molecule['input'][1][2] -= 0.1
+        self.assertAlmostEqual(1.526, molecule.bond_lengths[(1, 2)], places=3)
+
+        molecule.molecule['qm'] = molecule.molecule['input'].copy()
+        molecule.get_bond_lengths(input_type='qm')
+        molecule.molecule['qm'][1][2] += 0.1
+        self.assertAlmostEqual(1.426, molecule.bond_lengths[(1, 2)], places=3)
+        self.assertEqual('qm', molecule.measured_from['bond_lengths'])
+
+        # and terms are found again when the bonds change, even if a bond only moves
+        molecule.topology.remove_edge(2, 6)
+        molecule.topology.add_edge(1, 6)
+        self.assertIn((1, 6), molecule.bond_lengths)
+        self.assertNotIn((1, 2, 6), molecule.angles)
+        self.assertEqual(0, len(molecule.dih_phis))
+
+        molecule.topology.remove_edge(1, 6)
+        self.assertEqual(4, len(molecule.bond_lengths))
+        self.assertEqual(0, len(molecule.dih_phis))
+        self.assertNotIn((1, 2, 6), molecule.angles)
+
+    def test_derived_values_scale(self):
+
+        def chain(carbons):
+            """A zigzag carbon chain; every bond of it is the centre of a dihedral."""
+
+            with open(f'chain_{carbons}.pdb', 'w+') as pdb:
+                for atom in range(1, carbons + 1):
+                    pdb.write(f'HETATM{atom:>5}  C1  UNL     1    {1.25 * atom:8.3f}{0.8 * (atom % 2):8.3f}   0.000'
+                              f'  1.00  0.00           C\n')
+                pdb.write(''.join(f'CONECT{atom:>5}{atom + 1:>5}\n' for atom in range(1, carbons)) + 'END\n')
+
+            return Ligand(f'chain_{carbons}.pdb')
+
+        def best_time(molecule):
+
+            times = []
+            for _ in range(3):
+                molecule.dih_phis = None
+                start = perf_counter()
+                molecule.get_dihedral_values()
+                times.append(perf_counter() - start)
+
+            return min(times)
+
+        # Reading the derived terms costs the same at any size, so measuring eight times the atoms takes
+        # about eight times as long; checking them against the whole topology on every read made it quadratic
+        small, large = chain(500), chain(4000)
+        self.assertEqual(3997, len(large.dih_phis))
+        self.assertLess(best_time(large), 24 * best_time(small))
+
+    def test_canonical_key(self):
+
+        # Methanol again with the atoms in another order
+        with open('shuffled.pdb', 'w+') as pdb:
+            pdb.write('HETATM    1  H4  UNL     1       0.979  -1.036   0.000  1.00  0.00           H\n'
+                      'HETATM    2  O1  UNL     1       0.047  -0.758   0.000  1.00  0.00           O\n'
+                      'HETATM    3  H2  UNL     1       0.438   1.084   0.889  1.00  0.00           H\n'
+                      'HETATM    4  C1  UNL     1      -0.047   0.665   0.000  1.00  0.00           C\n'
+                      'HETATM    5  H3  UNL     1       0.438   1.084  -0.889  1.00  0.00           H\n'
+                      'HETATM    6  H1  UNL     1      -1.103   0.978   0.000  1.00  0.00           H\n'
+                      'CONECT    4    2    6    3    5\nCONECT    2    4    1\nEND\n')
+        shuffled = Ligand('shuffled.pdb')
+
+        self.assertEqual(self.molecule.canonical_key(), shuffled.canonical_key())
+        self.assertEqual(self.molecule.canonical_key(input_type='input'), shuffled.canonical_key(input_type='input'))
+        self.assertNotEqual(self.molecule.canonical_key(), shuffled.canonical_key(charge=1))
+
+        # Atoms are matched up to symmetry: the methyl hydrogens may be matched in any order
+        atom_map = self.molecule.atom_map(shuffled).tolist()
+        self.assertEqual([3, 1], atom_map[:2])
+        self.assertEqual(0, atom_map[5])
+        self.assertEqual({2, 4, 5}, set(atom_map[2:5]))
+
+        # A different molecule gets a different key
+        ethane = loads(dumps(self.molecule))
+        ethane.molecule['input'].elements[1] = 'C'
+        ethane.canonical_ranks = None
+        self.assertNotEqual(self.molecule.canonical_key(), ethane.canonical_key())
+        with self.assertRaises(ValueError):
+            self.molecule.atom_map(ethane)
+
+    def test_pickle_state(self):
+
+        copied = loads(dumps(self.molecule))
+
+        # Topology and terms are stored as arrays but come back in the same form and order
+        self.assertEqual(list(self.molecule.topology.edges), list(copied.topology.edges))
+        self.assertEqual(self.molecule.dihedrals, copied.dihedrals)
+        self.assertEqual(self.molecule.angles, copied.angles)
+        self.assertEqual(self.molecule.dih_phis, copied.dih_phis)
+        self.assertEqual(self.molecule.molecule['input'], copied.molecule['input'])
+        self.assertIsNone(copied.xml_tree)
+
+    def test_old_parameter_state(self):
+
+        # States saved before version 2 hold the parameters as dictionaries of strings
+        state = self.molecule.__getstate__()
+        state['_state_version'] = 1
+        state['HarmonicBondForce'] = {(0, 1): ['0.14', '300000.0']}
+        state['PeriodicTorsionForce'] = {(0, 1, 2, 3): [['1', '0.5', '0'], ['2', '0', '3.14'], ['3', '0', '0'],
+                                                        ['4', '0', '3.14'], 'Improper']}
+
+        copied = Ligand.__new__(Ligand)
+        copied.__setstate__(state)
+
+        self.assertEqual([[0.14, 300000.0]], copied.HarmonicBondForce.values.tolist())
+        self.assertEqual([True], copied.PeriodicTorsionForce.impropers.tolist())
+        self.assertEqual(0, len(copied.NonbondedForce))
+
+    def test_read_xyz_converts(self):
+
+        self.molecule.write_xyz(name='opt')
+        self.molecule.read_xyz(input_type='qm')
+
+        self.assertIsInstance(self.molecule.molecule['qm'], Geometry)
+        self.assertTrue(allclose(self.molecule.molecule['input'].coords, self.molecule.molecule['qm'].coords))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
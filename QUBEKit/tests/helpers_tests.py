@@ -0,0 +1,95 @@
+from QUBEKit.helpers import StateStore, unpickle
+
+from os import chdir, getcwd, listdir, path
+from pickle import dump
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+
+import unittest
+
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+
+        self.home = getcwd()
+        self.temp = TemporaryDirectory()
+        chdir(self.temp.name)
+
+        self.store = StateStore()
+
+    def tearDown(self):
+
+        chdir(self.home)
+        self.temp.cleanup()
+
+    def test_save_and_load(self):
+
+        for state in ['parametrise', 'mm_optimise', 'qm_optimise']:
+            self.store.save(SimpleNamespace(state=state, energy=len(state)))
+
+        # One file per state plus the index
+        self.assertEqual(4, len(listdir('.QUBEKit_states')))
+        self.assertEqual(['parametrise', 'mm_optimise', 'qm_optimise'], list(unpickle()))
+        self.assertEqual(11, unpickle('mm_optimise').energy)
+
+        # Overwriting a state keeps its place
+        self.store.save(SimpleNamespace(state='parametrise', energy=0))
+        self.assertEqual(['parametrise', 'mm_optimise', 'qm_optimise'], list(self.store))
+        self.assertEqual(0, self.store['parametrise'].energy)
+
+        with self.assertRaises(KeyError):
+            self.store['hessian']
+
+    def test_crash_recovery(self):
+
+        self.store.save(SimpleNamespace(state='parametrise'))
+
+        # A half written temporary file and a state file which never made it into the index
+        with open(path.join('.QUBEKit_states', '.broken.tmp'), 'wb') as broken:
+            broken.write(b'\x80')
+        with open(self.store.state_file('hessian'), 'wb') as unindexed:
+            dump(SimpleNamespace(state='hessian'), unindexed)
+
+        self.assertEqual(['parametrise', 'hessian'], list(self.store))
+        self.assertIn('hessian', self.store)
+
+        # States written by the store are compressed; the plain pickle above still loads
+        with open(self.store.state_file('parametrise'), 'rb') as state:
+            self.assertTrue(state.read().startswith(StateStore.magic))
+        self.assertEqual('hessian', self.store['hessian'].state)
+
+    def test_legacy_jar(self):
+
+        # Old versions kept every state in one file
+        with open('.QUBEKit_states', 'wb') as jar:
+            for state in ['parametrise', 'mm_optimise']:
+                dump(SimpleNamespace(state=state), jar)
+
+        self.assertEqual(['parametrise', 'mm_optimise'], list(self.store))
+
+        self.store.save(SimpleNamespace(state='hessian'))
+        self.assertTrue(path.isdir('.QUBEKit_states'))
+        self.assertEqual(['parametrise', 'mm_optimise', 'hessian'], list(self.store))
+        self.assertEqual('mm_optimise', self.store['mm_optimise'].state)
+        self.assertEqual(['.QUBEKit_states'], listdir('.'))
+
+    def test_interrupted_conversion(self):
+
+        # A conversion which moved the jar aside but never swapped in the new folder
+        with open('.QUBEKit_states.old', 'wb') as jar:
+            for state in ['parametrise', 'mm_optimise']:
+                dump(SimpleNamespace(state=state), jar)
+
+        self.assertEqual(['parametrise', 'mm_optimise'], list(self.store))
+        self.assertIn('mm_optimise', self.store)
+
+        # The next save finishes the conversion
+        self.store.save(SimpleNamespace(state='hessian'))
+        self.assertEqual(['parametrise', 'mm_optimise', 'hessian'], list(self.store))
+        self.assertEqual(['.QUBEKit_states'], listdir('.'))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,156 @@
+from QUBEKit.connectivity import residue_charge
+from QUBEKit.engines import ONETEP
+from QUBEKit.ligand import Ligand, Protein
+
+from numpy import allclose, array, cos, sin
+from os import chdir, getcwd, listdir, path
+from tempfile import TemporaryDirectory
+
+import unittest
+
+
+class TestONETEP(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.home = getcwd()
+        cls.temp = TemporaryDirectory()
+        chdir(cls.temp.name)
+
+        molecules = {
+            'water': (['O', 'H', 'H'], [[0.0, 0.0, 0.0], [0.757, 0.586, 0.0], [-0.757, 0.586, 0.0]]),
+            'methanol': (['C', 'O', 'H', 'H', 'H', 'H'],
+                         [[-0.047, 0.665, 0.0], [0.047, -0.758, 0.0], [-1.103, 0.978, 0.0],
+                          [0.438, 1.084, 0.889], [0.438, 1.084, -0.889], [0.979, -1.036, 0.0]])}
+
+        for name, (elements, coords) in molecules.items():
+            with open(f'{name}.pdb', 'w+') as pdb:
+                for atom, (element, (x, y, z)) in enumerate(zip(elements, coords), 1):
+                    pdb.write(f'HETATM{atom:>5}  {element}{atom:<2} UNL     1    {x:8.3f}{y:8.3f}{z:8.3f}'
+                              f'  1.00  0.00          {element:>2}\n')
+                pdb.write('END\n')
+
+        cls.water = Ligand('water.pdb')
+        cls.methanol = Ligand('methanol.pdb')
+        cls.configs = [{'charge': -1, 'multiplicity': 1}, {'theory': 'PBE1PBE', 'threads': 4}, {}, {}]
+
+    @classmethod
+    def tearDownClass(cls):
+
+        chdir(cls.home)
+        cls.temp.cleanup()
+
+    @staticmethod
+    def read_block(lines, block):
+        """The lines of a %block of a .dat file."""
+
+        start = lines.index(f'%block {block}')
+        return lines[start + 1:lines.index(f'%endblock {block}')]
+
+    def test_minimal_cell(self):
+
+        onetep = ONETEP(self.water, self.configs, padding=4.0)
+        padding = 4.0 * onetep.bohr_to_angs
+
+        # Corners of a 10 x 4 x 2 box turned away from the axes; the cell is fitted to the box's own axes
+        corners = array([[x, y, z] for x in (0, 10) for y in (0, 4) for z in (0, 2)], dtype=float)
+        turn = array([[cos(0.5), -sin(0.5), 0], [sin(0.5), cos(0.5), 0], [0, 0, 1]])
+        positions, lattice = onetep.minimal_cell(corners @ turn.T + 3.0)
+
+        self.assertTrue(allclose(sorted(lattice), array([2, 4, 10]) + 2 * padding))
+        self.assertTrue(allclose(positions.min(axis=0), padding))
+        self.assertTrue(allclose(positions.max(axis=0), lattice - padding))
+
+        # A given cell is kept and the molecule centred in it
+        positions, lattice = onetep.minimal_cell(corners, lattice=[30, 30, 30])
+        self.assertTrue(allclose([30, 30, 30], lattice))
+        self.assertTrue(allclose(positions.min(axis=0) + positions.max(axis=0), 30))
+
+        # Flat molecules have no hull but still get a cell
+        positions, lattice = onetep.minimal_cell(self.water.molecule['input'].coords)
+        self.assertEqual((3, 3), positions.shape)
+        self.assertTrue((lattice >= 2 * padding).all())
+
+    def test_dat_file(self):
+
+        ONETEP(self.methanol, self.configs).generate_input(name='methanol_single')
+
+        with open('methanol_single.dat') as dat:
+            lines = [line.strip() for line in dat]
+
+        self.assertIn('xc_functional : PBE0', lines)
+        self.assertIn('charge : -1', lines)
+
+        lattice = array([row.split() for row in self.read_block(lines, 'lattice_cart')[1:]], dtype=float)
+        self.assertEqual((3, 3), lattice.shape)
+        self.assertTrue(allclose(lattice, lattice * [[1, 0, 0], [0, 1, 0], [0, 0, 1]]))
+
+        positions = self.read_block(lines, 'positions_abs')
+        self.assertEqual('ang', positions[0])
+        self.assertEqual(['C', 'O', 'H', 'H', 'H', 'H'], [row.split()[0] for row in positions[1:]])
+
+        # One species per element, with 4 NGWFs for first row atoms and 1 for hydrogen
+        species = [row.split() for row in self.read_block(lines, 'species')]
+        self.assertEqual([['C', 'C', '6', '4', '7.00'], ['O', 'O', '8', '4', '7.00'], ['H', 'H', '1', '1', '7.00']],
+                         species)
+        self.assertEqual(3, len(self.read_block(lines, 'species_pot')))
+
+    def test_unknown_functional(self):
+
+        # Theories ONETEP does not have fall back to PBE so the density stage still writes its inputs
+        onetep = ONETEP(self.water, [self.configs[0], {'theory': 'wB97XD'}, {}, {}])
+        self.assertEqual('PBE', onetep.xc_functional)
+
+        onetep.generate_input(name='water_fallback')
+        with open('water_fallback.dat') as dat:
+            self.assertIn('xc_functional : PBE', [line.strip() for line in dat])
+
+    def test_batch(self):
+
+        ONETEP(self.water, self.configs).generate_batch([self.water, self.methanol], folder='batch', shared_cell=True)
+
+        self.assertEqual(['methanol.dat', 'water.dat'], sorted(name for name in listdir('batch') if
+                                                               name.endswith('.dat')))
+        with open(path.join('batch', 'jobs.txt')) as jobs:
+            self.assertEqual(['water', 'methanol'], jobs.read().split())
+        with open(path.join('batch', 'submit_array.sh')) as script:
+            script = script.read()
+        self.assertIn('#SBATCH --array=1-2', script)
+        self.assertIn('#SBATCH --cpus-per-task=4', script)
+
+        # Both inputs share the larger cell
+        cells = []
+        for name in ('water', 'methanol'):
+            with open(path.join('batch', f'{name}.dat')) as dat:
+                lines = [line.strip() for line in dat]
+            cells.append(array([row.split() for row in self.read_block(lines, 'lattice_cart')[1:]], dtype=float))
+        self.assertTrue(allclose(cells[0], cells[1]))
+        self.assertTrue(allclose(cells[1].diagonal(), ONETEP(self.methanol, self.configs).minimal_cell(
+            self.methanol.molecule['input'].coords)[1]))
+
+    def test_capped_peptide_charge(self):
+
+        # ACE-ALA-NME with hydrogens: the methyl hydrogens of both caps are named H1, H2 and H3
+        residues = [('ACE', ['H1', 'CH3', 'H2', 'H3', 'C', 'O']),
+                    ('ALA', ['N', 'H', 'CA', 'HA', 'CB', 'HB1', 'HB2', 'HB3', 'C', 'O']),
+                    ('NME', ['N', 'H', 'C', 'H1', 'H2', 'H3'])]
+
+        with open('capped.pdb', 'w+') as pdb:
+            atoms = [(atom, residue, number) for number, (residue, names) in enumerate(residues, 1) for atom in names]
+            for serial, (atom, residue, number) in enumerate(atoms, 1):
+                pdb.write(f'ATOM  {serial:>5} {atom:<4} {residue} A{number:>4}    {1.5 * serial:8.3f}   0.000   0.000'
+                          f'  1.00  0.00          {atom[0]:>2}\n')
+            pdb.write('END\n')
+
+        # The caps are never charged termini, so the net charge written to the ONETEP inputs is 0
+        self.assertEqual(0, Protein('capped.pdb').charge)
+
+        # An uncapped N terminus on the same residue is still charged
+        names = ['N', 'H1', 'H2', 'H3', 'CA', 'C', 'O']
+        self.assertEqual(1, residue_charge(names, ['ALA'] * len(names), ['A   1 '] * len(names)))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,133 @@
+from QUBEKit.parameters import BondTable, NonbondedTable, TorsionTable
+
+from copy import deepcopy
+from pickle import dumps, loads
+
+import unittest
+
+
+class TestParameterTable(unittest.TestCase):
+
+    def setUp(self):
+
+        self.bonds = BondTable([((0, 1), ['0.14', '300000.0']), ((1, 2), [0.1, 400000.0])])
+
+    def test_mapping(self):
+
+        # Strings are converted once, on the way in
+        self.assertEqual([(0, 1), (1, 2)], list(self.bonds))
+        self.assertEqual([0.14, 300000.0], self.bonds[(0, 1)].to_list())
+        self.assertEqual(['0.14', '300000.0'], self.bonds[(0, 1)])
+        self.assertNotIn((1, 0), self.bonds)
+
+        # Views write through to the arrays, and the arrays through to the views
+        self.bonds[(1, 2)][0] = 0.11
+        self.assertEqual(0.11, self.bonds.values[1, 0])
+        self.bonds.column('k')[:] *= 2
+        self.assertEqual(600000.0, self.bonds[(0, 1)][1])
+
+        with self.assertRaises(ValueError):
+            self.bonds[(2, 3)] = [0.1]
+
+    def test_growth_and_deletion(self):
+
+        for i in range(2, 50):
+            self.bonds[(i, i + 1)] = [i, i]
+
+        del self.bonds[(1, 2)]
+        self.assertEqual(49, len(self.bonds))
+        self.assertEqual((49, 2), self.bonds.values.shape)
+        self.assertEqual([2.0, 2.0], self.bonds[(2, 3)].to_list())
+        self.assertEqual([[0, 1], [2, 3]], self.bonds.terms[:2].tolist())
+        self.assertEqual([1, 48], self.bonds.rows([(2, 3), (49, 50)]).tolist())
+
+    def test_single_atom_keys(self):
+
+        nonbonded = NonbondedTable((i, [-0.1 * i, 0.3, 0.2]) for i in range(3))
+        nonbonded[1][0] -= 0.5
+
+        self.assertEqual([0, 1, 2], list(nonbonded))
+        self.assertEqual([0.0, -0.6, -0.2], nonbonded.column('charge').round(6).tolist())
+
+    def test_from_arrays(self):
+
+        # A repeated term stays where it first appears with its last parameters, as assigning in turn would
+        bonds = BondTable.from_arrays([[0, 1], [1, 2], [0, 1]], [[0.1, 1.0], [0.2, 2.0], [0.3, 3.0]])
+        self.assertEqual([(0, 1), (1, 2)], list(bonds))
+        self.assertEqual([0.3, 3.0], bonds[(0, 1)].to_list())
+
+        nonbonded = NonbondedTable.from_arrays(range(2), [[0.1, 0.3, 0.2], [-0.1, 0.3, 0.2]])
+        self.assertEqual([0, 1], list(nonbonded))
+
+        # The tables grow as usual afterwards
+        bonds[(2, 3)] = [0.4, 4.0]
+        self.assertEqual(3, len(bonds.values))
+
+    def test_pickle(self):
+
+        for copied in (loads(dumps(self.bonds)), deepcopy(self.bonds)):
+            self.assertEqual(list(self.bonds), list(copied))
+            self.assertEqual(self.bonds.values.tolist(), copied.values.tolist())
+
+            # The copy is independent of the original
+            copied[(0, 1)][0] = 1
+            self.assertEqual(0.14, self.bonds[(0, 1)][0])
+
+
+class TestTorsionTable(unittest.TestCase):
+
+    def setUp(self):
+
+        self.torsions = TorsionTable()
+        self.torsions[(0, 1, 2, 3)] = [['3', '0.5', '0'], ['1', '1.2', '0']]
+        self.torsions[(1, 0, 2, 3)] = [[1, 0, 0], [2, 0, 3.14], [3, 0, 0], [4, 0.7, 3.14], 'Improper']
+
+    def test_nested_form(self):
+
+        # Missing periodicities get no barrier and the default phase
+        proper = self.torsions[(0, 1, 2, 3)]
+        self.assertEqual([[1, 1.2, 0.0], [2, 0.0, 3.141592653589793], [3, 0.5, 0.0], [4, 0.0, 3.141592653589793]],
+                         proper.to_list())
+        self.assertEqual(4, len(proper))
+        self.assertEqual(0.5, proper[2][1])
+
+        improper = self.torsions[(1, 0, 2, 3)]
+        self.assertEqual('Improper', improper[-1])
+        self.assertEqual(5, len(improper))
+        self.assertEqual([False, True], self.torsions.impropers.tolist())
+
+    def test_edit(self):
+
+        proper = self.torsions[(0, 1, 2, 3)]
+        proper[1][1] = 2.5
+        proper.k[3] = 0.25
+        self.assertEqual([1.2, 2.5, 0.5, 0.25], self.torsions.values[0, :4].tolist())
+
+        # Copying one torsion onto another keeps the improper flag
+        self.torsions[(4, 5, 6, 7)] = self.torsions[(1, 0, 2, 3)]
+        self.assertTrue(self.torsions[(4, 5, 6, 7)].improper)
+        self.assertEqual(self.torsions[(1, 0, 2, 3)], self.torsions[(4, 5, 6, 7)])
+
+    def test_from_arrays(self):
+
+        torsions = TorsionTable.from_arrays([[0, 1, 2, 3], [1, 0, 2, 3]], [[1, 0, 0, 0, 0, 3.14, 0, 3.14]] * 2,
+                                            [False, True])
+        self.assertEqual([False, True], torsions.impropers.tolist())
+        self.assertEqual('Improper', torsions[(1, 0, 2, 3)][-1])
+
+        torsions[(4, 5, 6, 7)] = [[2, 1.5, 3.14]]
+        self.assertEqual([False, True, False], torsions.impropers.tolist())
+
+    def test_delete_and_pickle(self):
+
+        del self.torsions[(0, 1, 2, 3)]
+        copied = loads(dumps(self.torsions))
+
+        self.assertEqual([(1, 0, 2, 3)], list(copied))
+        self.assertEqual([True], copied.impropers.tolist())
+        self.assertEqual(0.7, copied[(1, 0, 2, 3)][3][1])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
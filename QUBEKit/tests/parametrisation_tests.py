@@ -0,0 +1,249 @@
+from QUBEKit.ligand import Ligand, Protein
+from QUBEKit.parametrisation import Parametrisation, XMLProtein
+
+from numpy import allclose, array, pi, zeros
+from os import chdir, getcwd, mkdir
+from tempfile import TemporaryDirectory
+
+import unittest
+
+
+# Stand ins for the OpenMM forces; force_arrays only needs their class names and term getters
+
+class HarmonicBondForce:
+
+    def __init__(self, bonds):
+        self.bonds = bonds
+
+    def getNumBonds(self):
+        return len(self.bonds)
+
+    def getBondParameters(self, index):
+        return self.bonds[index]
+
+
+class HarmonicAngleForce:
+
+    def __init__(self, angles):
+        self.angles = angles
+
+    def getNumAngles(self):
+        return len(self.angles)
+
+    def getAngleParameters(self, index):
+        return self.angles[index]
+
+
+class NonbondedForce:
+
+    def __init__(self, particles):
+        self.particles = particles
+
+    def getNumParticles(self):
+        return len(self.particles)
+
+    def getParticleParameters(self, index):
+        return self.particles[index]
+
+
+class PeriodicTorsionForce:
+
+    def __init__(self, torsions):
+        self.torsions = torsions
+
+    def getNumTorsions(self):
+        return len(self.torsions)
+
+    def getTorsionParameters(self, index):
+        return self.torsions[index]
+
+
+class System:
+
+    def __init__(self, *forces):
+        self.forces = list(forces)
+
+    def getForces(self):
+        return self.forces
+
+
+class TestStoreForces(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.home = getcwd()
+        cls.temp = TemporaryDirectory()
+        chdir(cls.temp.name)
+
+        # Formic acid: one improper about the carbon and two dihedrals about the C-O single bond
+        with open('formic.pdb', 'w+') as pdb:
+            pdb.write('HETATM    1  C1  UNL     1       0.000   0.420   0.000  1.00  0.00           C\n'
+                      'HETATM    2  O1  UNL     1       1.200   0.640   0.000  1.00  0.00           O\n'
+                      'HETATM    3  O2  UNL     1      -0.900   1.410   0.000  1.00  0.00           O\n'
+                      'HETATM    4  H1  UNL     1      -0.400  -0.600   0.000  1.00  0.00           H\n'
+                      'HETATM    5  H2  UNL     1      -0.450   2.270   0.000  1.00  0.00           H\n'
+                      'CONECT    1    2    3    4\nCONECT    3    5\nEND\n')
+
+    @classmethod
+    def tearDownClass(cls):
+
+        chdir(cls.home)
+        cls.temp.cleanup()
+
+    def setUp(self):
+
+        self.molecule = Ligand('formic.pdb')
+        self.molecule.find_impropers()
+        self.param = Parametrisation(self.molecule)
+
+        self.bonds = [(0, 1, 0.121, 476976.0), (0, 2, 0.134, 376560.0), (0, 3, 0.109, 284512.0),
+                      (2, 4, 0.097, 462750.4)]
+        self.angles = [(1, 0, 2, 2.14, 669.44), (1, 0, 3, 2.09, 418.4), (2, 0, 3, 1.92, 418.4),
+                       (0, 2, 4, 1.89, 292.88)]
+        self.particles = [(0.52, 0.375, 0.439), (-0.44, 0.296, 0.879), (-0.53, 0.300, 0.711), (0.0, 0.242, 0.125),
+                          (0.45, 0.0, 0.0)]
+
+    def test_store_forces(self):
+
+        self.param.system = System(HarmonicBondForce(self.bonds), HarmonicAngleForce(self.angles),
+                                   NonbondedForce(self.particles), PeriodicTorsionForce([]))
+        self.param.store_forces()
+
+        self.assertEqual([bond[:2] for bond in self.bonds], list(self.molecule.HarmonicBondForce))
+        self.assertTrue(allclose([bond[2:] for bond in self.bonds], self.molecule.HarmonicBondForce.values))
+        self.assertEqual([angle[:3] for angle in self.angles], list(self.molecule.HarmonicAngleForce))
+        self.assertTrue(allclose([angle[3:] for angle in self.angles], self.molecule.HarmonicAngleForce.values))
+        self.assertEqual([0, 1, 2, 3, 4], list(self.molecule.NonbondedForce))
+        self.assertTrue(allclose(self.particles, self.molecule.NonbondedForce.values))
+
+        # With no torsion parameters every dihedral is still stored, with no barriers
+        torsions = self.molecule.PeriodicTorsionForce
+        self.assertEqual([(1, 0, 2, 4), (3, 0, 2, 4)], list(torsions))
+        self.assertTrue(allclose(0, torsions.values[:, :4]))
+        self.assertFalse(torsions.impropers.any())
+
+    def test_store_torsions(self):
+
+        # One row per periodicity, as OpenMM gives them: periodicity, phase, k
+        self.param.system = System(HarmonicBondForce(self.bonds), PeriodicTorsionForce([
+            (1, 0, 2, 4, 2, pi, 10.46),
+            # The same torsion in the other direction, with a phase which is not the default
+            (4, 2, 0, 1, 1, 0.5, 2.0),
+            # The improper about the carbon, in the order the force field matched it
+            (1, 2, 0, 3, 2, pi, 4.6)]))
+        self.param.store_forces()
+
+        torsions = self.molecule.PeriodicTorsionForce
+
+        # Propers under the direction first given, the unparameterised dihedral, then the improper centre first
+        self.assertEqual([(1, 0, 2, 4), (3, 0, 2, 4), (0, 1, 2, 3)], list(torsions))
+        self.assertEqual([False, False, True], torsions.impropers.tolist())
+
+        # Periodicities left out have no barrier and every phase is the default of its periodicity
+        self.assertTrue(allclose([[2.0, 10.46, 0, 0], [0, 0, 0, 0], [0, 4.6, 0, 0]], torsions.values[:, :4]))
+        self.assertTrue(allclose([0, pi, 0, pi], torsions.values[:, 4:]))
+        self.assertEqual([[1, 2.0, 0], [2, 10.46, pi], [3, 0, 0], [4, 0, pi]], torsions[(1, 0, 2, 4)])
+
+        # Missing forces give empty tables rather than errors
+        self.assertEqual(0, len(self.molecule.HarmonicAngleForce))
+        self.assertEqual(0, len(self.molecule.NonbondedForce))
+
+    def test_store_arrays(self):
+
+        # The arrays of each force can be given directly, as XMLProtein does, without a system
+        forces = {'HarmonicBondForce': (array([[0, 1]]), array([[0.121, 476976.0]])),
+                  'HarmonicAngleForce': (zeros((0, 3), dtype=int), zeros((0, 2))),
+                  'NonbondedForce': (zeros((5, 0), dtype=int), array(self.particles)),
+                  'PeriodicTorsionForce': (array([[3, 0, 2, 4], [3, 0, 2, 4]]), array([[3, 0, 1.5], [1, 0, 0.5]]))}
+        self.param.store_forces(forces=forces)
+
+        torsions = self.molecule.PeriodicTorsionForce
+        self.assertEqual([(3, 0, 2, 4), (1, 0, 2, 4)], list(torsions))
+        self.assertTrue(allclose([[0.5, 0, 1.5, 0], [0, 0, 0, 0]], torsions.values[:, :4]))
+        self.assertEqual(1, len(self.molecule.HarmonicBondForce))
+
+
+class TestXMLProtein(unittest.TestCase):
+
+    # Atoms (name, element) and bonds of each residue of a capped dialanine, with the OpenMM atom names
+    residues = {
+        'ACE': ([('H1', 'H'), ('CH3', 'C'), ('H2', 'H'), ('H3', 'H'), ('C', 'C'), ('O', 'O')],
+                [('H1', 'CH3'), ('CH3', 'H2'), ('CH3', 'H3'), ('CH3', 'C'), ('C', 'O')]),
+        'ALA': ([('N', 'N'), ('H', 'H'), ('CA', 'C'), ('HA', 'H'), ('CB', 'C'), ('HB1', 'H'), ('HB2', 'H'),
+                 ('HB3', 'H'), ('C', 'C'), ('O', 'O')],
+                [('N', 'H'), ('N', 'CA'), ('CA', 'HA'), ('CA', 'CB'), ('CB', 'HB1'), ('CB', 'HB2'), ('CB', 'HB3'),
+                 ('CA', 'C'), ('C', 'O')]),
+        'NME': ([('N', 'N'), ('H', 'H'), ('C', 'C'), ('H1', 'H'), ('H2', 'H'), ('H3', 'H')],
+                [('N', 'H'), ('N', 'C'), ('C', 'H1'), ('C', 'H2'), ('C', 'H3')])}
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.home = getcwd()
+        cls.temp = TemporaryDirectory()
+        chdir(cls.temp.name)
+        # The timer logs are written to the folder above
+        mkdir('run')
+        chdir('run')
+
+        # Parameters only depend on the atoms and bonds, so the atoms are simply spread along a line
+        atoms, bonds, previous_c = [], [], None
+        for residue_id, name in enumerate(['ACE', 'ALA', 'ALA', 'NME'], 1):
+            names, residue_bonds = cls.residues[name]
+            serials = {atom: len(atoms) + i for i, (atom, _) in enumerate(names, 1)}
+            atoms.extend((atom, element, name, residue_id) for atom, element in names)
+            bonds.extend((serials[a], serials[b]) for a, b in residue_bonds)
+            # Peptide bond to the previous residue
+            if previous_c is not None:
+                bonds.append((previous_c, serials['N']))
+            previous_c = serials['C']
+
+        with open('peptide.pdb', 'w+') as pdb:
+            for serial, (atom, element, name, residue_id) in enumerate(atoms, 1):
+                pdb.write(f'ATOM  {serial:>5} {atom:<4} {name} A{residue_id:>4}    {1.2 * serial:8.3f}'
+                          f'{0.8 * (serial % 2):8.3f}{0.3 * (serial % 3):8.3f}  1.00  0.00          {element:>2}\n')
+            pdb.write(''.join(f'CONECT{a:>5}{b:>5}\n' for a, b in bonds) + 'END\n')
+
+        cls.whole = Protein('peptide.pdb')
+        XMLProtein(cls.whole, input_file='amber99sb.xml', cache_residues=False)
+
+        # Stamped from the residue and residue pair templates, as proteins are by default
+        cls.cached = Protein('peptide.pdb')
+        cls.stamped = XMLProtein(cls.cached, input_file='amber99sb.xml')
+
+    @classmethod
+    def tearDownClass(cls):
+
+        chdir(cls.home)
+        cls.temp.cleanup()
+
+    @staticmethod
+    def by_atoms(table, ordered=False):
+        """The parameters of each term under its atoms in a fixed direction (in order for impropers)."""
+
+        impropers = getattr(table, 'impropers', zeros(len(table), dtype=bool)).tolist()
+
+        return {(tuple(term) if ordered or improper else min(tuple(term), tuple(term[::-1]))): tuple(values)
+                for term, values, improper in zip(table.terms.tolist(), table.values.tolist(), impropers)}
+
+    def test_same_tables(self):
+
+        # The residue templates were used rather than the system of the whole peptide
+        self.assertIsNotNone(self.stamped.forces)
+
+        for name in ('HarmonicBondForce', 'HarmonicAngleForce', 'PeriodicTorsionForce', 'NonbondedForce'):
+            whole, cached = getattr(self.whole, name), getattr(self.cached, name)
+            with self.subTest(force=name):
+                self.assertEqual(len(whole), len(cached))
+                self.assertEqual(self.by_atoms(whole, name == 'NonbondedForce'),
+                                 self.by_atoms(cached, name == 'NonbondedForce'))
+
+        self.assertEqual(self.whole.PeriodicTorsionForce.impropers.sum(),
+                         self.cached.PeriodicTorsionForce.impropers.sum())
+        self.assertEqual(list(self.whole.topology.edges), list(self.cached.topology.edges))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,260 @@
+from QUBEKit.ligand import read_ligands
+from QUBEKit.readers import CubeFile, PDBFile, WFXFile, read_molecules
+
+from numpy import arange, allclose, save, stack
+from os import chdir, getcwd, listdir, utime
+from shutil import copy
+from tempfile import TemporaryDirectory
+
+import unittest
+
+
+class TestDensityReaders(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.home = getcwd()
+        cls.temp = TemporaryDirectory()
+        chdir(cls.temp.name)
+
+        # A 4 x 6 x 5 grid of increasing values, written 6 values per line like Gaussian
+        cls.values = arange(4 * 6 * 5, dtype=float).reshape(4, 6, 5) / 100
+        with open('test.cube', 'w+') as cube:
+            cube.write('Test cube\nElectron density\n')
+            cube.write('    2   -1.000000   -2.000000   -3.000000\n')
+            cube.write('    4    0.500000    0.000000    0.000000\n')
+            cube.write('    6    0.000000    0.500000    0.000000\n')
+            cube.write('    5    0.000000    0.000000    0.500000\n')
+            cube.write('    8    8.000000    0.000000    0.000000    0.000000\n')
+            cube.write('    1    1.000000    0.000000    0.000000    1.800000\n')
+            for i in range(4):
+                for j in range(6):
+                    row = cls.values[i, j]
+                    for start in range(0, 5, 6):
+                        cube.write(''.join(f'{val:13.5E}' for val in row[start:start + 6]) + '\n')
+
+        with open('test.wfx', 'w+') as wfx:
+            wfx.write('<Title>\n water\n</Title>\n<Number of Nuclei>\n 2\n</Number of Nuclei>\n'
+                      '<Net Charge>\n 0\n</Net Charge>\n<Nuclear Names>\n O1\n H2\n</Nuclear Names>\n'
+                      '<Atomic Numbers>\n 8\n 1\n</Atomic Numbers>\n'
+                      '<Nuclear Cartesian Coordinates>\n 0.0 0.0 0.0\n 0.0 0.0 1.8\n</Nuclear Cartesian Coordinates>\n'
+                      '<Molecular Orbital Primitive Coefficients>\n 1.0 2.0\n</Molecular Orbital Primitive Coefficients>\n'
+                      '<Energy>\n -7.60000000000000D+01\n</Energy>\n')
+
+    @classmethod
+    def tearDownClass(cls):
+
+        chdir(cls.home)
+        cls.temp.cleanup()
+
+    def test_cube_header(self):
+
+        cube = CubeFile('test.cube')
+        self.assertEqual((4, 6, 5), cube.shape)
+        self.assertEqual([8, 1], list(cube.atomic_numbers))
+        self.assertTrue(allclose([-1, -2, -3], cube.origin))
+
+    def test_cube_grid_and_views(self):
+
+        cube = CubeFile('test.cube', chunk_lines=3)
+
+        # The whole grid is mapped and matches the values written
+        self.assertTrue(allclose(self.values, cube.grid))
+
+        # Strided views and sub-boxes are views of the same data
+        self.assertTrue(allclose(self.values[::2, 1:5, ::3], cube.view((0, 1, 0), (4, 5, 5), (2, 1, 3))))
+        sub_box, sub_origin = cube.box((-0.5, -1.5, -3), (0, -1, -2))
+        self.assertTrue(allclose(self.values[1:3, 1:3, 0:3], sub_box))
+        self.assertTrue(allclose([-0.5, -1.5, -3], sub_origin))
+
+        reduced, axes = cube.downsample(2)
+        self.assertEqual((2, 3, 2), reduced.shape)
+        self.assertAlmostEqual(self.values[:2, :2, :2].mean(), reduced[0, 0, 0])
+        self.assertTrue(allclose(axes[0], [1, 0, 0]))
+
+    def test_cube_sidecar(self):
+
+        # A sidecar left truncated (or of another grid) is rebuilt even though it is newer than the cube
+        save('truncated.cube.npy', arange(7, dtype=float))
+        copy('test.cube', 'truncated.cube')
+        utime('truncated.cube.npy', (1e10, 1e10))
+        cube = CubeFile('truncated.cube')
+        self.assertFalse(cube.cache_is_current())
+        self.assertTrue(allclose(self.values, cube.grid))
+        self.assertTrue(CubeFile('truncated.cube').cache_is_current())
+
+        # A build which fails part way leaves no sidecar behind
+        with open('test.cube') as cube, open('short.cube', 'w+') as short:
+            short.writelines(cube.readlines()[:-3])
+        with self.assertRaises(EOFError):
+            CubeFile('short.cube', chunk_lines=3).grid
+        self.assertEqual([], [name for name in listdir('.') if name.startswith('short.cube.npy') or
+                              name.endswith('.tmp')])
+
+    def test_orbital_cube(self):
+
+        # Two orbitals; each grid point lists both
+        orbitals = stack([self.values, -self.values], axis=-1)
+        with open('test.cube') as cube, open('orbitals.cube', 'w+') as out:
+            header = cube.readlines()[:8]
+            header[2] = '   -2' + header[2][5:]
+            out.writelines(header)
+            out.write('    2   11   12\n')
+            for i in range(4):
+                for j in range(6):
+                    out.write(''.join(f'{val:13.5E}' for val in orbitals[i, j].ravel()) + '\n')
+
+        cube = CubeFile('orbitals.cube')
+        self.assertEqual([11, 12], cube.mo_indices)
+        self.assertTrue(allclose(orbitals, cube.grid))
+
+        reduced = cube.downsample(2)[0]
+        self.assertEqual((2, 3, 2, 2), reduced.shape)
+        self.assertAlmostEqual(-self.values[:2, :2, :2].mean(), reduced[0, 0, 0, 1])
+
+    def test_wfx_lazy_headers(self):
+
+        wfx = WFXFile('test.wfx')
+        self.assertEqual(2, wfx.number_of_nuclei)
+        self.assertEqual(['O1', 'H2'], wfx.nuclear_names)
+        self.assertEqual((2, 3), wfx.nuclear_coordinates.shape)
+        self.assertAlmostEqual(-76.0, wfx.energy)
+
+        with self.assertRaises(KeyError):
+            wfx.section('Number of Primitives')
+
+
+class TestPDBFile(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.home = getcwd()
+        cls.temp = TemporaryDirectory()
+        chdir(cls.temp.name)
+
+        with open('test.pdb', 'w+') as pdb:
+            pdb.write('REMARK   1 ATOM and HETATM records only\n'
+                      'ATOM      1  N   ALA A   1     -10.500   2.250 100.125  1.00  0.00           N\n'
+                      'ATOM      2  CA  ALA A   1      -1.000-200.000   0.000  1.00  0.00           C\n'
+                      'HETATM    3 CL12 LIG B   2       0.000   0.000   1.750  1.00  0.00          Cl1-\n'
+                      'HETATM    4 H1   LIG B   2       1.000   1.000   1.000\n'
+                      'CONECT    1    2    3    4\nCONECT    2    1    0\nCONECT1000010001\nEND\n')
+
+        # A small block size so the file is read over several blocks
+        cls.pdb = PDBFile('test.pdb', chunk_lines=3)
+
+    @classmethod
+    def tearDownClass(cls):
+
+        chdir(cls.home)
+        cls.temp.cleanup()
+
+    def test_atoms(self):
+
+        self.assertEqual(4, len(self.pdb))
+        self.assertEqual(['N', 'CA', 'CL12', 'H1'], list(self.pdb.names))
+        self.assertEqual(['ALA', 'ALA', 'LIG', 'LIG'], list(self.pdb.residues))
+        self.assertEqual(['N', 'C', 'Cl', ''], list(self.pdb.elements))
+        self.assertTrue(allclose([[-10.5, 2.25, 100.125], [-1, -200, 0], [0, 0, 1.75], [1, 1, 1]], self.pdb.coords))
+
+    def test_bonds(self):
+
+        # Zero partners are dropped and joined up 5 digit serial numbers are still split
+        self.assertEqual([[1, 2], [1, 3], [1, 4], [2, 1], [10000, 10001]], self.pdb.bonds.tolist())
+
+
+class TestMoleculeStreams(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.home = getcwd()
+        cls.temp = TemporaryDirectory()
+        chdir(cls.temp.name)
+
+        # Methanol, then the methoxide anion (charge from M  CHG) with no name and methanol again
+        methanol = ('\n  QUBEKit\n\n  6  5  0  0  0  0  0  0  0  0999 V2000\n'
+                    '   -0.0470    0.6650    0.0000 C   0  0  0  0  0  0  0  0  0  0  0  0\n'
+                    '    0.0470   -0.7580    0.0000 O   0  0  0  0  0  0  0  0  0  0  0  0\n'
+                    '   -1.1030    0.9780    0.0000 H   0  0  0  0  0  0  0  0  0  0  0  0\n'
+                    '    0.4380    1.0840    0.8890 H   0  0  0  0  0  0  0  0  0  0  0  0\n'
+                    '    0.4380    1.0840   -0.8890 H   0  0  0  0  0  0  0  0  0  0  0  0\n'
+                    '    0.9790   -1.0360    0.0000 H   0  0  0  0  0  0  0  0  0  0  0  0\n'
+                    '  1  2  1  0\n  1  3  1  0\n  1  4  1  0\n  1  5  1  0\n  2  6  1  0\n')
+        methoxide = methanol.replace('  6  5  0', '  5  4  0').replace(
+            '    0.9790   -1.0360    0.0000 H   0  0  0  0  0  0  0  0  0  0  0  0\n', '').replace('  2  6  1  0\n', '')
+
+        with open('library.sdf', 'w+') as sdf:
+            sdf.write(f'methanol{methanol}M  END\n> <ID>\n1\n\n$$$$\n'
+                      f'{methoxide}M  CHG  1   2  -1\nM  END\n$$$$\nmethanol{methanol}M  END\n$$$$\n')
+
+        with open('library.mol2', 'w+') as mol2:
+            mol2.write('@<TRIPOS>MOLECULE\nwater 1\n 3 2 1\nSMALL\nUSER_CHARGES\n\n@<TRIPOS>ATOM\n'
+                       '      7 OW     0.0000    0.0000    0.0000 O.3     1 HOH  -0.8340\n'
+                       '      8 HW1    0.9572    0.0000    0.0000 H       1 HOH   0.4170\n'
+                       '      9 HW2   -0.2400    0.9266    0.0000 H       1 HOH   0.4170\n'
+                       '@<TRIPOS>BOND\n     1     7     8    1\n     2     7     9    1\n'
+                       '@<TRIPOS>MOLECULE\nchloride\n 1 0 1\nSMALL\nNO_CHARGES\n\n@<TRIPOS>ATOM\n'
+                       '      1 CL     0.0000    0.0000    0.0000 Cl\n')
+
+    @classmethod
+    def tearDownClass(cls):
+
+        chdir(cls.home)
+        cls.temp.cleanup()
+
+    def test_sdf(self):
+
+        records = list(read_molecules('library.sdf'))
+
+        # Molecules without names are named from the file, and repeated names are numbered
+        self.assertEqual(['methanol', 'library_2', 'methanol_2'], [record.name for record in records])
+        self.assertEqual([6, 5, 6], [len(record) for record in records])
+        self.assertEqual([0, -1, 0], [record.charge for record in records])
+        self.assertEqual(['C1', 'O1', 'H1', 'H2', 'H3', 'H4'], records[0].names.tolist())
+        self.assertEqual([[1, 2], [1, 3], [1, 4], [1, 5], [2, 6]], records[0].bonds.tolist())
+        self.assertTrue(allclose([0.979, -1.036, 0.0], records[0].coords[5]))
+
+    def test_mol2(self):
+
+        water, chloride = read_molecules('library.mol2')
+
+        self.assertEqual(['O', 'H', 'H'], water.elements.tolist())
+        self.assertEqual(['OW', 'HW1', 'HW2'], water.names.tolist())
+        self.assertEqual([[1, 2], [1, 3]], water.bonds.tolist())
+        self.assertEqual(0, water.charge)
+        self.assertEqual(['Cl'], chloride.elements.tolist())
+        self.assertIsNone(chloride.charge)
+
+    def test_ligands(self):
+
+        # Ligands are built one at a time with their topology from the bond table
+        ligands = read_ligands('library.sdf')
+        methanol = next(ligands)
+
+        self.assertEqual('methanol', methanol.name)
+        self.assertEqual([(1, 2), (1, 3), (1, 4), (1, 5), (2, 6)], list(methanol.topology.edges))
+        self.assertEqual(3, len(methanol.dih_phis))
+        self.assertEqual(-1, next(ligands).charge)
+
+        with self.assertRaises(ValueError):
+            read_molecules('library.xyz')
+
+    def test_smiles(self):
+
+        # The unclosed ring cannot be read, so it is skipped rather than ending the library
+        with open('library.smi', 'w+') as smi:
+            smi.write('# SMILES name\nCO methanol\n\nC1CC broken\n[O-]C\n')
+
+        records = list(read_molecules('library.smi'))
+
+        self.assertEqual(['methanol', 'library_2'], [record.name for record in records])
+        self.assertEqual([6, 5], [len(record) for record in records])
+        self.assertEqual([0, -1], [record.charge for record in records])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,196 @@
+from QUBEKit.topology import Topology, canonical_ranks, conflicting_terms, find_bridges, index_torsions, \
+    refine_colours, symmetry_classes, term_tuples
+
+from networkx import Graph, cycle_graph, has_path, neighbors, path_graph
+
+import unittest
+
+
+class TestBridges(unittest.TestCase):
+
+    def setUp(self):
+
+        # A six membered ring joined through a two bond linker to a three membered ring, plus a separate fragment
+        self.graph = cycle_graph(range(1, 7))
+        self.graph.add_edges_from([(6, 7), (7, 8), (8, 9), (9, 10), (10, 8), (11, 12)])
+
+    def test_ring_bonds_are_not_bridges(self):
+
+        bridges = find_bridges(self.graph)
+        self.assertEqual({(6, 7), (7, 8), (11, 12)}, {bond for bond in bridges if bond[0] < bond[1]})
+
+        # Both orientations are returned
+        self.assertIn((7, 6), bridges)
+
+    def test_matches_path_search(self):
+
+        edges = list(self.graph.edges)
+        bridges = find_bridges(self.graph.adj)
+
+        for edge in edges:
+            self.graph.remove_edge(*edge)
+            self.assertEqual(not has_path(self.graph, *edge), edge in bridges)
+            self.graph.add_edge(*edge)
+
+    def test_long_chain(self):
+
+        # Deeper than the default recursion limit
+        chain = Graph()
+        chain.add_edges_from((i, i + 1) for i in range(5000))
+
+        self.assertEqual(2 * 5000, len(find_bridges(chain)))
+
+
+class TestTopology(unittest.TestCase):
+
+    def setUp(self):
+
+        # Methyl acetate like heavy atom skeleton with a ring fused on and atoms added out of order
+        self.edges = [(1, 2), (2, 3), (2, 4), (4, 5), (5, 6), (6, 7), (7, 8), (8, 5), (3, 9), (2, 1), (10, 6)]
+        self.graph = Graph()
+        self.graph.add_nodes_from(range(1, 10))
+        self.graph.add_edges_from(self.edges)
+
+    def test_matches_networkx(self):
+
+        topology = Topology.from_graph(self.graph)
+
+        self.assertEqual(list(self.graph.edges), term_tuples(topology.edges()))
+        self.assertEqual([len(self.graph.adj[node]) for node in self.graph], topology.degrees.tolist())
+        self.assertEqual(list(self.graph.adj[5]), topology.neighbours_of(5).tolist())
+
+        angles = [(bonded[i], node, bonded[j]) for node in self.graph for bonded in [sorted(neighbors(self.graph, node))]
+                  for i in range(len(bonded)) for j in range(i + 1, len(bonded))]
+        self.assertEqual(angles, term_tuples(topology.angles()))
+
+        impropers = [(node, *sorted(neighbors(self.graph, node))) for node in self.graph
+                     if len(self.graph.adj[node]) == 3]
+        self.assertEqual(impropers, term_tuples(topology.impropers()))
+
+        dihedrals = [(start, b, c, end) for b, c in self.graph.edges for start in neighbors(self.graph, b)
+                     for end in neighbors(self.graph, c) if start not in (b, c) and end not in (b, c)]
+        found, central = topology.dihedrals()
+        self.assertEqual(dihedrals, term_tuples(found))
+        self.assertTrue(all(bond[1:3] == edge for bond, edge in
+                            zip(term_tuples(found), [term_tuples(topology.edges())[i] for i in central])))
+
+    def test_from_edges(self):
+
+        # The same adjacency order as networkx, without building a graph
+        topology = Topology.from_edges(self.edges, range(1, 10))
+
+        self.assertEqual(list(self.graph), topology.nodes.tolist())
+        self.assertEqual(list(self.graph.edges), term_tuples(topology.edges()))
+        self.assertEqual([list(self.graph.adj[node]) for node in self.graph],
+                         [topology.neighbours_of(node).tolist() for node in self.graph])
+        self.assertEqual(sorted(self.graph.edges), sorted(topology.graph.edges))
+
+
+class TestTypeClasses(unittest.TestCase):
+
+    def test_refine_colours(self):
+
+        # Propane: the end carbons are alike, the middle one is not
+        propane = Graph([(1, 2), (2, 3), (1, 4), (1, 5), (1, 6), (2, 7), (2, 8), (3, 9), (3, 10), (3, 11)])
+        topology = Topology.from_graph(propane)
+        elements = [0 if node <= 3 else 1 for node in topology.nodes.tolist()]
+
+        colours = refine_colours(topology, elements)
+        first = dict(zip(topology.nodes.tolist(), colours.tolist()))
+        self.assertEqual(first[1], first[3])
+        self.assertNotEqual(first[1], first[2])
+        self.assertEqual(first[4], first[7])
+
+        # The hydrogens only see the difference between the carbons in the next round
+        second = dict(zip(topology.nodes.tolist(), refine_colours(topology, colours).tolist()))
+        self.assertEqual(second[4], second[9])
+        self.assertNotEqual(second[4], second[7])
+
+    def test_symmetry_classes(self):
+
+        # Isobutanol skeleton: the two methyl carbons are alike, and so are the hydrogens on each of them
+        graph = Graph([(1, 2), (2, 3), (2, 4), (4, 5), (1, 6), (1, 7), (1, 8), (3, 9), (3, 10), (3, 11), (5, 12)])
+        topology = Topology.from_graph(graph)
+        elements = [0 if node <= 4 else 1 if node == 5 else 2 for node in topology.nodes.tolist()]
+
+        classes = dict(zip(topology.nodes.tolist(), symmetry_classes(topology, elements).tolist()))
+        self.assertEqual(classes[1], classes[3])
+        self.assertEqual({classes[6]}, {classes[node] for node in (6, 7, 8, 9, 10, 11)})
+        self.assertEqual(6, len(set(classes.values())))
+
+        # The same classes as refining one round at a time until nothing changes
+        colours = refine_colours(topology, elements)
+        while len(set(refine_colours(topology, colours).tolist())) > len(set(colours.tolist())):
+            colours = refine_colours(topology, colours)
+        self.assertEqual(len(set(colours.tolist())), len(set(classes.values())))
+
+    def test_long_chain_symmetry(self):
+
+        # Each end of a chain is only told apart from the middle one bond further in each round
+        topology = Topology.from_graph(path_graph(range(1, 2002)))
+        classes = symmetry_classes(topology, [0] * 2001).tolist()
+
+        self.assertEqual(1001, len(set(classes)))
+        self.assertEqual(classes[:1000], classes[:1000:-1])
+
+    def test_canonical_ranks(self):
+
+        # Toluene carbons: the ring carbons pair off by symmetry, so they must be set apart to rank every atom
+        edges = [(1, 2), (2, 3), (3, 4), (4, 5), (5, 6), (6, 1), (1, 7)]
+        topology = Topology.from_graph(Graph(edges))
+        ranks = canonical_ranks(topology, [0] * 7)
+        self.assertEqual(list(range(7)), sorted(ranks.tolist()))
+
+        # Any other atom order gives the same bonds once relabelled by rank
+        relabel = {1: 5, 2: 7, 3: 1, 4: 3, 5: 6, 6: 2, 7: 4}
+        shuffled = Topology.from_graph(Graph([(relabel[a], relabel[b]) for a, b in edges[::-1]]))
+        shuffled_ranks = canonical_ranks(shuffled, [0] * 7)
+
+        def relabelled(top, atom_ranks):
+            return sorted(tuple(sorted(atom_ranks[top.positions[[a, b]]].tolist())) for a, b in top.edges())
+
+        self.assertEqual(relabelled(topology, ranks), relabelled(shuffled, shuffled_ranks))
+        self.assertEqual(ranks[topology.positions[7]], shuffled_ranks[shuffled.positions[4]])
+
+        # Ties follow the values given rather than the atom order
+        tied = canonical_ranks(Topology.from_graph(Graph([(1, 2), (1, 3)])), [0, 1, 1], ties=[0.0, 2.0, 1.0])
+        self.assertEqual([0, 2, 1], tied.tolist())
+
+    def test_conflicting_terms(self):
+
+        # Bonds between classes 0 and 1 are matched either way round so must share their parameters
+        classes = [0, 1, 1, 0]
+        bonds = [(0, 1), (2, 3), (0, 2)]
+        self.assertEqual([False] * 3, conflicting_terms(classes, bonds, [5, 5, 5]).tolist())
+        self.assertEqual([True, True, True], conflicting_terms(classes, bonds, [5, 6, 5]).tolist())
+        self.assertEqual([True, True, True], conflicting_terms(classes, bonds, [5, -1, 5]).tolist())
+
+        # Impropers match the outer atoms in any order, but the order they were given in decides the energy
+        classes = [0, 1, 2, 3, 0, 1, 2, 3]
+        self.assertFalse(conflicting_terms(classes, [(0, 1, 2, 3), (4, 5, 6, 7)], [1, 1], True).any())
+        self.assertTrue(conflicting_terms(classes, [(0, 1, 2, 3), (4, 6, 5, 7)], [1, 1], True).all())
+        self.assertTrue(conflicting_terms([0, 1, 1, 2], [(0, 1, 2, 3)], [1], True).all())
+        self.assertFalse(conflicting_terms([0, 1, 1, 2], [(0, 1, 2, 3)], [-1], True).any())
+
+    def test_index_torsions(self):
+
+        # Repeats and reversed torsions share a term, kept in the order and direction they first appear
+        torsions = [(3, 2, 1, 0), (1, 2, 3, 4), (0, 1, 2, 3), (3, 2, 1, 0), (2, 0, 5, 6), (6, 0, 2, 5)]
+        impropers = [(2, 1, 3, 4), (0, 2, 5, 6), (7, 8, 9, 10)]
+        terms, rows, improper, sources = index_torsions(torsions, impropers)
+
+        self.assertEqual([[3, 2, 1, 0], [1, 2, 3, 4], [2, 0, 5, 6], [6, 0, 2, 5]], terms.tolist())
+        self.assertEqual([0, 1, 0, 0, 2, 3], rows.tolist())
+
+        # Impropers match torsions over the same atoms in any order, taking the last of them
+        self.assertEqual([False, True, True, True], improper.tolist())
+        self.assertEqual([1, 3, -1], sources.tolist())
+
+        terms, rows, improper, sources = index_torsions(torsions[:1], [])
+        self.assertEqual(([[3, 2, 1, 0]], [0], [False], []), (terms.tolist(), rows.tolist(), improper.tolist(),
+                                                             sources.tolist()))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
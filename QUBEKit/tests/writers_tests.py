@@ -0,0 +1,156 @@
+from QUBEKit.ligand import Ligand
+from QUBEKit.parameters import AngleTable, BondTable, NonbondedTable, TorsionTable
+from QUBEKit.topology import Topology
+from QUBEKit.writers import XMLWriter, conect_records, format_rows
+
+from collections import OrderedDict
+from copy import deepcopy
+from io import StringIO
+from networkx import Graph
+from os import chdir, getcwd
+from tempfile import TemporaryDirectory
+from xml.dom.minidom import parseString
+from xml.etree.ElementTree import parse, tostring
+
+import unittest
+
+
+class TestXMLWriter(unittest.TestCase):
+
+    def test_layout(self):
+
+        output = StringIO()
+        writer = XMLWriter(output, buffer_lines=2)
+        writer.start('ForceField', {})
+        writer.start('AtomTypes', {})
+        writer.start('Type', {'name': 'a"b', 'class': '<&>'})
+        writer.end('Type')
+        writer.end('AtomTypes')
+        writer.start('HarmonicBondForce', {})
+        writer.end('HarmonicBondForce')
+        writer.end('ForceField')
+        writer.close()
+
+        self.assertEqual('<?xml version="1.0" ?>\n<ForceField>\n<AtomTypes>\n'
+                         '<Type name="a&quot;b" class="&lt;&amp;&gt;"/>\n</AtomTypes>\n'
+                         '<HarmonicBondForce/>\n</ForceField>\n', output.getvalue())
+
+    def test_unbalanced(self):
+
+        writer = XMLWriter(StringIO())
+        writer.start('ForceField', {})
+
+        with self.assertRaises(ValueError):
+            writer.end('AtomTypes')
+
+        with self.assertRaises(ValueError):
+            writer.close()
+
+
+class TestBulkFormatters(unittest.TestCase):
+
+    def test_format_rows(self):
+
+        elements = ['C', 'Cl', 'H']
+        coords = [[0.0, -0.0, 1.23456789], [-12.3456, 0.0005, 100.0], [1e-12, -0.0015, 7.0]]
+
+        expected = ''.join(f'{element:2} {x: .3f}{y:8.3f}{z: .10f}\n' for element, (x, y, z) in zip(elements, coords))
+        self.assertEqual(expected, format_rows('%-2s % .3f%8.3f% .10f\n', elements, *zip(*coords)))
+        self.assertEqual('', format_rows('%d\n', []))
+
+    def test_conect_records(self):
+
+        # Atoms with a single bond get no record of their own; neighbours are listed in label order
+        graph = Graph([(1, 2), (2, 3), (2, 4), (4, 5), (3, 5), (5, 6)])
+        topology = Topology.from_graph(graph)
+
+        self.assertEqual('CONECT    2    1    3    4\nCONECT    3    2    5\n'
+                         'CONECT    4    2    5\nCONECT    5    3    4    6\n', conect_records(topology))
+        self.assertEqual(6, len(conect_records(topology, min_bonds=1).splitlines()))
+
+
+class TestWriteParameters(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.home = getcwd()
+        cls.temp = TemporaryDirectory()
+        chdir(cls.temp.name)
+
+        with open('methanol.pdb', 'w+') as pdb:
+            pdb.write('HETATM    1  C1  UNL     1      -0.047   0.665   0.000  1.00  0.00           C\n'
+                      'HETATM    2  O1  UNL     1       0.047  -0.758   0.000  1.00  0.00           O\n'
+                      'HETATM    3  H1  UNL     1      -1.103   0.978   0.000  1.00  0.00           H\n'
+                      'HETATM    4  H2  UNL     1       0.438   1.084   0.889  1.00  0.00           H\n'
+                      'HETATM    5  H3  UNL     1       0.438   1.084  -0.889  1.00  0.00           H\n'
+                      'HETATM    6  H4  UNL     1       0.979  -1.036   0.000  1.00  0.00           H\n'
+                      'CONECT    1    2    3    4    5\nCONECT    2    1    6\nEND\n')
+
+        # A made up parameter set in the form the parametrisation classes store it
+        molecule = Ligand('methanol.pdb')
+        molecule.AtomTypes = OrderedDict((i, [name, f'QUBE_{800 + i}', f'C{800 + i}'])
+                                         for i, name in enumerate(molecule.atom_names))
+        molecule.HarmonicBondForce = BondTable(((a - 1, b - 1), [0.14, 300000.0])
+                                               for a, b in molecule.topology.edges)
+        molecule.HarmonicAngleForce = AngleTable((tuple(i - 1 for i in angle), [1.91, 400.0])
+                                                 for angle in molecule.angles)
+        molecule.PeriodicTorsionForce = TorsionTable(
+            (tuple(i - 1 for i in torsion), [[1, 0.5, 0], [2, 0, 3.14], [3, 0.1, 0], [4, 0, 3.14]])
+            for torsions in molecule.dihedrals.values() for torsion in torsions)
+        molecule.NonbondedForce = NonbondedTable((i, [-0.1, 0.3, 0.2]) for i in range(len(molecule.atom_names)))
+        molecule.sites = OrderedDict([(0, [(1, 0, 5), (0.1, 0.2, 0.3), -0.25])])
+        molecule.AtomTypes[2][0] = 'H&1'
+
+        cls.molecule = molecule
+
+    @classmethod
+    def tearDownClass(cls):
+
+        chdir(cls.home)
+        cls.temp.cleanup()
+
+    def test_matches_tree(self):
+
+        # The streamed file is the same as the pretty printed tree it replaced
+        self.molecule.write_parameters(name='methanol')
+        self.molecule.build_tree(protein=False)
+        expected = parseString(tostring(self.molecule.xml_tree.getroot(), 'utf-8')).toprettyxml(indent='')
+
+        with open('methanol.xml') as xml_doc:
+            self.assertEqual(expected, xml_doc.read())
+
+    def read_collapsed(self, molecule):
+        """Write the collapsed xml and return the class of each atom and the bonds by class."""
+
+        molecule.write_parameters(name='collapsed', collapse=True)
+        root = parse('collapsed.xml').getroot()
+
+        type_classes = {atom_type.get('name'): atom_type.get('class') for atom_type in root.iter('Type')}
+        classes = [type_classes[atom.get('type')] for atom in root.find('Residues/Residue').iter('Atom')]
+        bonds = {(bond.get('class1'), bond.get('class2')): bond.get('length')
+                 for bond in root.find('HarmonicBondForce').iter('Bond')}
+
+        return classes, bonds
+
+    def test_collapsed(self):
+
+        # With the same parameters on every hydrogen there are C, O and H types plus the virtual site
+        classes, bonds = self.read_collapsed(self.molecule)
+        self.assertEqual(4, len(set(classes)))
+        self.assertEqual(3, len(bonds))
+        self.assertEqual(classes[2], classes[5])
+
+        # One different C-H bond means the methyl hydrogens can no longer share a class
+        molecule = deepcopy(self.molecule)
+        molecule.HarmonicBondForce[(0, 2)] = [0.11, 300000.0]
+        classes, bonds = self.read_collapsed(molecule)
+
+        for (first, second), val in molecule.HarmonicBondForce.items():
+            key = (classes[first], classes[second])
+            self.assertEqual(val[0], float(bonds.get(key, bonds.get(key[::-1]))))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,553 @@
+#!/usr/bin/env python
+
+"""
+Graph algorithms on the molecule topology which scale linearly with the number of atoms and bonds,
+for use on large flexible molecules and proteins.
+"""
+
+from numpy import add, arange, array, asarray, bincount, column_stack, concatenate, cumsum, diff, empty, flatnonzero, \
+    fromiter, full, int64, lexsort, maximum, repeat, sort, triu_indices, unique, where, zeros
+from networkx import Graph
+
+from functools import wraps
+from itertools import chain, count
+
+
+# Every change to the atoms or bonds of a BondGraph takes the next of these as its version
+versions = count(1)
+
+
+def label_positions(nodes):
+    """Look up array from (non negative integer) node label to position in nodes; -1 for missing labels."""
+
+    positions = full(nodes.max() + 1 if len(nodes) else 0, -1, dtype=int64)
+    positions[nodes] = arange(len(nodes))
+
+    return positions
+
+
+def find_bridges(adjacency):
+    """
+    Find every bridge of the graph in one depth first pass (Tarjan's low link method), O(V + E).
+    A bridge is a bond whose removal splits the molecule in two, i.e. a bond which is not in any ring;
+    these are exactly the rotatable central bonds of torsions.
+    The graph is not changed.
+
+    adjacency       Mapping of each node to its neighbours, e.g. a networkx Graph or Graph.adj
+    Returns a set of the bridges containing both orientations of each bond, (a, b) and (b, a),
+    so keys from any edge list can be looked up directly.
+    """
+
+    # Depth first discovery order of each node and the lowest order reachable from its subtree with one back edge
+    order, low = {}, {}
+    bridges = set()
+
+    for root in adjacency:
+        if root in order:
+            continue
+
+        order[root] = low[root] = len(order)
+        # An explicit stack rather than recursion so long chains do not hit the recursion limit
+        stack = [(root, None, iter(adjacency[root]))]
+
+        while stack:
+            node, parent, neighbours = stack[-1]
+
+            for neighbour in neighbours:
+                if neighbour == parent:
+                    continue
+
+                if neighbour in order:
+                    # Back edge to a node higher up the tree
+                    low[node] = min(low[node], order[neighbour])
+
+                else:
+                    order[neighbour] = low[neighbour] = len(order)
+                    stack.append((neighbour, node, iter(adjacency[neighbour])))
+                    break
+
+            else:
+                # All neighbours are done; pass the low link up to the parent
+                stack.pop()
+                if parent is not None:
+                    low[parent] = min(low[parent], low[node])
+
+                    # Nothing below node can reach back above it except through this bond
+                    if low[node] > order[parent]:
+                        bridges.update(((parent, node), (node, parent)))
+
+    return bridges
+
+
+def term_tuples(terms):
+    """List of tuples (the form the Molecule term lists use) from an (n, k) integer array."""
+
+    return list(zip(*terms.T.tolist())) if len(terms) else []
+
+
+def group_dihedrals(dihedrals):
+    """
+    Dictionary of dihedral tuples stored under their central bond (the middle two atoms), as Molecule.dihedrals,
+    from a (D, 4) array in which the dihedrals about each bond are next to each other.
+    """
+
+    central = dihedrals[:, 1:3]
+    starts = concatenate([[0], (central[1:] != central[:-1]).any(axis=1).nonzero()[0] + 1]).tolist()
+    ends = starts[1:] + [len(dihedrals)]
+    dihedrals = term_tuples(dihedrals)
+
+    return {dihedrals[start][1:3]: dihedrals[start:end] for start, end in zip(starts, ends) if end > start}
+
+
+def refine_colours(topology, colours):
+    """
+    One round of colour refinement (the Weisfeiler-Lehman test) on a Topology.
+    colours are integer labels of the atoms by position; two atoms keep the same colour only if they had the same
+    colour and their neighbours have the same colours, counting repeats. Returns the new colours (counted from 0).
+    """
+
+    colours = asarray(colours, dtype=int64)
+    if not len(topology):
+        return colours
+
+    # One row per atom: its colour then its sorted neighbour colours, padded with -1
+    table = full((len(topology), int(topology.degrees.max()) + 1), -1, dtype=int64)
+    table[:, 0] = colours
+
+    rows = topology.rows()
+    neighbour_colours = colours[topology.neighbours]
+    order = lexsort((neighbour_colours, rows))
+    table[rows, 1 + arange(len(rows)) - topology.offsets[rows]] = neighbour_colours[order]
+
+    return unique(table, axis=0, return_inverse=True)[1].ravel()
+
+
+def symmetry_classes(topology, colours, splitters=None):
+    """
+    Refine colours on a Topology until no class splits: the end point of repeating refine_colours, where every atom
+    of a class has the same number of neighbours in each class. colours are integer labels of the atoms by position,
+    e.g. their elements; atoms swapped by a symmetry of the molecule always end in the same class.
+    If the colours are already refined apart from a few atoms moved into new classes of their own, only those
+    atoms need to be split on (splitters, positions; default every atom).
+
+    Classes are split the way Hopcroft's partition refinement does it, so that no round needs the whole molecule:
+    each round only the atoms bonded to the parts which split in the round before are hashed, on the classes of
+    those neighbours, and one part of every split class (the largest, or the untouched rest) is never needed,
+    as its atoms' counts follow from the others. The work is about (bonds) x log(atoms) however many rounds it takes,
+    so long chains (a round per bond) and large proteins are handled in near linear time.
+    Returns the classes, counted from 0.
+    """
+
+    colours = unique(asarray(colours, dtype=int64), return_inverse=True)[1].ravel()
+
+    count = int(colours.max()) + 1 if len(colours) else 0
+    sizes = zeros(len(colours), dtype=int64)
+    sizes[:count] = bincount(colours)
+
+    # At first split on every class, after that on the new parts
+    splitters = arange(len(colours)) if splitters is None else asarray(splitters, dtype=int64)
+    while len(splitters):
+
+        # Every bond from a splitter atom: the atom it reaches and the class of the splitter
+        degrees = topology.degrees[splitters]
+        rows = repeat(arange(len(splitters)), degrees)
+        entries = arange(len(rows)) - (cumsum(degrees) - degrees)[rows]
+        reached = topology.neighbours[topology.offsets[splitters][rows] + entries]
+        keys = colours[splitters][rows]
+        if not len(reached):
+            break
+
+        # One row per reached atom: its class then the sorted classes of its splitter neighbours, padded with -1
+        order = lexsort((keys, reached))
+        keys, reached = keys[order], reached[order]
+        touched, starts, counts = unique(reached, return_index=True, return_counts=True)
+        rows = repeat(arange(len(touched)), counts)
+
+        table = full((len(touched), counts.max() + 1), -1, dtype=int64)
+        table[:, 0] = colours[touched]
+        table[rows, 1 + arange(len(reached)) - starts[rows]] = keys
+
+        # Groups of touched atoms alike; they come out sorted by their old class
+        groups, inverse = unique(table, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        group_sizes = bincount(inverse)
+        classes, first, group_counts = unique(groups[:, 0], return_index=True, return_counts=True)
+        group_class = repeat(arange(len(classes)), group_counts)
+        rest = sizes[classes] - add.reduceat(group_sizes, first)
+
+        # The untouched rest of a class keeps its label, or if all of it was touched, its first group does
+        keep = zeros(len(groups), dtype=bool)
+        keep[first] = rest == 0
+        labels = where(keep, groups[:, 0], count + cumsum(~keep) - 1)
+        count += int((~keep).sum())
+
+        colours[touched] = labels[inverse]
+        sizes[labels] = group_sizes
+        sizes[classes] = where(rest > 0, rest, sizes[classes])
+
+        # Split on every new part but one per class: the rest where there is one, otherwise the largest group
+        largest = zeros(len(groups), dtype=bool)
+        largest[lexsort((-group_sizes, group_class))[first]] = True
+        split = (group_counts > 1) | (rest > 0)
+        use = split[group_class] & ~(largest & (rest == 0)[group_class])
+        splitters = touched[use[inverse]]
+
+    return unique(colours, return_inverse=True)[1].ravel()
+
+
+def canonical_ranks(topology, colours, ties=None):
+    """
+    Canonical position of each atom of a Topology, from the bonds and integer colours (e.g. elements) by position:
+    the same molecule given with its atoms in any order has the same atoms at each canonical position,
+    up to its symmetry, so it has the same bonds and colours once relabelled by rank.
+
+    Atoms are ranked by their symmetry class. While atoms other than leaves (like hydrogens) still share a class,
+    one atom of the lowest such class is set apart in a class of its own and the classes are refined again;
+    as the atoms of a class can be swapped by a symmetry of the molecule, which one is set apart does not matter
+    to the relabelled bonds. Leaves left sharing a class are bonded to the same atom (or to nothing).
+    Atoms alike are taken in the order given, or by ties first if given: an (N,) or (N, k) array by position,
+    e.g. rounded coordinates, so that the ranks of a symmetric molecule also follow its geometry.
+    Some very regular ring systems have atoms in one class which are not swapped by a symmetry; they may be ranked
+    differently in different atom orders, though two different molecules are never given the same relabelled bonds.
+    Returns the ranks, counted from 0.
+    """
+
+    classes = symmetry_classes(topology, colours)
+    if not len(classes):
+        return classes
+
+    # Sort keys of the atoms when alike, last key first as lexsort takes them
+    keys = [arange(len(classes))]
+    if ties is not None:
+        ties = asarray(ties).reshape(len(classes), -1)
+        keys += [ties[:, column] for column in range(ties.shape[1] - 1, -1, -1)]
+
+    # Atoms which can be swapped whenever they share a class: lone atoms and the leaves of a larger atom
+    leaves = flatnonzero(topology.degrees == 1)
+    loose = topology.degrees == 0
+    loose[leaves] = topology.degrees[topology.neighbours[topology.offsets[leaves]]] > 1
+
+    while True:
+        sizes = bincount(classes)
+        tied = flatnonzero(~loose & (sizes[classes] > 1))
+        if not len(tied):
+            break
+
+        # Set apart the first atom of the lowest tied class and refine from there
+        tied = tied[classes[tied] == classes[tied].min()]
+        atom = tied[lexsort([key[tied] for key in keys])[0]]
+        classes = classes.copy()
+        classes[atom] = len(sizes)
+        classes = symmetry_classes(topology, classes, [atom])
+
+    ranks = empty(len(classes), dtype=int64)
+    ranks[lexsort(keys + [classes])] = arange(len(classes))
+
+    return ranks
+
+
+def chain_keys(terms):
+    """
+    Each (T, k) term of a chain (bond, angle or proper torsion) in whichever direction is lexicographically smaller,
+    so a term has the same key whichever way round it is given.
+    """
+
+    terms = asarray(terms, dtype=int64)
+    reverse = terms[:, ::-1]
+    differ = terms != reverse
+    first = differ.argmax(axis=1)
+    rows = arange(len(terms))
+    flip = differ.any(axis=1) & (reverse[rows, first] < terms[rows, first])
+
+    return where(flip[:, None], reverse, terms)
+
+
+def index_torsions(torsions, impropers):
+    """
+    Index torsions given in any direction, and repeated (e.g. once per periodicity as in an OpenMM force),
+    by hashing direction independent keys rather than searching for each torsion in both directions;
+    then match them to impropers by their atoms (any order) in the same way. All the work is sorting.
+
+    torsions        (T, 4) atoms of each torsion
+    impropers       (I, 4) atoms of each improper, centre first
+
+    Returns
+        terms       (U, 4) each distinct torsion in the order and direction it first appears
+        rows        (T,) the term of each torsion
+        improper    (U,) bool marking the terms over the atoms of an improper
+        sources     (I,) the last term over the atoms of each improper, -1 if there is none
+    """
+
+    torsions = asarray(torsions, dtype=int64).reshape(-1, 4)
+    impropers = asarray(impropers, dtype=int64).reshape(-1, 4)
+
+    # Keys in the order they first appear
+    firsts, inverse = unique(chain_keys(torsions), axis=0, return_index=True, return_inverse=True)[1:]
+    order = firsts.argsort()
+    position = empty(len(order), dtype=int64)
+    position[order] = arange(len(order))
+    terms = torsions[firsts[order]]
+
+    # An improper is the same four atoms in any order
+    atoms = unique(sort(concatenate([terms, impropers]), axis=1), axis=0, return_inverse=True)[1].ravel()
+    term_atoms, improper_atoms = atoms[:len(terms)], atoms[len(terms):]
+
+    improper = zeros(len(atoms), dtype=bool)
+    improper[improper_atoms] = True
+    last = full(len(atoms), -1, dtype=int64)
+    maximum.at(last, term_atoms, arange(len(terms)))
+
+    return terms, position[inverse.ravel()], improper[term_atoms], last[improper_atoms]
+
+
+def conflicting_terms(classes, terms, values, improper=False):
+    """
+    Find the bonded terms which cannot be written by atom class, as OpenMM's ForceField matches them.
+
+    classes         (N,) integer class of each atom
+    terms           (T, k) atom indices of the terms
+    values          (T,) integer id of the parameters of each term; terms with different parameters have different ids
+                    and terms with no parameters (which OpenMM must not match) are given -1
+    improper        Terms are impropers (centre first, the other three atoms matched in any order)
+                    rather than chains (bonds, angles and propers, matched in either direction)
+
+    Returns a (T,) bool array marking the terms whose class key is shared with a term with other parameters.
+    Parametrised impropers are also marked if their outer classes repeat, as then the atom order OpenMM picks
+    is ambiguous.
+    """
+
+    terms, values = asarray(terms, dtype=int64), asarray(values, dtype=int64)
+    if not len(terms):
+        return zeros(0, dtype=bool)
+
+    keys = asarray(classes)[terms]
+
+    if improper:
+        outer = sort(keys[:, 1:], axis=1)
+        ambiguous = (outer[:, 1:] == outer[:, :-1]).any(axis=1) & (values >= 0)
+        # The order of the classes decides which atom goes where, so it is part of the parameters
+        values = unique(column_stack([values, keys]), axis=0, return_inverse=True)[1].ravel()
+        keys = column_stack([keys[:, :1], outer])
+
+    else:
+        keys = chain_keys(keys)
+        ambiguous = zeros(len(keys), dtype=bool)
+
+    groups = unique(keys, axis=0, return_inverse=True)[1].ravel()
+
+    # Groups holding more than one distinct parameter set
+    pairs = unique(column_stack([groups, values]), axis=0)
+    bad = bincount(pairs[:, 0], minlength=groups.max() + 1) > 1
+    bad[groups[ambiguous]] = True
+
+    return bad[groups]
+
+
+def changes_graph(method):
+    """Wrap a networkx Graph method which adds or removes atoms or bonds so the graph gets a new version."""
+
+    @wraps(method)
+    def changed(graph, *args, **kwargs):
+
+        method(graph, *args, **kwargs)
+        graph.version = next(versions)
+
+    return changed
+
+
+class BondGraph(Graph):
+    """
+    networkx Graph of the molecule topology which carries a version, given a new value whenever atoms or bonds
+    are added or removed (including a bond being moved while the counts stay the same).
+    Values worked out from the topology are checked against the version rather than against the whole graph.
+    """
+
+    def __init__(self, incoming_graph_data=None, **attr):
+
+        self.version = next(versions)
+        super().__init__(incoming_graph_data, **attr)
+
+    add_node = changes_graph(Graph.add_node)
+    add_nodes_from = changes_graph(Graph.add_nodes_from)
+    remove_node = changes_graph(Graph.remove_node)
+    remove_nodes_from = changes_graph(Graph.remove_nodes_from)
+    add_edge = changes_graph(Graph.add_edge)
+    add_edges_from = changes_graph(Graph.add_edges_from)
+    remove_edge = changes_graph(Graph.remove_edge)
+    remove_edges_from = changes_graph(Graph.remove_edges_from)
+    clear = changes_graph(Graph.clear)
+    clear_edges = changes_graph(Graph.clear_edges)
+
+
+class Topology:
+    """
+    Compact (CSR) adjacency of the molecule topology, for enumerating bonded terms of large molecules
+    with numpy rather than per node networkx neighbors() calls.
+
+    Atoms are stored by position 0 .. N-1; node labels (counted from 1 in QUBEKit) are kept in nodes.
+    The neighbours of the atom at position i are neighbours[offsets[i]:offsets[i + 1]] (positions),
+    in the same order as the networkx adjacency, so every enumeration below comes out in exactly the order
+    the networkx based loops produce. All enumerations return integer arrays of node labels.
+
+    Build with from_graph (from the networkx topology) or from_edges (from a bond array, e.g. PDBFile.bonds).
+    The networkx graph is kept, or built on request, as graph for code which still needs it.
+    """
+
+    def __init__(self, nodes, offsets, neighbours, graph=None):
+
+        self.nodes = asarray(nodes, dtype=int64)
+        self.offsets = asarray(offsets, dtype=int64)
+        self.neighbours = asarray(neighbours, dtype=int64)
+        self.positions = label_positions(self.nodes)
+        self._graph = graph
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(atoms={len(self)}, bonds={len(self.edges())})'
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @classmethod
+    def from_graph(cls, graph):
+        """Build from a networkx Graph with integer node labels, keeping its node and neighbour order."""
+
+        if not len(graph):
+            return cls([], [0], [], graph)
+
+        # adjacency() gives the plain neighbour dicts, which are much quicker to walk than the adj views
+        nodes, adjacency = zip(*graph.adjacency())
+        nodes = array(nodes, dtype=int64)
+        degrees = fromiter(map(len, adjacency), dtype=int64, count=len(nodes))
+        labels = fromiter(chain.from_iterable(adjacency), dtype=int64, count=int(degrees.sum()))
+
+        return cls(nodes, concatenate([[0], cumsum(degrees)]), label_positions(nodes)[labels], graph)
+
+    @classmethod
+    def from_edges(cls, edges, nodes=None):
+        """
+        Build from an (E, 2) array of bonded node labels, as networkx would build a Graph by adding
+        the nodes (default: every label in edges, in order of appearance) and then the edges in order.
+        Repeated bonds are ignored after their first appearance, as in networkx.
+        """
+
+        edges = asarray(edges, dtype=int64).reshape(-1, 2)
+        if nodes is None:
+            nodes = edges.ravel()
+        # Add any labels missing from nodes in the order they first appear in edges, as add_edge would
+        nodes = concatenate([asarray(nodes, dtype=int64), edges.ravel()])
+        nodes = nodes[sort(unique(nodes, return_index=True)[1])]
+
+        edges = label_positions(nodes)[edges]
+
+        # Keep the first appearance of each bond in either direction
+        ordered = sort(edges, axis=1)
+        edges = edges[sort(unique(ordered[:, 0] * len(nodes) + ordered[:, 1], return_index=True)[1])]
+
+        # Each bond (u, v) puts v after u's earlier neighbours and u after v's; self bonds appear once
+        loops = edges[:, 0] == edges[:, 1]
+        sources = concatenate([edges[:, 0], edges[~loops, 1]])
+        targets = concatenate([edges[:, 1], edges[~loops, 0]])
+        added = concatenate([arange(len(edges)), arange(len(edges))[~loops]])
+        order = lexsort((added, sources))
+
+        offsets = concatenate([[0], cumsum(bincount(sources, minlength=len(nodes)))])
+
+        return cls(nodes, offsets, targets[order])
+
+    @property
+    def graph(self):
+        """networkx Graph of the topology (the one it was built from if there was one)."""
+
+        if self._graph is None:
+            self._graph = BondGraph()
+            self._graph.add_nodes_from(self.nodes.tolist())
+            self._graph.add_edges_from(self.edges().tolist())
+
+        return self._graph
+
+    @property
+    def degrees(self):
+        """Number of bonds of each atom."""
+
+        return diff(self.offsets)
+
+    def rows(self):
+        """Position of the atom which owns each entry of neighbours."""
+
+        return repeat(arange(len(self)), self.degrees)
+
+    def neighbours_of(self, node):
+        """Bonded node labels of one node, in adjacency order."""
+
+        position = self.positions[node]
+        return self.nodes[self.neighbours[self.offsets[position]:self.offsets[position + 1]]]
+
+    def sorted_neighbours(self):
+        """Neighbour positions with each atom's neighbours sorted by node label, like sorted(neighbors(node))."""
+
+        return self.neighbours[lexsort((self.nodes[self.neighbours], self.rows()))]
+
+    def edges(self):
+        """(E, 2) array of the bonds in networkx Graph.edges order."""
+
+        rows = self.rows()
+        # networkx yields each bond from the first of its two atoms in node order
+        first = self.neighbours >= rows
+
+        return self.nodes[column_stack([rows[first], self.neighbours[first]])]
+
+    def angles(self):
+        """
+        (A, 3) array of every angle (a, centre, b), in the order of Molecule.find_angles:
+        centres in node order and, for each centre, all pairs of its sorted neighbours.
+        """
+
+        degrees = self.degrees
+        bonded = self.sorted_neighbours()
+        counts = degrees * (degrees - 1) // 2
+        starts = cumsum(counts) - counts
+
+        angles = empty((int(counts.sum()), 3), dtype=int64)
+
+        # Atoms with the same number of bonds share the same pattern of pairs
+        for degree in unique(degrees[degrees > 1]):
+            centres = (degrees == degree).nonzero()[0]
+            first, second = triu_indices(degree, 1)
+            rows = (starts[centres][:, None] + arange(len(first))).ravel()
+
+            angles[rows, 0] = bonded[(self.offsets[centres][:, None] + first).ravel()]
+            angles[rows, 1] = repeat(centres, len(first))
+            angles[rows, 2] = bonded[(self.offsets[centres][:, None] + second).ravel()]
+
+        return self.nodes[angles]
+
+    def impropers(self):
+        """(I, 4) array of (centre, a, b, c) for every atom with exactly three bonds, neighbours sorted."""
+
+        centres = (self.degrees == 3).nonzero()[0]
+        bonded = self.sorted_neighbours()[(self.offsets[centres][:, None] + arange(3)).ravel()].reshape(-1, 3)
+
+        return self.nodes[column_stack([centres, bonded])]
+
+    def dihedrals(self):
+        """
+        Every proper dihedral (a, b, c, d) about each bond (b, c), in the order of Molecule.find_dihedrals:
+        bonds in networkx edge order, then the neighbours of b and of c in adjacency order.
+        Returns the (D, 4) array of dihedrals and the index into edges() of the central bond of each.
+        """
+
+        edges = self.positions[self.edges()]
+        degrees = self.degrees
+        first, second = edges[:, 0], edges[:, 1]
+
+        # Every (start, end) combination of each bond, then drop any which fold back onto the central bond
+        counts = degrees[first] * degrees[second]
+        bond = repeat(arange(len(edges)), counts)
+        combination = arange(int(counts.sum())) - repeat(cumsum(counts) - counts, counts)
+        start = self.neighbours[self.offsets[first[bond]] + combination // degrees[second[bond]]]
+        end = self.neighbours[self.offsets[second[bond]] + combination % degrees[second[bond]]]
+
+        keep = (start != first[bond]) & (start != second[bond]) & (end != first[bond]) & (end != second[bond])
+        dihedrals = column_stack([start, first[bond], second[bond], end])[keep]
+
+        return self.nodes[dihedrals], bond[keep]
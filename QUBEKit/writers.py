@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+Writers for the files QUBEKit produces: a streaming xml writer, so large molecules never need a full copy
+of the output document in memory, and bulk formatters which turn whole coordinate and bond arrays into text
+in one go rather than with one write per atom.
+"""
+
+from numpy import arange, empty, flatnonzero, ndarray, unique
+
+from itertools import chain
+
+
+def format_rows(template, *columns):
+    """
+    Format whole columns of values into lines of text with a %-style template, returning one string.
+    template is the line for one row with a % field per column, e.g. '%-2s % .3f % .3f % .3f\n';
+    columns are equal length sequences or arrays, so a geometry is written with
+        format_rows(template, geometry.elements, *geometry.coords.T)
+    The rows are formatted by one % operation on the repeated template rather than row by row.
+    The fields behave like the matching f-string formats, so '%5d' is {:5} and '% .10f' is {: .10f}.
+    """
+
+    columns = [column.tolist() if isinstance(column, ndarray) else list(column) for column in columns]
+    if not columns or not columns[0]:
+        return ''
+
+    return (template * len(columns[0])) % tuple(chain.from_iterable(zip(*columns)))
+
+
+def conect_records(topology, min_bonds=2):
+    """
+    PDB CONECT records of a Topology as one string: each atom with at least min_bonds bonds followed by
+    its bonded atoms in label order, in the order of the atoms.
+    Atoms are grouped by their number of bonds so each group is formatted with a single template.
+    """
+
+    degrees = topology.degrees
+    bonded = topology.nodes[topology.sorted_neighbours()]
+
+    records = empty(len(topology), dtype=object)
+    for degree in unique(degrees[degrees >= min_bonds]).tolist():
+        positions = flatnonzero(degrees == degree)
+        neighbours = bonded[topology.offsets[positions][:, None] + arange(degree)]
+        lines = format_rows('CONECT%5d' + '%5d' * degree + '\n', topology.nodes[positions], *neighbours.T)
+        records[positions] = lines.splitlines(keepends=True)
+
+    return ''.join(records[degrees >= min_bonds].tolist())
+
+
+class XMLWriter:
+    """
+    Write an XML document to an open text file as it is built, one element per line.
+
+    Elements are added with the same start(tag, attrs) / end(tag) calls as xml.etree.ElementTree.TreeBuilder,
+    so the code which lays out a document can build either a tree or a file.
+    The output matches minidom's toprettyxml(indent='') of the same tree: an xml declaration, then every
+    tag on its own line, attributes in the order given and elements without children closed as <tag/>.
+
+    Lines are collected and written in blocks of buffer_lines, so memory use stays bounded
+    however large the document is.
+    """
+
+    def __init__(self, file, buffer_lines=10000):
+
+        self.file = file
+        self.buffer_lines = buffer_lines
+
+        self.lines = ['<?xml version="1.0" ?>\n']
+        # Tags of the open elements, innermost last
+        self.open = []
+        # The most recent start tag is held back until we know whether it has children
+        self.pending = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(file={getattr(self.file, "name", self.file)!r})'
+
+    def escape(self, value):
+        """Escape an attribute value the way minidom writes it."""
+
+        return (str(value).replace('&', '&amp;').replace('<', '&lt;')
+                .replace('"', '&quot;').replace('>', '&gt;'))
+
+    def start(self, tag, attrs=None):
+        """Open an element; attrs is a dictionary of attribute values, written in order."""
+
+        self.write_pending()
+
+        attributes = ''.join(f' {key}="{self.escape(value)}"' for key, value in (attrs or {}).items())
+        self.pending = f'<{tag}{attributes}'
+        self.open.append(tag)
+
+    def end(self, tag):
+        """Close the innermost open element, which must be tag."""
+
+        if not self.open or self.open[-1] != tag:
+            raise ValueError(f'Cannot close {tag}; the innermost open element is '
+                             f'{self.open[-1] if self.open else None}.')
+
+        self.open.pop()
+
+        if self.pending is not None:
+            self.lines.append(f'{self.pending}/>\n')
+            self.pending = None
+        else:
+            self.lines.append(f'</{tag}>\n')
+
+        if len(self.lines) >= self.buffer_lines:
+            self.flush()
+
+    def element(self, tag, attrs=None):
+        """Add an element with no children."""
+
+        self.start(tag, attrs)
+        self.end(tag)
+
+    def write_pending(self):
+        """Write the held back start tag as an opening tag now that it has children."""
+
+        if self.pending is not None:
+            self.lines.append(f'{self.pending}>\n')
+            self.pending = None
+
+    def flush(self):
+        """Write the collected lines to the file."""
+
+        self.file.writelines(self.lines)
+        self.lines = []
+
+    def close(self):
+        """Finish the document; every element must have been closed."""
+
+        if self.open:
+            raise ValueError(f'Elements left open: {", ".join(self.open)}.')
+
+        self.flush()